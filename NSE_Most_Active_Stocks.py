@@ -3,13 +3,16 @@ import logging
 import os
 import random
 import time
-from datetime import datetime, timedelta, time as dt_time
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 import requests
 from zoneinfo import ZoneInfo
 
+from market_calendar import MARKET_CLOSE_IST, MarketCalendar, wait_until_open
+
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,11 +30,24 @@ BLOCK_HOURS = 2.0          # a symbol's cache entry lives this long
 RENOTIFY_DIFF_PCT = 3.0    # min move needed to re-alert while still cached
 COOLDOWN_MINUTES = 30      # hard block applied after a re-alert
 
+# Selection: "threshold" only keeps rows outside the dead zone and orders
+# that subset; "sort" ranks every row (the old behaviour, used for tables).
+SELECTION_MODE = "threshold"
+TELEGRAM_TOP_K = 25        # max movers listed in one batched message
+
 POLL_MIN_SECONDS = 12
 POLL_MAX_SECONDS = 22
 
+# Adaptive polling: the sleep between polls moves between these bounds
+# depending on how active the last snapshot was (see PollScheduler).
+ADAPTIVE_POLLING = True
+POLL_FLOOR_SECONDS = 12    # busiest market (the old fixed minimum)
+POLL_CEIL_SECONDS = 45     # quietest market
+NEAR_THRESHOLD_PCT = 0.5   # |pChange| this close to a threshold = "approaching"
+MOVE_REF_PCT = 0.25        # mean |ΔpChange| per poll treated as fully active
+ACTIVE_SYMBOLS_REF = 10    # crossings (+ weighted near-misses) treated as fully active
+
 IST_ZONE = ZoneInfo("Asia/Kolkata")
-MARKET_CLOSE_IST = dt_time(15, 30)
 
 # Where alert state is persisted. On GitHub Actions this file needs to be
 # committed back to the repo (or restored from cache) between runs, or the
@@ -51,6 +67,7 @@ class NSEMarketMonitor:
     API_URL = "https://www.nseindia.com/api/live-analysis-most-active-securities"
 
     RANK_BY = "value"  # "value" or "volume"
+    SELECTION_MODE = SELECTION_MODE
 
     MARKET_CLOSE_IST = MARKET_CLOSE_IST
     IST_ZONE = IST_ZONE
@@ -64,11 +81,22 @@ class NSEMarketMonitor:
         "ICICIBANK", "BHARTIARTL", "TCS", "INFY", "LT", "WIPRO", "ETERNAL"
     }
 
-    def __init__(self):
+    def __init__(self, base_url: Optional[str] = None):
         if self.RANK_BY not in {"value", "volume"}:
             raise ValueError("RANK_BY must be 'value' or 'volume'.")
+        if self.SELECTION_MODE not in {"threshold", "sort"}:
+            raise ValueError("SELECTION_MODE must be 'threshold' or 'sort'.")
 
         self.exclude_symbols = {x.upper() for x in self.EXCLUDE_SYMBOLS}
+        self.last_rows: List[Dict[str, Any]] = []  # every row of the last poll
+
+        # Point the monitor at another host (e.g. nse_api_standin.py) while
+        # keeping the same paths as nseindia.com.
+        if base_url:
+            base_url = base_url.rstrip("/")
+            self.REFERER_URL = self.REFERER_URL.replace(self.BASE_URL, base_url)
+            self.API_URL = self.API_URL.replace(self.BASE_URL, base_url)
+            self.BASE_URL = base_url
 
         self.session = requests.Session()
         self.session.headers.update({
@@ -142,19 +170,37 @@ class NSEMarketMonitor:
         except Exception:
             return 0.0
 
-    def _sort_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _rank_key(self, row: Dict[str, Any]):
         primary = "pChange" if self.RANK_BY == "value" else "pChange"
         secondary = "totalTradedValue" if self.RANK_BY == "value" else "totalTradedVolume"
+        return (
+            self._safe_float(row.get(primary)),
+            self._safe_float(row.get(secondary)),
+            self._safe_float(row.get("lastPrice"))
+        )
 
-        return sorted(
-            rows,
-            key=lambda r: (
-                self._safe_float(r.get(primary)),
-                self._safe_float(r.get(secondary)),
-                self._safe_float(r.get("lastPrice"))
-            ),
-            reverse=True
+    def _sort_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return sorted(rows, key=self._rank_key, reverse=True)
+
+    def _select_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Keep only rows outside the BUY/SELL dead zone and rank that subset.
+
+        The dead-zone test uses the same 2dp rounding as build_table_rows,
+        so nothing the AlertEngine would act on is dropped here.
+        """
+        qualifying = []
+        for row in rows:
+            change = round(self._safe_float(row.get("pChange")), 2)
+            if not SELL_THRESHOLD <= change <= BUY_THRESHOLD:
+                qualifying.append(row)
+
+        logger.info(
+            "Rows outside dead zone: total=%s qualifying=%s",
+            len(rows),
+            len(qualifying)
         )
+        return self._sort_rows(qualifying)
 
     def _filter_excluded(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         filtered = [
@@ -169,17 +215,28 @@ class NSEMarketMonitor:
         )
         return filtered
 
-    def get_all_stocks(self) -> List[Dict[str, Any]]:
-        """Fetch, rank, and return every stock except the excluded symbols."""
+    def get_all_stocks(self, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch, rank, and return stocks except the excluded symbols.
+
+        mode="threshold" (default) returns only rows outside the dead zone;
+        mode="sort" returns every row, fully ranked.
+        """
+        mode = mode or self.SELECTION_MODE
+        self.last_rows = []
         rows = self._fetch_rows()
         if not rows:
             return []
 
-        ranked = self._sort_rows(rows)
-        filtered = self._filter_excluded(ranked)
+        filtered = self._filter_excluded(rows)
+        self.last_rows = filtered
+        if mode == "sort":
+            ranked = self._sort_rows(filtered)
+        else:
+            ranked = self._select_rows(filtered)
 
-        logger.info("Stocks after exclusion filter: %s", len(filtered))
-        return filtered
+        logger.info("Stocks after exclusion filter: %s", len(ranked))
+        return ranked
 
     def build_table_rows(self, stocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Flatten raw API rows into plain values ready for tabular display."""
@@ -193,9 +250,16 @@ class NSEMarketMonitor:
             })
         return table_rows
 
-    def build_dataframe(self, stocks: List[Dict[str, Any]]):
-        """Return a pandas DataFrame - renders as a clean table in Colab."""
+    def build_dataframe(self, stocks: List[Dict[str, Any]], full_sort: bool = False):
+        """
+        Return a pandas DataFrame - renders as a clean table in Colab.
+
+        Pass full_sort=True (with stocks from get_all_stocks(mode="sort"))
+        to rank every row instead of keeping the order given.
+        """
         import pandas as pd
+        if full_sort:
+            stocks = self._sort_rows(stocks)
         return pd.DataFrame(self.build_table_rows(stocks))
 
 
@@ -233,11 +297,30 @@ class AlertState:
             "notified_at": iso str,       # when last notified
             "cooldown_until": iso str|None  # 30-min hard block, if any
         }
+
+    In memory the records are held column-wise in NumPy arrays indexed by a
+    per-symbol slot (times as epoch seconds, NaN = unset), so AlertEngine
+    can evaluate a whole poll at once. The JSON file keeps the format above.
     """
 
-    def __init__(self, path: Path = STATE_FILE):
+    def __init__(self, path: Path = STATE_FILE, capacity: int = 1024):
         self.path = path
-        self.data: Dict[str, Dict[str, Any]] = self._load()
+        self.index: Dict[str, int] = {}
+        self.symbols: List[str] = []
+        self.change = np.full(capacity, np.nan)
+        self.notified_at = np.full(capacity, np.nan)
+        self.cooldown_until = np.full(capacity, np.nan)
+        for symbol, entry in self._load().items():
+            try:
+                cooldown = entry.get("cooldown_until")
+                self.set(
+                    symbol,
+                    float(entry["change"]),
+                    datetime.fromisoformat(entry["notified_at"]),
+                    datetime.fromisoformat(cooldown) if cooldown else None,
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning("Dropping bad state entry for %s: %s", symbol, e)
 
     def _load(self) -> Dict[str, Dict[str, Any]]:
         if self.path.exists():
@@ -248,6 +331,18 @@ class AlertState:
                 logger.warning("Could not read state file (%s), starting fresh: %s", self.path, e)
         return {}
 
+    @staticmethod
+    def _iso(ts: float) -> Optional[str]:
+        return None if np.isnan(ts) else datetime.fromtimestamp(ts, tz=IST_ZONE).isoformat()
+
+    @property
+    def data(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            symbol: self.get(symbol)
+            for symbol in self.symbols
+            if not np.isnan(self.notified_at[self.index[symbol]])
+        }
+
     def save(self) -> None:
         try:
             with open(self.path, "w") as f:
@@ -255,16 +350,46 @@ class AlertState:
         except OSError as e:
             logger.error("Failed to save state file: %s", e)
 
+    def _grow(self, needed: int) -> None:
+        size = len(self.change)
+        if needed <= size:
+            return
+        new_size = max(needed, size * 2)
+        for name in ("change", "notified_at", "cooldown_until"):
+            old = getattr(self, name)
+            grown = np.full(new_size, np.nan)
+            grown[:size] = old
+            setattr(self, name, grown)
+
+    def slot(self, symbol: str) -> int:
+        """Return the array slot for `symbol`, allocating an empty one if new."""
+        slot = self.index.get(symbol)
+        if slot is None:
+            slot = len(self.symbols)
+            self._grow(slot + 1)
+            self.index[symbol] = slot
+            self.symbols.append(symbol)
+        return slot
+
+    def slots(self, symbols: List[str]) -> np.ndarray:
+        return np.fromiter((self.slot(s) for s in symbols), dtype=np.int64, count=len(symbols))
+
     def get(self, symbol: str) -> Optional[Dict[str, Any]]:
-        return self.data.get(symbol)
+        slot = self.index.get(symbol)
+        if slot is None or np.isnan(self.notified_at[slot]):
+            return None
+        return {
+            "change": float(self.change[slot]),
+            "notified_at": self._iso(self.notified_at[slot]),
+            "cooldown_until": self._iso(self.cooldown_until[slot]),
+        }
 
     def set(self, symbol: str, change: float, notified_at: datetime,
             cooldown_until: Optional[datetime]) -> None:
-        self.data[symbol] = {
-            "change": change,
-            "notified_at": notified_at.isoformat(),
-            "cooldown_until": cooldown_until.isoformat() if cooldown_until else None,
-        }
+        slot = self.slot(symbol)
+        self.change[slot] = change
+        self.notified_at[slot] = notified_at.timestamp()
+        self.cooldown_until[slot] = cooldown_until.timestamp() if cooldown_until else np.nan
 
 
 # --------------------------------------------------------------------------
@@ -282,7 +407,7 @@ class AlertEngine:
     def _parse_iso(value: Optional[str]) -> Optional[datetime]:
         return datetime.fromisoformat(value) if value else None
 
-    def evaluate(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def evaluate(self, row: Dict[str, Any], now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
         """
         Returns a small dict describing the signal if `row` should trigger
         an alert right now, else None. Mutates self.state as a side effect
@@ -296,7 +421,7 @@ class AlertEngine:
             return None
 
         signal = "BUY" if change > BUY_THRESHOLD else "SELL"
-        now = self._now()
+        now = now or self._now()
         entry = self.state.get(symbol)
 
         # 2. 30-minute cooldown -> ignore
@@ -327,11 +452,100 @@ class AlertEngine:
         self.state.set(symbol, change, now, cooldown_until=cooldown_until)
         return {"signal": signal, "row": row, "first": False}
 
+    def evaluate_batch(self, rows: List[Dict[str, Any]],
+                       now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Same flowchart as evaluate(), applied to every row of a poll at once
+        with array ops over AlertState's columns. Returns the alerts in row
+        order. A symbol repeated within `rows` has its later copies run
+        through evaluate() afterwards, so they see the state the first copy
+        left behind, exactly as a per-row loop would.
+        """
+        if not rows:
+            return []
+
+        now = now or self._now()
+        ts = now.timestamp()
+        state = self.state
+
+        changes = np.fromiter((r["Change %"] for r in rows), dtype=np.float64, count=len(rows))
+
+        # 1. Dead zone -> ignore
+        outside = np.flatnonzero((changes < SELL_THRESHOLD) | (changes > BUY_THRESHOLD))
+        if not len(outside):
+            return []
+
+        seen = set()
+        batch_idx, repeats = [], []
+        for i in outside.tolist():
+            symbol = rows[i]["Symbol"]
+            (repeats if symbol in seen else batch_idx).append(i)
+            seen.add(symbol)
+
+        idx = np.asarray(batch_idx, dtype=np.int64)
+        slots = state.slots([rows[i]["Symbol"] for i in batch_idx])
+        change = changes[idx]
+
+        # 2. 30-minute cooldown (NaN compares False, i.e. no cooldown)
+        in_cooldown = state.cooldown_until[slots] > ts
+
+        # 3. 2-hour cache expiry
+        notified_at = state.notified_at[slots]
+        cached = ~np.isnan(notified_at) & (ts - notified_at < BLOCK_HOURS * 3600)
+
+        # 4. Not cached -> first notification; 5. cached -> >=3% move re-alerts
+        first = ~in_cooldown & ~cached
+        diff = np.abs(change - state.change[slots])
+        realert = ~in_cooldown & cached & (diff >= RENOTIFY_DIFF_PCT)
+
+        # The per-symbol skip lines evaluate() logs, in row order, for the rows the masks skipped.
+        skipped = np.flatnonzero(in_cooldown | (cached & ~realert))
+        cooldown_until = state.cooldown_until[slots]
+        for k in skipped.tolist():
+            symbol = rows[batch_idx[k]]["Symbol"]
+            if in_cooldown[k]:
+                logger.info("%s in 30-min cooldown until %s, skipping",
+                            symbol, datetime.fromtimestamp(cooldown_until[k], tz=IST_ZONE))
+            else:
+                logger.info("%s cached, diff %.2f%% < %.1f%%, skipping", symbol, diff[k], RENOTIFY_DIFF_PCT)
+
+        fire = first | realert
+        fire_slots = slots[fire]
+        state.change[fire_slots] = change[fire]
+        state.notified_at[fire_slots] = ts
+        state.cooldown_until[slots[first]] = np.nan
+        state.cooldown_until[slots[realert]] = ts + COOLDOWN_MINUTES * 60
+
+        logger.info(
+            "Batch evaluated %s row(s): outside=%s cooldown=%s first=%s re-alert=%s",
+            len(rows), len(outside), int(in_cooldown.sum()), int(first.sum()), int(realert.sum())
+        )
+
+        alerts = {}
+        for i, is_first in zip(idx[fire].tolist(), first[fire].tolist()):
+            alerts[i] = {
+                "signal": "BUY" if changes[i] > BUY_THRESHOLD else "SELL",
+                "row": rows[i],
+                "first": is_first,
+            }
+        for i in repeats:
+            result = self.evaluate(rows[i], now=now)
+            if result:
+                alerts[i] = result
+        return [alerts[i] for i in sorted(alerts)]
+
     @staticmethod
-    def format_batch(alerts: List[Dict[str, Any]]) -> str:
-        """Combine any number of alerts from one poll into a single message."""
+    def format_batch(alerts: List[Dict[str, Any]], top_k: int = TELEGRAM_TOP_K) -> str:
+        """
+        Combine any number of alerts from one poll into a single message.
+        The top_k biggest movers (by |Change %|) get a full line; the rest
+        are named on one compact line, since evaluate_batch() has already
+        recorded every one of them as notified.
+        """
+        ranked = sorted(alerts, key=lambda a: abs(a["row"]["Change %"]), reverse=True)
+        shown, rest = ranked[:top_k], ranked[top_k:]
         lines = [f"*Signals* ({len(alerts)}) — {datetime.now(tz=IST_ZONE).strftime('%H:%M:%S')} IST"]
-        for a in alerts:
+        for a in shown:
             row = a["row"]
             tag = "🟢 BUY" if a["signal"] == "BUY" else "🔴 SELL"
             kind = "new" if a["first"] else "re-alert ≥3%"
@@ -339,52 +553,135 @@ class AlertEngine:
                 f"{tag} `{row['Symbol']}` ({kind}) — "
                 f"LTP {row['LTP']}, Chg {row['Change %']}%, Val ₹{row['Value (Cr)']}Cr"
             )
+        if rest:
+            lines.append(f"…and {len(rest)} more: " + ", ".join(
+                f"`{a['row']['Symbol']}` {a['row']['Change %']:+}%" for a in rest))
         return "\n".join(lines)
 
 
 # --------------------------------------------------------------------------
-# Entry point - loops every 12-22s until market close (15:30 IST),
+# Poll cadence
+# --------------------------------------------------------------------------
+class PollScheduler:
+    """
+    Picks the sleep before the next poll from the change rate between the
+    last two snapshots: mean |ΔpChange| across symbols, how many symbols
+    crossed a threshold and how many sit just inside one. Busy snapshots
+    pull the interval towards POLL_FLOOR_SECONDS, quiet ones towards
+    POLL_CEIL_SECONDS. Smoothed so one odd poll doesn't swing it.
+    """
+
+    def __init__(self, smoothing: float = 0.5):
+        self.smoothing = smoothing
+        self.previous: Dict[str, float] = {}
+        self.intensity: Optional[float] = None
+
+    @staticmethod
+    def _zone(change: float) -> int:
+        return 1 if change > BUY_THRESHOLD else -1 if change < SELL_THRESHOLD else 0
+
+    def observe(self, rows: List[Dict[str, Any]]) -> float:
+        """Feed one poll's raw rows; returns the smoothed activity in [0, 1]."""
+        current = {
+            str(r.get("symbol", "")).upper(): NSEMarketMonitor._safe_float(r.get("pChange"))
+            for r in rows
+        }
+
+        moves, crossings, near = [], 0, 0
+        for symbol, change in current.items():
+            if BUY_THRESHOLD - NEAR_THRESHOLD_PCT <= change <= BUY_THRESHOLD or \
+                    SELL_THRESHOLD <= change <= SELL_THRESHOLD + NEAR_THRESHOLD_PCT:
+                near += 1
+            before = self.previous.get(symbol)
+            if before is not None:
+                moves.append(abs(change - before))
+                if self._zone(change) != self._zone(before):
+                    crossings += 1
+
+        self.previous = current
+        if not moves:
+            return self.intensity or 0.0
+
+        mean_move = sum(moves) / len(moves)
+        raw = max(
+            min(1.0, mean_move / MOVE_REF_PCT),
+            min(1.0, (crossings + 0.25 * near) / ACTIVE_SYMBOLS_REF),
+        )
+        if self.intensity is None:
+            self.intensity = raw
+        else:
+            self.intensity = self.smoothing * raw + (1 - self.smoothing) * self.intensity
+
+        logger.info(
+            "Activity: mean move %.3f%% crossings=%s near=%s -> intensity %.2f",
+            mean_move, crossings, near, self.intensity
+        )
+        return self.intensity
+
+    def next_interval(self) -> float:
+        if not ADAPTIVE_POLLING or self.intensity is None:
+            return random.uniform(POLL_MIN_SECONDS, POLL_MAX_SECONDS)
+        base = POLL_CEIL_SECONDS - (POLL_CEIL_SECONDS - POLL_FLOOR_SECONDS) * self.intensity
+        # keep some jitter so requests don't land on a fixed beat
+        jittered = base * random.uniform(0.85, 1.15)
+        return min(POLL_CEIL_SECONDS, max(POLL_FLOOR_SECONDS, jittered))
+
+
+# --------------------------------------------------------------------------
+# Entry point - waits for the session to open, then loops every 12-45s
+# (adaptive) until market close (15:30 IST, or the special-session close),
 # batching every signal from a single poll into one Telegram message.
 # --------------------------------------------------------------------------
+def poll_once(monitor: NSEMarketMonitor, engine: AlertEngine,
+              send=send_telegram_message) -> List[Dict[str, Any]]:
+    """Run one fetch -> evaluate -> notify cycle and return the alerts raised."""
+    stocks = monitor.get_all_stocks()
+    if not stocks:
+        logger.info("No stocks returned this poll; nothing to check.")
+        return []
+
+    rows = monitor.build_table_rows(stocks)
+
+    alerts = engine.evaluate_batch(rows)
+    if alerts:
+        message = engine.format_batch(alerts)
+        if send(message):
+            logger.info("Sent batched alert for %s symbol(s): %s",
+                        len(alerts), [a["row"]["Symbol"] for a in alerts])
+
+    engine.state.save()
+    return alerts
+
+
 def run_until_close() -> None:
+    schedule = MarketCalendar().schedule()
+    if not wait_until_open(schedule):
+        logger.info("No NSE session left today; exiting without polling.")
+        return
+
     monitor = NSEMarketMonitor()
     monitor._warmup()
 
     state = AlertState()
     engine = AlertEngine(state)
+    scheduler = PollScheduler()
 
     poll_count = 0
-    while datetime.now(tz=IST_ZONE).time() < MARKET_CLOSE_IST:
+    while schedule.is_active():
         poll_count += 1
         try:
-            stocks = monitor.get_all_stocks()
-            if stocks:
-                rows = monitor.build_table_rows(stocks)
-
-                alerts = []
-                for row in rows:
-                    result = engine.evaluate(row)
-                    if result:
-                        alerts.append(result)
-
-                if alerts:
-                    message = engine.format_batch(alerts)
-                    if send_telegram_message(message):
-                        logger.info("Sent batched alert for %s symbol(s): %s",
-                                    len(alerts), [a["row"]["Symbol"] for a in alerts])
-
-                state.save()
-            else:
-                logger.info("No stocks returned this poll; nothing to check.")
-
+            poll_once(monitor, engine)
+            scheduler.observe(monitor.last_rows)
         except Exception as e:
             # Keep the loop alive across transient NSE/network hiccups.
             logger.error("Poll #%s failed: %s", poll_count, e)
 
-        sleep_for = random.uniform(POLL_MIN_SECONDS, POLL_MAX_SECONDS)
+        sleep_for = scheduler.next_interval()
+        logger.info("Next poll in %.1fs", sleep_for)
         time.sleep(sleep_for)
 
-    logger.info("Market closed (15:30 IST). Loop ending after %s poll(s).", poll_count)
+    logger.info("Market closed (%s IST). Loop ending after %s poll(s).",
+                schedule.stop_at.strftime("%H:%M"), poll_count)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+"""
+Micro-benchmarks for the Dhan feed hot path.
+
+Generates a synthetic session of full (code 8) packets - security ids drawn
+with a heavy-tailed activity profile, log-normal prices random-walking in
+0.05 ticks, monotonic cumulative volume, exchange time advancing with the
+tick rate, and the odd large resting order in the book - and times every
+stage a packet goes through:
+
+    decode      legacy slices vs precompiled Structs (FULL_VOLUME/DEPTH/TICK)
+    gate        FeedState slot lookup + change gate + unpack
+    window      FeedState.tick (5-minute bucket ring)
+    cooldown    FeedState.cool_down
+    depth       check_depth per packet, big_orders over NumPy batches
+    hub         FeedHub.dispatch into both analyzers, inline and timer-driven
+
+For each case it reports packets/s, ns/packet and tracemalloc's peak and
+retained allocation. Results can be saved and compared between runs:
+
+    python bench_feed.py --packets 200000 --save bench_results/base.json
+    python bench_feed.py --packets 200000 --compare bench_results/base.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("SIGNAL_AMOUNT", "100000")
+
+import dhan_feed
+import dhan_streamer_order_book
+import nse_data
+from dhan_feed_hub import FeedHub
+
+# Alerts still go through their cooldown and formatting; only the network call is skipped.
+nse_data.send_telegram = dhan_streamer_order_book.send_telegram = lambda msg: None
+
+SESSION_START = 1_760_000_000
+
+
+# --------------------------------------------------------------------------
+# Synthetic session
+# --------------------------------------------------------------------------
+def make_universe(n_securities: int, rng: random.Random):
+    sids = rng.sample(range(1, 30000), n_securities)
+    prices = [min(900.0, max(5.0, round(rng.lognormvariate(math.log(150), 0.9) / 0.05) * 0.05)) for _ in sids]
+    activity = [rng.paretovariate(1.2) for _ in sids]   # a few names carry most of the ticks
+    return sids, prices, activity
+
+
+def make_packets(n: int, n_securities: int = 1500, seed: int = 7, ticks_per_second: float = 3000.0):
+    """n full packets for a universe of n_securities; returns (packets, {sid: symbol})."""
+    rng = random.Random(seed)
+    sids, prices, activity = make_universe(n_securities, rng)
+    volume = [rng.randint(10_000, 2_000_000) for _ in sids]
+    picks = rng.choices(range(n_securities), weights=activity, k=n)
+    packets = []
+    for i, k in enumerate(picks):
+        ltp = prices[k] = min(900.0, max(5.0, round((prices[k] + rng.gauss(0, 0.1)) / 0.05) * 0.05))
+        volume[k] += int(rng.expovariate(1 / max(1.0, 20_000 / ltp)))
+        depth = []
+        for level in range(5):
+            bid_qty = int(rng.lognormvariate(math.log(2_000), 1.2))
+            ask_qty = int(rng.lognormvariate(math.log(2_000), 1.2))
+            if rng.random() < 0.0005:
+                bid_qty = int(300_000_000 / ltp)          # a big resting order
+            depth.append((bid_qty, ask_qty, rng.randint(1, 40), rng.randint(1, 40),
+                          round(ltp - 0.05 * (level + 1), 2), round(ltp + 0.05 * (level + 1), 2)))
+        packets.append(dhan_feed.encode_full(
+            sids[k], ltp, volume[k], ltt=SESSION_START + int(i / ticks_per_second), depth=depth,
+        ))
+    return packets, {sid: f"SYM{sid}" for sid in sids}
+
+
+# --------------------------------------------------------------------------
+# Decoders under test
+# --------------------------------------------------------------------------
+def legacy_volume(message):
+    sec_id = struct.unpack('<I', message[4:8])[0]
+    ltp = round(struct.unpack('<f', message[8:12])[0], 2)
+    cum_vol = struct.unpack('<I', message[22:26])[0]
+    return sec_id, ltp, cum_vol
+
+
+def legacy_depth(message):
+    sec_id = struct.unpack('<I', message[4:8])[0]
+    ltp = round(struct.unpack('<f', message[8:12])[0], 2)
+    bids, asks = [], []
+    for i in range(5):
+        off = 62 + (i * 20)
+        bq = struct.unpack('<I', message[off: off + 4])[0]
+        aq = struct.unpack('<I', message[off + 4: off + 8])[0]
+        bp = round(struct.unpack('<f', message[off + 12: off + 16])[0], 2)
+        ap = round(struct.unpack('<f', message[off + 16: off + 20])[0], 2)
+        bids.append({"qty": bq, "px": bp})
+        asks.append({"qty": aq, "px": ap})
+    max_bid = max(bids, key=lambda x: x['qty'])
+    max_ask = max(asks, key=lambda x: x['qty'])
+    return sec_id, ltp, max_bid['qty'] * max_bid['px'], max_ask['qty'] * max_ask['px']
+
+
+def struct_volume(message):
+    out = None
+    for _c, _l, _s, sec_id, ltp, _ltt, cum_vol in dhan_feed.full_packets(message, dhan_feed.FULL_VOLUME):
+        out = (sec_id, round(ltp, 2), cum_vol)
+    return out
+
+
+def struct_depth(message):
+    out = None
+    for fields in dhan_feed.full_packets(message, dhan_feed.FULL_DEPTH):
+        d = fields[5:]
+        bq, aq = d[0::6], d[1::6]
+        b = max(range(5), key=bq.__getitem__)
+        a = max(range(5), key=aq.__getitem__)
+        out = (fields[3], round(fields[4], 2), bq[b] * round(d[4 + 6 * b], 2), aq[a] * round(d[5 + 6 * a], 2))
+    return out
+
+
+def struct_tick(message):
+    return dhan_feed.full_packets(message, dhan_feed.FULL_TICK)
+
+
+def numpy_batch(frames, threshold=150_000_000):
+    packets = dhan_feed.full_packet_array(frames)
+    return dhan_feed.big_orders(packets["depth"], threshold)
+
+
+def struct_full(message):
+    return [dhan_feed.unpack_full(message, off) for _c, _s, off, _l in dhan_feed.iter_packets(message)]
+
+
+# --------------------------------------------------------------------------
+# Streaming state and analyzers
+# --------------------------------------------------------------------------
+def stateful_cases(packets, universe, batch):
+    """(name, fn, items, packets per item) for the cases that need FeedState / FeedHub."""
+    gate_state = dhan_feed.FeedState(universe, region=dhan_feed.VOLUME_REGION)
+
+    def gate(message):
+        return gate_state.full_packets(message, dhan_feed.FULL_VOLUME)
+
+    window_state = dhan_feed.FeedState(universe)
+    ticks = [(window_state.slot_of[f[3]], f[4], f[5], f[6])
+             for p in packets for f in dhan_feed.full_packets(p, dhan_feed.FULL_VOLUME)]
+
+    def window(item):
+        return window_state.tick(*item)
+
+    now = [0.0]
+
+    def cooldown(item):
+        now[0] += 0.001
+        return window_state.cool_down(item[0], now[0], 800)
+
+    depth_state = dhan_feed.FeedState(universe, window_seconds=1, region=dhan_feed.DEPTH_REGION)
+    depth_items = [(depth_state.slot_of[f[3]], round(f[4], 2), f[7:])
+                   for p in packets for f in dhan_feed.full_packets(p, dhan_feed.FULL_TICK)]
+
+    def depth_inline(item):
+        return dhan_streamer_order_book.check_depth(depth_state, *item)
+
+    inline_hub = FeedHub([nse_data.VolumeSpikeAnalyzer(0), dhan_streamer_order_book.BigOrderAnalyzer(0)],
+                         "bench", "bench", queue_frames=0, capture_dir="")
+    inline_hub.start(universe)
+
+    timer_hub = FeedHub([nse_data.VolumeSpikeAnalyzer(250), dhan_streamer_order_book.BigOrderAnalyzer(250)],
+                        "bench", "bench", queue_frames=0, capture_dir="")
+    timer_hub.start(universe)
+    # One timer pass per `batch` frames stands in for the 250 ms timer.
+    timer_batches = [packets[i:i + batch] for i in range(0, len(packets), batch)]
+
+    def timer_dispatch(frames):
+        for frame in frames:
+            timer_hub.dispatch(frame)
+        for analyzer in timer_hub.analyzers:
+            analyzer.on_timer()
+
+    return [
+        ("gate     FeedState.full_packets", gate, packets, 1),
+        ("window   FeedState.tick", window, ticks, 1),
+        ("cooldown FeedState.cool_down", cooldown, ticks, 1),
+        ("depth    check_depth inline", depth_inline, depth_items, 1),
+        ("hub      dispatch, inline analyzers", inline_hub.dispatch, packets, 1),
+        (f"hub      dispatch, timer every {batch}", timer_dispatch, timer_batches, batch),
+    ]
+
+
+# --------------------------------------------------------------------------
+# Measurement
+# --------------------------------------------------------------------------
+def time_it(fn, frames, packets_per_frame=1, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for frame in frames:
+            fn(frame)
+        best = min(best, time.perf_counter() - t0)
+    n = len(frames) * packets_per_frame
+    return n / best, best / n * 1e9
+
+
+def allocations(fn, frames, limit=20_000):
+    """tracemalloc peak and retained bytes over one pass (at most `limit` items)."""
+    frames = frames[:limit]
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for frame in frames:
+        fn(frame)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base, current - base
+
+
+def run_cases(cases, repeat=3):
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):   # alert prints
+        for name, fn, items, per_item in cases:
+            pps, ns = time_it(fn, items, per_item, repeat)
+            peak, retained = allocations(fn, items)
+            results[name] = {
+                "packets_per_sec": pps,
+                "ns_per_packet": ns,
+                "alloc_peak_kb": peak / 1024,
+                "retained_kb": retained / 1024,
+            }
+    return results
+
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    return {
+        "when": datetime.now().isoformat(timespec="seconds"),
+        "git": rev,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Dhan feed hot path")
+    parser.add_argument("--packets", type=int, default=100_000)
+    parser.add_argument("--securities", type=int, default=1500)
+    parser.add_argument("--batch", type=int, default=4, help="packets per frame for the multi-packet case")
+    parser.add_argument("--numpy-batch", type=int, default=1000, help="packets per vectorised depth / timer batch")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="earlier --save output to compare against")
+    args = parser.parse_args()
+
+    packets, universe = make_packets(args.packets, args.securities)
+
+    # Both decoders must agree before timing means anything.
+    for p in packets[:1000]:
+        assert legacy_volume(p) == struct_volume(p)
+        assert legacy_depth(p) == struct_depth(p)
+    hits = numpy_batch(packets[:5000], threshold=20_000_000)
+    expected = [i for i, p in enumerate(packets[:5000]) if max(legacy_depth(p)[2:]) >= 20_000_000]
+    assert expected and hits.rows.tolist() == expected
+
+    frames = [b"".join(packets[i:i + args.batch]) for i in range(0, len(packets), args.batch)]
+    batches = [packets[i:i + args.numpy_batch] for i in range(0, len(packets), args.numpy_batch)]
+
+    cases = [
+        ("decode   volume, legacy slices", legacy_volume, packets, 1),
+        ("decode   volume, FULL_VOLUME", struct_volume, packets, 1),
+        ("decode   depth + max, legacy slices", legacy_depth, packets, 1),
+        ("decode   depth + max, FULL_DEPTH", struct_depth, packets, 1),
+        ("decode   all fields, unpack_full", struct_full, packets, 1),
+        ("decode   FULL_TICK", struct_tick, packets, 1),
+        (f"decode   depth, {args.batch} pkts/frame", struct_depth, frames, args.batch),
+        (f"depth    big_orders, {args.numpy_batch}/batch", numpy_batch, batches, args.numpy_batch),
+    ]
+    cases += stateful_cases(packets, universe, args.numpy_batch)
+
+    results = run_cases(cases, args.repeat)
+
+    previous = {}
+    if args.compare:
+        previous = json.loads(args.compare.read_text())["results"]
+
+    print(f"{len(packets):,} packets over {len(universe):,} securities")
+    print(f"{'case':42} {'packets/s':>12} {'ns/packet':>10} {'peak KB':>9} {'kept KB':>9}"
+          + (f" {'vs base':>8}" if previous else ""))
+    for name, r in results.items():
+        line = (f"{name:42} {r['packets_per_sec']:12,.0f} {r['ns_per_packet']:10.0f} "
+                f"{r['alloc_peak_kb']:9.1f} {r['retained_kb']:9.1f}")
+        if name in previous:
+            line += f" {previous[name]['ns_per_packet'] / r['ns_per_packet']:7.2f}x"
+        print(line)
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({
+            "environment": environment(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+            "results": results,
+        }, indent=2))
+        print(f"Saved to {args.save}", file=sys.stderr)
@@ -0,0 +1,114 @@
+"""
+Offline benchmark for NSE_Most_Active_Stocks.py.
+
+Starts nse_api_standin.py in-process, then drives the same poll cycle that
+run_until_close() uses (poll_once) back-to-back, without the 12-22s sleep
+and without Telegram, and reports:
+
+  * poll latency (wall clock, p50/p95/max)
+  * CPU per poll on the monitor thread (excludes the stand-in's threads)
+  * alert throughput (alerts per poll / per second)
+  * failed polls (403 after re-warmup, malformed JSON, timeouts)
+
+    python bench_nse_monitor.py --polls 200 --symbols 2000 --forbid-rate 0.05
+"""
+import argparse
+import json
+import logging
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import NSE_Most_Active_Stocks as nse
+from nse_api_standin import StandinConfig, start_standin
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run_benchmark(polls: int, n_symbols: int, config: StandinConfig, seed: int = 7) -> dict:
+    server = start_standin(0, n_symbols, config, seed=seed)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    sent = {"messages": 0}
+
+    def fake_send(_text: str) -> bool:
+        sent["messages"] += 1
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor = nse.NSEMarketMonitor(base_url=base_url)
+        monitor._warmup()
+        engine = nse.AlertEngine(nse.AlertState(Path(tmp) / "state.json"))
+
+        wall, cpu, alert_counts = [], [], []
+        failures = 0
+        started = time.perf_counter()
+        for i in range(polls):
+            t0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                alerts = nse.poll_once(monitor, engine, send=fake_send)
+                alert_counts.append(len(alerts))
+            except Exception as e:
+                failures += 1
+                nse.logger.debug("Poll #%s failed: %s", i + 1, e)
+            wall.append(time.perf_counter() - t0)
+            cpu.append(time.thread_time() - c0)
+        elapsed = time.perf_counter() - started
+
+    server.shutdown()
+
+    total_alerts = sum(alert_counts)
+    return {
+        "polls": polls,
+        "symbols": n_symbols,
+        "failed_polls": failures,
+        "latency_ms_p50": percentile(wall, 50) * 1000,
+        "latency_ms_p95": percentile(wall, 95) * 1000,
+        "latency_ms_max": max(wall) * 1000 if wall else 0.0,
+        "cpu_ms_per_poll": statistics.fmean(cpu) * 1000 if cpu else 0.0,
+        "alerts_total": total_alerts,
+        "alerts_per_poll": total_alerts / max(1, len(alert_counts)),
+        "alerts_per_sec": total_alerts / elapsed if elapsed else 0.0,
+        "telegram_messages": sent["messages"],
+        "server_stats": dict(server.stats),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NSE monitor against a local stand-in")
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--forbid-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-seconds", type=float, default=0.5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    # The monitor logs every poll at INFO; that would dominate the timings.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    result = run_benchmark(args.polls, args.symbols, StandinConfig(
+        forbid_rate=args.forbid_rate,
+        slow_rate=args.slow_rate,
+        slow_seconds=args.slow_seconds,
+        malformed_rate=args.malformed_rate,
+    ))
+
+    print(f"Polls: {result['polls']} ({result['failed_polls']} failed) over {result['symbols']} symbols")
+    print(f"Latency  p50 {result['latency_ms_p50']:.1f} ms | p95 {result['latency_ms_p95']:.1f} ms | "
+          f"max {result['latency_ms_max']:.1f} ms")
+    print(f"CPU/poll {result['cpu_ms_per_poll']:.2f} ms")
+    print(f"Alerts   {result['alerts_total']} total | {result['alerts_per_poll']:.1f}/poll | "
+          f"{result['alerts_per_sec']:.1f}/s | {result['telegram_messages']} messages")
+    print(f"Server   {result['server_stats']}")
+
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
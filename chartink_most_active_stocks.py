@@ -12,13 +12,15 @@ import os
 import random
 import time
 import urllib.parse
-from datetime import datetime, timedelta, time as dt_time
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import requests
 from zoneinfo import ZoneInfo
 
+from market_calendar import MarketCalendar, wait_until_open
+
 # from your_project import Config, telegram, with_retry_call
 # from your_project import buy_payload, sell_payload
 
@@ -78,7 +80,6 @@ def with_retry_call(fn, label: str = "", fallback: Any = None,
 
 
 IST_ZONE = ZoneInfo("Asia/Kolkata")
-MARKET_CLOSE_IST = dt_time(15, 30)
 
 POLL_MIN_SECONDS = 15
 POLL_MAX_SECONDS = 30
@@ -313,11 +314,16 @@ sell_payload = {"scan_clause": '''( {1339018} (  daily volume *  daily "high+low
 # batching every signal from a single poll into one Telegram message.
 # --------------------------------------------------------------------------
 def run_until_close() -> None:
+    schedule = MarketCalendar().schedule()
+    if not wait_until_open(schedule):
+        logger.info("No NSE session left today; exiting without polling.")
+        return
+
     state = AlertState()
     engine = AlertEngine(state)
 
     poll_count = 0
-    while datetime.now(tz=IST_ZONE).time() < MARKET_CLOSE_IST:
+    while schedule.is_active():
         poll_count += 1
         try:
             signals = gather_signals()
@@ -343,7 +349,8 @@ def run_until_close() -> None:
         sleep_for = random.uniform(POLL_MIN_SECONDS, POLL_MAX_SECONDS)
         time.sleep(sleep_for)
 
-    logger.info("Market closed (15:30 IST). Loop ending after %s poll(s).", poll_count)
+    logger.info("Market closed (%s IST). Loop ending after %s poll(s).",
+                schedule.stop_at.strftime("%H:%M"), poll_count)
 
 
 if __name__ == "__main__":
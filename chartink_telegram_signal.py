@@ -18,7 +18,7 @@ Environment variables required:
 """
 
 # ===================== IMPORTS =====================
-from datetime import datetime, timedelta, time as dtime
+from datetime import datetime, timedelta
 from pathlib import Path
 import json
 import urllib.parse
@@ -31,6 +31,8 @@ import os
 import ast
 import random
 
+from market_calendar import MarketCalendar, wait_until_open
+
 # ===================== CONFIG =====================
 SIGNAL_AMOUNT = float(os.getenv("SIGNAL_AMOUNT"))
 
@@ -48,7 +50,8 @@ LOG_FILE = HOME / "stock_bot.log"
 SIGNAL_LOG_FILE = HOME / "signals.log"
 
 INDIA_TZ = pytz.timezone("Asia/Kolkata")
-NOTIFY_UNTIL = dtime(hour=15, minute=15)
+# Stop notifying 15 minutes before the close (15:15 on a normal day).
+SCHEDULE = MarketCalendar().schedule(stop_before=timedelta(minutes=15))
 
 # ===================== LOGGING =====================
 def ist_time(*_):
@@ -192,7 +195,7 @@ def main():
     log("[main] started")
     cache = load_cache()
 
-    while datetime.now(INDIA_TZ).time() < NOTIFY_UNTIL:
+    while SCHEDULE.is_active():
         cutoff = datetime.now(pytz.utc) - timedelta(minutes=10)
         cache = {k: v for k, v in cache.items() if v >= cutoff}
 
@@ -232,4 +235,5 @@ def main():
     log("[main] stopped")
 
 if __name__ == "__main__":
-    main()
+    if wait_until_open(SCHEDULE, log=log):
+        main()
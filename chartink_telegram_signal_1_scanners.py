@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from datetime import datetime, timedelta, time as dtime
+from datetime import datetime, timedelta
 from pathlib import Path
 import json
 import urllib.parse
@@ -14,6 +14,8 @@ import signal
 import threading
 import ast,os
 
+from market_calendar import MarketCalendar, wait_until_open
+
 # ============================================================
 # CONFIG
 # ============================================================
@@ -34,7 +36,8 @@ LOG_FILE   = HOME / "stock_bot.log"
 SIGNAL_LOG_FILE = HOME / "signals.log"
 
 INDIA_TZ = pytz.timezone("Asia/Kolkata")
-NOTIFY_UNTIL = dtime(hour=15, minute=15)
+# Stop notifying 15 minutes before the close (15:15 on a normal day).
+SCHEDULE = MarketCalendar().schedule(stop_before=timedelta(minutes=15))
 
 RUN_INTERVAL_SECONDS = 90 * 60   # 1 hour 30 minutes
 
@@ -221,7 +224,7 @@ def main_loop():
     try:
         while not SHUTDOWN.is_set():
             now_ist = datetime.now(INDIA_TZ)
-            if now_ist.time() >= NOTIFY_UNTIL:
+            if not SCHEDULE.is_active(now_ist):
                 break
 
             cutoff = datetime.now(pytz.utc) - timedelta(minutes=20)
@@ -264,9 +267,11 @@ def main_loop():
 
 if __name__ == "__main__":
     log("[boot] script started")
+    if not wait_until_open(SCHEDULE, log=log):
+        SHUTDOWN.set()
     
     while not SHUTDOWN.is_set():
-        if datetime.now(INDIA_TZ).time() >= NOTIFY_UNTIL:
+        if not SCHEDULE.is_active():
             break
 
         main_loop()
@@ -7,7 +7,7 @@ PythonAnywhere-friendly Chartink scanner
 - Telegram alerts with dedupe
 """
 
-from datetime import datetime, timedelta, time as dtime
+from datetime import datetime, timedelta
 from pathlib import Path
 import json
 import urllib.parse
@@ -19,6 +19,8 @@ import sys
 import random
 import os
 
+from market_calendar import MarketCalendar, wait_until_open
+
 # ---------------- CONFIG ----------------
 SIGNAL_AMOUNT = float(os.getenv("SIGNAL_AMOUNT"))
 LEVERAGE = 5
@@ -37,7 +39,8 @@ LOG_FILE = HOME / "stock_bot.txt"
 SIGNAL_LOG_FILE = HOME / "signals.log"
 
 INDIA_TZ = pytz.timezone("Asia/Kolkata")
-NOTIFY_UNTIL = dtime(hour=15, minute=15)
+# Stop notifying 15 minutes before the close (15:15 on a normal day).
+SCHEDULE = MarketCalendar().schedule(stop_before=timedelta(minutes=15))
 
 
 def parse_cookie_string_to_dict(cookie_string):
@@ -193,7 +196,7 @@ def main_loop():
 
     while True:
         now_ist = datetime.now(INDIA_TZ)
-        if now_ist.time() >= NOTIFY_UNTIL:
+        if not SCHEDULE.is_active(now_ist):
             log("[main] notify-until reached")
             break
 
@@ -283,4 +286,5 @@ def main_loop():
     log("[main] done")
 
 if __name__ == "__main__":
-    main_loop()
+    if wait_until_open(SCHEDULE, log=log):
+        main_loop()
@@ -0,0 +1,530 @@
+"""
+Shared decoder for Dhan v2 binary market-feed packets.
+
+Every packet starts with an 8-byte header:
+
+    0     feed response code  (uint8)   2=ticker 4=quote 5=OI 6=prev close 8=full 50=disconnect
+    1-2   message length      (int16)   length of this packet, header included
+    3     exchange segment    (uint8)
+    4-7   security id         (int32)
+
+A full packet (code 8, 162 bytes) then carries LTP, LTQ, LTT, ATP, volume,
+total sell/buy qty, OI (current/high/low), OHLC and five levels of depth
+(20 bytes each: bid qty, ask qty, bid orders, ask orders, bid px, ask px).
+A quote packet (code 4, 50 bytes) has the same LTP, LTQ, LTT, ATP and
+volume at bytes 8..26, then total sell/buy qty and OHLC, and no depth.
+
+The Struct objects below are compiled once and read straight out of the
+received frame (bytes or memoryview) with unpack_from(), so no intermediate
+slices are copied. One websocket frame may hold several packets back to
+back; iter_packets()/full_packets() walk them using the header's length
+field.
+"""
+import struct
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+
+TICKER = 2
+QUOTE = 4
+OI = 5
+PREV_CLOSE = 6
+FULL = 8
+DISCONNECT = 50
+
+HEADER = struct.Struct("<BhBI")
+FULL_FIELDS = struct.Struct("<fhifIIIIIIffff")   # bytes 8..62 of a full packet
+DEPTH_LEVEL = struct.Struct("<IIHHff")           # one 20-byte depth level
+DEPTH = struct.Struct("<" + "IIHHff" * 5)        # all five levels, bytes 62..162
+
+HEADER_SIZE = HEADER.size
+DEPTH_OFFSET = HEADER_SIZE + FULL_FIELDS.size    # 62
+FULL_SIZE = DEPTH_OFFSET + DEPTH.size            # 162
+QUOTE_FIELDS = struct.Struct("<fhifIIIffff")     # bytes 8..50 of a quote packet
+QUOTE_SIZE = HEADER_SIZE + QUOTE_FIELDS.size     # 50
+
+# Fallback sizes for when the header's length field is missing or bogus.
+PACKET_SIZES = {TICKER: 16, QUOTE: QUOTE_SIZE, OI: 12, PREV_CLOSE: 16, FULL: FULL_SIZE, DISCONNECT: 10}
+
+# Header + just the fields one streamer needs, in a single unpack:
+#   FULL_VOLUME -> (code, length, segment, security_id, ltp, ltt, volume)
+#   FULL_DEPTH  -> (code, length, segment, security_id, ltp,
+#                   (bid_qty, ask_qty, bid_orders, ask_orders, bid_px, ask_px) * 5)
+#   FULL_TICK   -> (code, length, segment, security_id, ltp, ltt, volume,
+#                   (bid_qty, ask_qty, bid_orders, ask_orders, bid_px, ask_px) * 5)
+FULL_VOLUME = struct.Struct("<BhBIf2xi4xI")
+FULL_DEPTH = struct.Struct("<BhBIf50x" + "IIHHff" * 5)
+FULL_TICK = struct.Struct("<BhBIf2xi4xI36x" + "IIHHff" * 5)
+# A quote packet has the same LTP/LTQ/LTT/ATP/volume layout up to byte 26.
+QUOTE_VOLUME = FULL_VOLUME
+
+# The same layouts as NumPy structured dtypes, for viewing one packet's depth
+# block (or a whole batch of full packets) as arrays without copying.
+DEPTH_DTYPE = np.dtype([
+    ("bid_qty", "<u4"), ("ask_qty", "<u4"),
+    ("bid_orders", "<u2"), ("ask_orders", "<u2"),
+    ("bid_px", "<f4"), ("ask_px", "<f4"),
+])
+FULL_DTYPE = np.dtype([
+    ("code", "u1"), ("length", "<i2"), ("segment", "u1"), ("security_id", "<u4"),
+    ("ltp", "<f4"), ("ltq", "<i2"), ("ltt", "<i4"), ("atp", "<f4"), ("volume", "<u4"),
+    ("total_sell_qty", "<u4"), ("total_buy_qty", "<u4"),
+    ("oi", "<u4"), ("oi_high", "<u4"), ("oi_low", "<u4"),
+    ("open", "<f4"), ("close", "<f4"), ("high", "<f4"), ("low", "<f4"),
+    ("depth", DEPTH_DTYPE, (5,)),
+])
+assert DEPTH_DTYPE.itemsize * 5 == DEPTH.size and FULL_DTYPE.itemsize == FULL_SIZE == FULL_TICK.size
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class FullPacket(NamedTuple):
+    security_id: int
+    ltp: float
+    ltq: int
+    ltt: int
+    atp: float
+    volume: int
+    total_sell_qty: int
+    total_buy_qty: int
+    oi: int
+    oi_high: int
+    oi_low: int
+    open: float
+    close: float
+    high: float
+    low: float
+
+
+def iter_packets(frame: Buffer) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Yield (code, security_id, offset, length) for every packet in a frame.
+    Stops at the first truncated or unrecognisable packet.
+    """
+    end = len(frame)
+    off = 0
+    while off + HEADER_SIZE <= end:
+        code, length, _segment, sec_id = HEADER.unpack_from(frame, off)
+        if length < HEADER_SIZE:
+            length = PACKET_SIZES.get(code, 0)
+            if not length:
+                return
+        if off + length > end:
+            return
+        yield code, sec_id, off, length
+        off += length
+
+
+def unpack_full(buf: Buffer, off: int = 0) -> FullPacket:
+    sec_id = HEADER.unpack_from(buf, off)[3]
+    return FullPacket(sec_id, *FULL_FIELDS.unpack_from(buf, off + HEADER_SIZE))
+
+
+def full_packets(frame: Buffer, layout: struct.Struct = FULL_VOLUME) -> List[Tuple]:
+    """
+    Unpack every full packet in `frame` with `layout` (a Struct that starts
+    with the header, e.g. FULL_VOLUME or FULL_DEPTH): one unpack_from call
+    per packet. Other packet types are skipped.
+    """
+    out = []
+    end = len(frame)
+    size = layout.size
+    off = 0
+    while off + HEADER_SIZE <= end:
+        if off + size <= end:
+            fields = layout.unpack_from(frame, off)
+            code, length = fields[0], fields[1]
+        else:
+            fields = None
+            code, length = HEADER.unpack_from(frame, off)[:2]
+        if length < HEADER_SIZE:
+            length = PACKET_SIZES.get(code, 0)
+            if not length:
+                break
+        if off + length > end:
+            break
+        if code == FULL and fields is not None and length >= size:
+            out.append(fields)
+        off += length
+    return out
+
+
+def readonly_view(frame: Buffer) -> memoryview:
+    """memoryview of `frame`, copied if need be so the packet views handed to analyzers are read-only."""
+    view = memoryview(frame)
+    return view if view.readonly else memoryview(bytes(frame))
+
+
+def unpack_depth(buf: Buffer, off: int = 0) -> Tuple:
+    """
+    Flat tuple of all five depth levels of a full packet:
+    (bid_qty, ask_qty, bid_orders, ask_orders, bid_px, ask_px) * 5.
+    Level i starts at index i * 6.
+    """
+    return DEPTH.unpack_from(buf, off + DEPTH_OFFSET)
+
+
+# Byte ranges (from packet start) FeedState can gate on.
+VOLUME_REGION = (8, 26)                  # LTP, LTQ, LTT, ATP, cumulative volume
+DEPTH_REGION = (DEPTH_OFFSET, FULL_SIZE)  # the five depth levels
+
+
+class FeedState:
+    """
+    Streaming state for every subscribed instrument, held column-wise in
+    preallocated NumPy arrays indexed by a dense slot handed out at
+    subscription time. The receive path does one dict lookup (security id
+    -> slot) per packet; the rest is array indexing, and a scan over the
+    whole universe is one expression over a column.
+
+        ltp, ltt, cum_vol      last tick seen (cum_vol is the running max)
+        cum_value              traded value (volume increase x LTP) summed
+                               over every tick since the first
+        cooldown_until         epoch seconds until which no new alert fires,
+                               one per cooldown (e.g. one per spike window)
+        opening                the traded-value prefix sums: a ring of
+                               window/bucket + 1 time buckets per slot, each
+                               holding cum_value as of the first tick at or
+                               after the start of that bucket. The value
+                               traded over any window up to window_seconds
+                               is cum_value minus one ring entry.
+        first_bucket/last_bucket  bucket numbers of the first and latest tick
+        gap_bucket             bucket of the first tick after the latest
+                               gap (rebase()); windows reaching back past
+                               it miss the volume traded in the gap
+        dirty                  set by tick()/capture(), cleared by take_dirty()
+        packets                (keep_packets=True) latest raw full packet
+
+    Per-packet reads and writes go through flat memoryviews of the columns,
+    which index at list speed rather than paying NumPy's per-scalar cost.
+
+    Full packets whose `region` bytes equal the previous packet's for that
+    slot are dropped before unpacking: Dhan re-sends full packets with
+    nothing new in them. The previous bytes are kept per slot in
+    last_region (a list of bytes, local to the process).
+    """
+
+    COLUMNS = (
+        ("ltp", np.float64, 0.0),
+        ("ltt", np.int64, 0),
+        ("cum_vol", np.int64, 0),
+        ("cum_value", np.float64, 0.0),
+        ("first_bucket", np.int64, -1),
+        ("last_bucket", np.int64, -1),
+        ("gap_bucket", np.int64, -1),
+        ("dirty", np.bool_, False),            # updated since the last take_dirty()
+    )
+
+    def __init__(self, instruments: Mapping[int, str], window_seconds: int = 300,
+                 bucket_seconds: int = 1, region: Tuple[int, int] = VOLUME_REGION,
+                 keep_packets: bool = False, cooldowns: int = 1):
+        self.bucket_seconds = bucket_seconds
+        self.span = max(1, window_seconds // bucket_seconds)
+        self.cooldowns = cooldowns
+        self.region = region
+        self.slot_of: Dict[int, int] = {}
+        self.security_ids: List[int] = []
+        self.symbols: List[str] = []
+        self.seen = 0
+        self.skipped = 0
+        self.last_region: List[bytes] = []     # gated bytes of each slot's last packet
+
+        # (name, dtype, fill, per-slot shape)
+        self.columns = [(name, dtype, fill, ()) for name, dtype, fill in self.COLUMNS]
+        self.columns.append(("cooldown_until", np.float64, 0.0, (cooldowns,)))
+        self.columns.append(("opening", np.float64, 0.0, (self.span + 1,)))
+        if keep_packets:
+            # Latest raw full packet per slot, for timer-driven evaluation.
+            self.columns.append(("packets", FULL_DTYPE, 0, ()))
+
+        self.capacity = max(1, len(instruments))
+        for name, dtype, fill, row in self.columns:
+            setattr(self, name, self._alloc(name, (self.capacity,) + row, dtype, fill))
+        self._bind()
+
+        for sec_id, symbol in instruments.items():
+            self.assign(sec_id, symbol)
+
+    def _alloc(self, name: str, shape: Tuple[int, ...], dtype, fill) -> np.ndarray:
+        """Allocate one column; override to place the columns somewhere else."""
+        column = np.zeros(shape, dtype=dtype)
+        if fill:
+            column.fill(fill)
+        return column
+
+    def _bind(self) -> None:
+        # Flat memoryview per column; raw packets are viewed as bytes.
+        for name, dtype, _fill, _row in self.columns:
+            column = getattr(self, name)
+            flat = column.view(np.uint8) if np.dtype(dtype).names else column
+            setattr(self, "_" + name, memoryview(flat.reshape(-1)))
+
+    def _grow(self) -> None:
+        old, self.capacity = self.capacity, self.capacity * 2
+        for name, dtype, fill, row in self.columns:
+            column = self._alloc(name, (self.capacity,) + row, dtype, fill)
+            column[:old] = getattr(self, name)
+            setattr(self, name, column)
+        self._bind()
+
+    def __len__(self) -> int:
+        return len(self.security_ids)
+
+    def assign(self, sec_id: int, symbol: Optional[str] = None) -> int:
+        """Slot for `sec_id`, handing out the next free one if it is new."""
+        sec_id = int(sec_id)
+        slot = self.slot_of.get(sec_id)
+        if slot is None:
+            slot = len(self.security_ids)
+            if slot == self.capacity:
+                self._grow()
+            self.slot_of[sec_id] = slot
+            self.security_ids.append(sec_id)
+            self.symbols.append(symbol or f"ID:{sec_id}")
+            self.last_region.append(b"")
+        return slot
+
+    # ---- receive path ------------------------------------------------------
+    def changed(self, view: memoryview, off: int, slot: int, length: int = 0) -> bool:
+        """
+        False if the gated bytes of the packet at `off` match the last packet
+        for `slot`. A `length` shorter than the region (a quote packet against
+        a full-packet region) gates on the packet's own bytes only.
+        """
+        self.seen += 1
+        start, end = self.region
+        if length and length < end:
+            end = length
+        # One copy and a memcmp: about what hashing the slice cost, without collisions.
+        current = bytes(view[off + start: off + end])
+        if self.last_region[slot] == current:
+            self.skipped += 1
+            return False
+        self.last_region[slot] = current
+        return True
+
+    def full_packets(self, frame: Buffer, layout: struct.Struct = FULL_VOLUME) -> List[Tuple[int, Tuple]]:
+        """
+        (slot, fields) for every full packet in `frame` that belongs to a
+        subscribed instrument and changed since its last packet, `fields`
+        being `layout` unpacked (see full_packets()).
+        """
+        out = []
+        view = readonly_view(frame)
+        size = layout.size
+        slot_of = self.slot_of
+        for code, sec_id, off, length in iter_packets(view):
+            if code != FULL or length < size:
+                continue
+            slot = slot_of.get(sec_id)
+            if slot is not None and self.changed(view, off, slot):
+                out.append((slot, layout.unpack_from(view, off)))
+        return out
+
+    def capture(self, frame: Buffer) -> int:
+        """
+        Copy every changed full packet in `frame` into its slot's row of
+        `packets` (keep_packets=True) and mark the slot dirty; nothing is
+        unpacked. Returns the number of packets stored.
+        """
+        stored = 0
+        view = readonly_view(frame)
+        slot_of = self.slot_of
+        packets, dirty = self._packets, self._dirty
+        for code, sec_id, off, length in iter_packets(view):
+            if code != FULL or length < FULL_SIZE:
+                continue
+            slot = slot_of.get(sec_id)
+            if slot is not None and self.changed(view, off, slot):
+                start = slot * FULL_SIZE
+                packets[start:start + FULL_SIZE] = view[off:off + FULL_SIZE]
+                dirty[slot] = True
+                stored += 1
+        return stored
+
+    def store(self, slot: int, packet: memoryview) -> None:
+        """capture() for one full packet already split out of its frame."""
+        start = slot * FULL_SIZE
+        self._packets[start:start + FULL_SIZE] = packet[:FULL_SIZE]
+        self._dirty[slot] = True
+
+    def tick(self, slot: int, ltp: float, ltt: int, cum_vol: int) -> float:
+        """
+        Record a tick; returns the value traded over the window ending at
+        it. Buckets with no ticks are back-filled when the next tick
+        arrives, so the start of any window is a direct lookup.
+        """
+        self._ltp[slot] = ltp
+        self._ltt[slot] = ltt
+        self._dirty[slot] = True
+        size = self.span + 1
+        base = slot * size
+        opening = self._opening
+        value = self._cum_value[slot]
+        volume = self._cum_vol[slot]
+        last = self._last_bucket[slot]
+        if last < 0 or volume < 0:
+            # The first tick (or the first after rebase()) only sets the
+            # baseline: the day's volume so far is not a spike.
+            if last >= 0:
+                self._gap_bucket[slot] = ltt // self.bucket_seconds
+            self._cum_vol[slot] = cum_vol
+        elif cum_vol > volume:
+            value += (cum_vol - volume) * ltp
+            self._cum_value[slot] = value
+            self._cum_vol[slot] = cum_vol
+
+        bucket = ltt // self.bucket_seconds
+        if last < 0:
+            self._first_bucket[slot] = self._last_bucket[slot] = last = bucket
+            opening[base + bucket % size] = value
+        elif bucket > last:
+            # This tick is the first one at or after every bucket since the last tick.
+            for b in range(max(last + 1, bucket - self.span), bucket + 1):
+                opening[base + b % size] = value
+            self._last_bucket[slot] = last = bucket
+
+        oldest = max(self._first_bucket[slot], last - self.span)
+        return value - opening[base + oldest % size]
+
+    def traded_value(self, slot: int, seconds: int) -> float:
+        """Value traded over the last `seconds` (at most window_seconds) ending at the latest tick."""
+        last = self._last_bucket[slot]
+        if last < 0:
+            return 0.0
+        size = self.span + 1
+        oldest = max(self._first_bucket[slot], last - min(self.span, seconds // self.bucket_seconds))
+        return self._cum_value[slot] - self._opening[slot * size + oldest % size]
+
+    def rebase(self, slots: Optional[Iterable[int]] = None) -> None:
+        """
+        Make the next tick of each of `slots` (default all) only reset its
+        volume baseline, keeping the windows and cooldowns: after a restore
+        or a gap, the volume traded while nothing was received must not
+        count as one tick. That tick is recorded as the end of a gap.
+        """
+        if slots is None:
+            self.cum_vol[:len(self)] = -1
+        else:
+            self.cum_vol[np.fromiter(slots, dtype=np.int64)] = -1
+
+    def incomplete(self, slot: int, seconds: int) -> bool:
+        """True if the window of `seconds` ending at the latest tick spans a gap (see rebase())."""
+        gap = self._gap_bucket[slot]
+        return gap >= 0 and gap > self._last_bucket[slot] - seconds // self.bucket_seconds
+
+    def cool_down(self, slot: int, now: float, seconds: float, which: int = 0) -> bool:
+        """True (and start a new cooldown) unless `slot` is still cooling down on cooldown `which`."""
+        i = slot * self.cooldowns + which
+        if now <= self._cooldown_until[i]:
+            return False
+        self._cooldown_until[i] = now + seconds
+        return True
+
+    # ---- whole-universe scans ----------------------------------------------
+    def take_dirty(self) -> np.ndarray:
+        """Slots updated since the last call, clearing their dirty flag."""
+        slots = np.flatnonzero(self.dirty[:len(self)])
+        self.dirty[slots] = False
+        return slots
+
+    def window_values(self, slots: np.ndarray, seconds: Optional[int] = None) -> np.ndarray:
+        """traded_value() for each of `slots` (window_seconds if `seconds` is None)."""
+        span = self.span if seconds is None else min(self.span, seconds // self.bucket_seconds)
+        last = self.last_bucket[slots]
+        oldest = np.maximum(self.first_bucket[slots], last - span)
+        values = self.cum_value[slots] - self.opening[slots, oldest % (self.span + 1)]
+        return np.where(last < 0, 0.0, values)
+
+    def cool_down_many(self, slots: np.ndarray, now: float, seconds: float, which: int = 0) -> np.ndarray:
+        """cool_down() for each of `slots`; returns the ones that were not cooling down."""
+        ready = slots[self.cooldown_until[slots, which] < now]
+        self.cooldown_until[ready, which] = now + seconds
+        return ready
+
+    @property
+    def skip_ratio(self) -> float:
+        return self.skipped / self.seen if self.seen else 0.0
+
+    def describe(self) -> str:
+        return f"Skipped: {self.skipped}/{self.seen} ({self.skip_ratio:.0%})"
+
+
+def depth_view(buf: Buffer, off: int = 0) -> np.ndarray:
+    """The five depth levels of the full packet at `off`, as a (5,) DEPTH_DTYPE view."""
+    return np.frombuffer(buf, dtype=DEPTH_DTYPE, count=5, offset=off + DEPTH_OFFSET)
+
+
+def full_packet_array(frames: Iterable[Buffer]) -> np.ndarray:
+    """
+    Every full packet in `frames` as one (N,) FULL_DTYPE array. Single-packet
+    frames (the common case) are joined as-is; others are split first.
+    """
+    chunks = []
+    for frame in frames:
+        if len(frame) == FULL_SIZE and frame[0] == FULL:
+            chunks.append(frame)
+            continue
+        for code, _sec_id, off, length in iter_packets(frame):
+            if code == FULL and length >= FULL_SIZE:
+                chunks.append(frame[off:off + FULL_SIZE])
+    return np.frombuffer(b"".join(chunks), dtype=FULL_DTYPE)
+
+
+class BigOrders(NamedTuple):
+    rows: np.ndarray     # index into the packet array
+    buy: np.ndarray      # True = bid side crossed the threshold
+    px: np.ndarray       # price of the largest level on that side (2dp)
+    qty: np.ndarray      # quantity of that level
+
+
+def big_orders(depth: np.ndarray, threshold: float) -> BigOrders:
+    """
+    Vectorised big-order check over an (N, 5) DEPTH_DTYPE array: on each
+    side take the level with the largest quantity (first one on ties) and
+    flag rows where qty * px reaches `threshold`. The bid side wins when
+    both sides qualify.
+    """
+    n = len(depth)
+    rows = np.arange(n)
+    b = depth["bid_qty"].argmax(axis=1)
+    a = depth["ask_qty"].argmax(axis=1)
+    bid_qty = depth["bid_qty"][rows, b].astype(np.int64)
+    ask_qty = depth["ask_qty"][rows, a].astype(np.int64)
+    bid_px = np.round(depth["bid_px"][rows, b].astype(np.float64), 2)
+    ask_px = np.round(depth["ask_px"][rows, a].astype(np.float64), 2)
+
+    buy = bid_qty * bid_px >= threshold
+    hit = np.flatnonzero(buy | (ask_qty * ask_px >= threshold))
+    buy = buy[hit]
+    return BigOrders(
+        hit,
+        buy,
+        np.where(buy, bid_px[hit], ask_px[hit]),
+        np.where(buy, bid_qty[hit], ask_qty[hit]),
+    )
+
+
+def encode_full(security_id: int, ltp: float, volume: int, ltt: int = 0, segment: int = 1,
+                depth=((0, 0, 0, 0, 0.0, 0.0),) * 5, ltq: int = 0, atp: float = 0.0,
+                total_sell_qty: int = 0, total_buy_qty: int = 0,
+                ohlc: Tuple[float, float, float, float] = (0.0, 0.0, 0.0, 0.0)) -> bytes:
+    """Build a full packet; used by the benchmarks and local stand-ins."""
+    out = bytearray(FULL_SIZE)
+    HEADER.pack_into(out, 0, FULL, FULL_SIZE, segment, security_id)
+    FULL_FIELDS.pack_into(out, HEADER_SIZE, ltp, ltq, ltt, atp, volume,
+                          total_sell_qty, total_buy_qty, 0, 0, 0, *ohlc)
+    flat = [v for level in depth for v in level]
+    DEPTH.pack_into(out, DEPTH_OFFSET, *flat)
+    return bytes(out)
+
+
+def encode_quote(security_id: int, ltp: float, volume: int, ltt: int = 0, segment: int = 1,
+                 ltq: int = 0, atp: float = 0.0, total_sell_qty: int = 0, total_buy_qty: int = 0,
+                 ohlc: Tuple[float, float, float, float] = (0.0, 0.0, 0.0, 0.0)) -> bytes:
+    """Build a quote packet; used by the local stand-in."""
+    out = bytearray(QUOTE_SIZE)
+    HEADER.pack_into(out, 0, QUOTE, QUOTE_SIZE, segment, security_id)
+    QUOTE_FIELDS.pack_into(out, HEADER_SIZE, ltp, ltq, ltt, atp, volume, total_sell_qty, total_buy_qty, *ohlc)
+    return bytes(out)
@@ -0,0 +1,903 @@
+"""
+One Dhan feed connection shared by every analyzer.
+
+nse_data.py (volume spikes) and dhan_streamer_order_book.py (big orders)
+used to build the same universe and open their own websocket for the same
+instruments. A FeedHub builds the universe once, subscribes once, decodes
+each full packet once (FULL_TICK: LTP, LTT, volume and depth in a single
+unpack) and hands it to every registered Analyzer:
+
+    python dhan_feed_hub.py                 # volume spikes + big orders
+    python nse_data.py                      # just one analyzer, same hub
+
+A large universe is sharded round-robin over several connections (Dhan
+allows 5000 instruments each, 5 per client; FEED_CONNECTIONS asks for more
+than the minimum), each with its own receive thread feeding the same
+analyzers. A receive thread only queues raw frames (FrameQueue, bounded,
+coalescing per security when full); the connection's worker thread does the
+decoding and analysis.
+
+An Analyzer owns its own per-slot FeedState (slots are the same across the
+hub and all analyzers, assigned from the universe in the same order) and
+may ask for a periodic on_timer() call for timer-driven evaluation.
+
+The heartbeat also reports feed lag (receive time vs exchange LTT), queue
+wait, decode and per-analyzer time as p50/p95/p99 (see feed_metrics.py).
+
+With FEED_QUIET_MODE=quote, quiet instruments stream quote packets and are
+moved to full mode only while they are active, and the universe is rebuilt
+every UNIVERSE_REFRESH_MINUTES without reconnecting (see
+feed_subscriptions.py). Quote packets go to Analyzer.on_quote().
+
+A dropped socket is reconnected with jittered exponential backoff and
+resubscribes its whole shard at once; analyzer state is kept. Its
+instruments' next ticks only re-baseline volume (FeedState.rebase()), so
+volume traded during the gap is not taken for a spike, and windows that
+span the gap are flagged incomplete. Reconnect-to-first-frame time and gap
+length are in the heartbeat metrics.
+
+Every analyzer's FeedState is checkpointed in the background
+(FEED_CHECKPOINT_FILE, one file per set of analyzers); a restart during the
+same session resumes from it
+instead of rebuilding the universe (see feed_checkpoint.py).
+"""
+import abc
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import pytz
+import websocket
+import websockets
+from dotenv import load_dotenv
+
+import dhan_feed
+import dhan_universe
+import feed_checkpoint
+from feed_capture import FeedRecorder
+from feed_checkpoint import FEED_CHECKPOINT_FILE, Checkpointer, checkpoint_path
+from feed_metrics import FEED_METRICS_FILE, FeedMetrics
+from feed_subscriptions import FEED_QUIET_MODE, SUBSCRIBE, SubscriptionManager
+from market_calendar import DaySchedule, MarketCalendar, wait_until_open
+
+load_dotenv()
+
+DHAN_CLIENT_ID = os.getenv("DHAN_CLIENT_ID")
+DHAN_ACCESS_TOKEN = os.getenv("DHAN_ACCESS_TOKEN")
+IST = pytz.timezone("Asia/Kolkata")
+
+FEED_URL = "wss://api-feed.dhan.co?version=2&token={token}&clientId={client_id}&authType=2"
+SUBSCRIBE_FULL = SUBSCRIBE["full"]
+SUBSCRIBE_CHUNK = 100       # Dhan accepts at most 100 instruments per subscribe message
+MAX_PER_CONNECTION = 5000   # and at most 5000 per connection
+MAX_CONNECTIONS = 5         # and at most 5 connections per client
+# 0 = as few connections as MAX_PER_CONNECTION allows; more spreads the
+# receive work of a large universe over more sockets and threads.
+FEED_CONNECTIONS = int(os.getenv("FEED_CONNECTIONS", 0))
+# Frames each connection may queue between its socket thread and its
+# decode/analyze worker (0 = decode inline on the socket thread), and what
+# to do when that fills up: "coalesce" keeps only the latest packet per
+# security, "drop_oldest" discards the oldest frames.
+FEED_QUEUE_FRAMES = int(os.getenv("FEED_QUEUE_FRAMES", 5000))
+FEED_QUEUE_POLICY = os.getenv("FEED_QUEUE_POLICY", "coalesce")
+# "asyncio": all connections on one event loop (websockets); "thread":
+# one websocket-client thread per connection.
+FEED_CLIENT = os.getenv("FEED_CLIENT", "asyncio")
+# Directory to record every raw frame to (see feed_capture.py); empty = off.
+FEED_CAPTURE_DIR = os.getenv("FEED_CAPTURE_DIR", "")
+HEARTBEAT_SECONDS = 60
+# Reconnect backoff: the n-th retry in a row waits uniform(0, min(MAX, MIN * 2**n)).
+RECONNECT_MIN_SECONDS = 1.0
+RECONNECT_MAX_SECONDS = 60.0
+CLOSE_CHECK_SECONDS = 30
+SEND_TIMEOUT_SECONDS = 10
+# The hub only drops exact re-sends; each analyzer gates on its own bytes.
+PAYLOAD_REGION = (dhan_feed.HEADER_SIZE, dhan_feed.FULL_SIZE)
+
+
+class Analyzer(abc.ABC):
+    """
+    Something a FeedHub dispatches decoded full packets to.
+
+    start() is called once the universe is known; on_packet() runs on the
+    socket thread for every full packet that changed, with `fields` laid out
+    as dhan_feed.FULL_TICK and `packet` a read-only view of its 162 bytes.
+    on_quote() does the same for quote packets: `fields` is
+    dhan_feed.QUOTE_VOLUME (the first seven FULL_TICK fields) and `packet`
+    its 50 bytes. add() hands over instruments that join the universe
+    mid-session; assign their slots in the order given, as the hub does.
+    If interval_ms > 0 the hub also calls on_timer() that often from its own
+    thread. on_packet() is the one method a subclass must define.
+
+    clock() is the time to run cooldowns on: wall time live, the capture's
+    time when FeedHub replays (FeedHub.now()).
+
+    Analyzers build their FeedState with state_factory, which feed_workers.py
+    swaps for one that places the columns in shared memory. An analyzer's
+    `state`, if it is a FeedState, is checkpointed and restored.
+    """
+
+    name = "analyzer"
+    interval_ms = 0
+    state_factory = dhan_feed.FeedState
+    clock = staticmethod(time.time)
+
+    def start(self, instruments: Mapping[int, str]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def on_packet(self, slot: int, fields: Tuple, packet: memoryview) -> None:
+        ...
+
+    def on_quote(self, slot: int, fields: Tuple, packet: memoryview) -> None:
+        pass
+
+    def add(self, instruments: Mapping[int, str]) -> None:
+        pass
+
+    def on_timer(self) -> None:
+        pass
+
+    def describe(self) -> str:
+        return ""
+
+
+def shard(sids: List[str], connections: int = 0, max_connections: int = MAX_CONNECTIONS) -> List[List[str]]:
+    """
+    Split `sids` over `connections` sockets (0 = as few as the limits
+    allow), round-robin so busy stocks spread evenly. Instruments beyond
+    max_connections * MAX_PER_CONNECTION are dropped with a warning.
+    """
+    needed = -(-len(sids) // MAX_PER_CONNECTION) or 1
+    n = max(1, min(max_connections, max(needed, connections or 1)))
+    capacity = n * MAX_PER_CONNECTION
+    if len(sids) > capacity:
+        print(f"⚠️ {len(sids)} instruments exceed {n} x {MAX_PER_CONNECTION}; dropping {len(sids) - capacity}.")
+        sids = sids[:capacity]
+    return [sids[i::n] for i in range(n) if sids[i::n]]
+
+
+def request_messages(code: int, sids: Sequence[str]) -> List[str]:
+    """Subscribe/unsubscribe request(s) with RequestCode `code` for `sids`, SUBSCRIBE_CHUNK per message."""
+    return [
+        json.dumps({
+            "RequestCode": code,
+            "InstrumentCount": len(chunk),
+            "InstrumentList": [{"ExchangeSegment": "NSE_EQ", "SecurityId": s} for s in chunk],
+        })
+        for chunk in (sids[i:i + SUBSCRIBE_CHUNK] for i in range(0, len(sids), SUBSCRIBE_CHUNK))
+    ]
+
+
+class FrameQueue:
+    """
+    Bounded hand-off of raw frames from a socket thread to one worker. put()
+    never blocks the socket: when `capacity` frames are already waiting,
+    the overflow policy shrinks the backlog first. Each frame is queued with
+    the time it was received (ns), for the hub's lag and queue-wait metrics.
+
+    "coalesce" rewrites the backlog as one frame holding only the latest
+    packet per (code, security) - full packets carry cumulative volume and
+    the whole depth book, so only intermediate ticks are lost. It costs one
+    pass over the backlog, after which there is room for `capacity` more
+    frames, so it is O(1) per put() amortised. "drop_oldest" discards the
+    oldest frame instead.
+    """
+
+    def __init__(self, capacity: int, policy: str = "coalesce"):
+        if policy not in ("coalesce", "drop_oldest"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self.frames: Deque[Tuple[int, dhan_feed.Buffer]] = deque()
+        self.ready = threading.Condition()
+        self.enqueued = 0
+        self.high_water = 0
+        self.overflows = 0
+        self.coalesced = 0     # packets replaced by a later one for the same security
+        self.dropped = 0       # frames discarded by drop_oldest
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def put(self, frame: dhan_feed.Buffer, received_ns: int = 0) -> None:
+        with self.ready:
+            if len(self.frames) >= self.capacity:
+                self.overflows += 1
+                if self.policy == "coalesce":
+                    self._coalesce()
+                else:
+                    self.frames.popleft()
+                    self.dropped += 1
+            self.frames.append((received_ns, frame))
+            self.enqueued += 1
+            if len(self.frames) > self.high_water:
+                self.high_water = len(self.frames)
+            self.ready.notify()
+
+    def _coalesce(self) -> None:
+        latest = {}
+        total = 0
+        received_ns = 0
+        for received_ns, frame in self.frames:
+            for code, sec_id, off, length in dhan_feed.iter_packets(frame):
+                latest[(code, sec_id)] = frame[off:off + length]
+                total += 1
+        self.coalesced += total - len(latest)
+        self.frames.clear()
+        if latest:
+            # Stamped with the newest frame's receive time.
+            self.frames.append((received_ns, b"".join(latest.values())))
+
+    def take(self, timeout: float = 1.0) -> List[Tuple[int, dhan_feed.Buffer]]:
+        """Everything queued so far as (received ns, frame), waiting up to `timeout` for the first."""
+        with self.ready:
+            if not self.frames:
+                self.ready.wait(timeout)
+            frames = list(self.frames)
+            self.frames.clear()
+        return frames
+
+    def describe(self) -> str:
+        return (f"q {len(self.frames)}/{self.capacity} (max {self.high_water}, "
+                f"overflows {self.overflows}, coalesced {self.coalesced}, dropped {self.dropped})")
+
+
+class Backoff:
+    """
+    Full-jitter exponential backoff: spread over [0, cap] so the shards of
+    one client (and other clients) do not reconnect in lockstep, and the
+    cap doubles per failure so a rejected client backs off. reset() once a
+    connection is streaming again.
+    """
+
+    def __init__(self, base: float = RECONNECT_MIN_SECONDS, cap: float = RECONNECT_MAX_SECONDS):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt = min(self.attempt + 1, 30)
+        return delay
+
+    def reset(self) -> None:
+        self.attempt = 0
+
+
+class FeedConnection:
+    """
+    One websocket carrying one shard of the universe. Its receive thread only
+    queues raw frames; a worker thread drains the queue and decodes/analyzes,
+    so a slow analyzer never delays socket reads.
+
+    `sids` can change while connected (subscribe/remove/change send the
+    requests on the live socket); a reconnect subscribes whatever `sids` and
+    their modes are at that moment.
+
+    Across a reconnect it tracks when the socket dropped and when it came
+    back; the first frame after that closes the gap (see resumed()).
+    """
+
+    def __init__(self, hub: "FeedHub", index: int, sids: List[str]):
+        self.hub = hub
+        self.index = index
+        self.sids = sids
+        self.ws = None
+        self.frames = 0
+        self.lock = threading.Lock()
+        # Held by whichever thread dispatches this connection's frames (see FeedHub.paused()).
+        self.dispatch_lock = hub.dispatch_lock()
+        self.backoff = Backoff()
+        self.reconnects = 0
+        self.down_ns = 0          # when the socket dropped; 0 while streaming
+        self.connected_ns = 0     # when the current socket opened; 0 once its first frame is in
+        self.rebase_ns = 0        # rebase frames received from then on (queue worker)
+        self.longest_gap = 0.0    # seconds
+        self.queue = FrameQueue(hub.queue_frames, hub.queue_policy) if hub.queue_frames else None
+
+    def subscribe_messages(self) -> List[str]:
+        """Subscribe requests for every sid, one RequestCode per mode."""
+        mode_of = self.hub.subscriptions.mode_of
+        by_mode: Dict[str, List[str]] = {}
+        with self.lock:
+            for sid in self.sids:
+                by_mode.setdefault(mode_of(sid), []).append(sid)
+        return [msg for mode, sids in by_mode.items() for msg in request_messages(SUBSCRIBE[mode], sids)]
+
+    def subscribe(self, sids: List[str], codes: List[int]) -> None:
+        """Add `sids`, each subscribed with its RequestCode in `codes`."""
+        with self.lock:
+            self.sids.extend(sids)
+        self.send(self._grouped(sids, codes))
+
+    def remove(self, sids: List[str], codes: List[int]) -> None:
+        """Drop `sids`, each unsubscribed with its RequestCode in `codes`."""
+        gone = set(sids)
+        with self.lock:
+            self.sids[:] = [sid for sid in self.sids if sid not in gone]
+        self.send(self._grouped(sids, codes))
+
+    def change(self, sids: List[str], unsubscribe: int, subscribe: int) -> None:
+        """Move `sids` to another mode: unsubscribe the old one, subscribe the new."""
+        self.send(request_messages(unsubscribe, sids) + request_messages(subscribe, sids))
+
+    @staticmethod
+    def _grouped(sids: List[str], codes: List[int]) -> List[str]:
+        by_code: Dict[int, List[str]] = {}
+        for sid, code in zip(sids, codes):
+            by_code.setdefault(code, []).append(sid)
+        return [msg for code, group in by_code.items() for msg in request_messages(code, group)]
+
+    def send(self, messages: List[str]) -> bool:
+        """
+        Send requests on the live socket from any thread. False if it is not
+        connected; the next (re)connect subscribes the current sids anyway.
+        """
+        ws = self.ws
+        if ws is None or not messages:
+            return False
+        try:
+            if self.hub.loop is None:
+                for msg in messages:
+                    ws.send(msg)
+            else:
+                asyncio.run_coroutine_threadsafe(self._send_async(ws, messages), self.hub.loop) \
+                    .result(SEND_TIMEOUT_SECONDS)
+            return True
+        except Exception as e:
+            print(f"⚠️ Socket #{self.index} request failed: {e}. Sent on reconnect.")
+            return False
+
+    @staticmethod
+    async def _send_async(ws, messages: List[str]) -> None:
+        for msg in messages:
+            await ws.send(msg)
+
+    def connected(self) -> None:
+        """The socket is open (called before subscribing)."""
+        self.connected_ns = time.time_ns()
+        if not self.down_ns:
+            return
+        self.reconnects += 1
+        if self.queue is None:
+            with self.dispatch_lock:
+                self.hub.gap(self)
+        else:
+            # Frames from before the drop may still be queued; the worker rebases at the first later one.
+            self.rebase_ns = self.connected_ns
+
+    def disconnected(self) -> None:
+        """The socket closed; a gap runs from the first drop until frames flow again."""
+        self.ws = None
+        if not self.down_ns:
+            self.down_ns = time.time_ns()
+
+    def resumed(self, received_ns: int) -> None:
+        """First frame on a new socket: stop backing off and, after a drop, measure the gap."""
+        self.backoff.reset()
+        if self.down_ns:
+            metrics = self.hub.metrics
+            metrics.resume.record((received_ns - self.connected_ns) / 1e6)
+            gap = (received_ns - self.down_ns) / 1e9
+            metrics.gap.record(gap)
+            self.longest_gap = max(self.longest_gap, gap)
+            print(f"🔁 Socket #{self.index} streaming again after a {gap:.1f}s gap "
+                  f"({(received_ns - self.connected_ns) / 1e6:.0f} ms after reconnecting)")
+            self.down_ns = 0
+        self.connected_ns = 0
+
+    def on_frame(self, message) -> None:
+        if not isinstance(message, bytes):
+            return
+        self.frames += 1
+        received_ns = time.time_ns()
+        if self.connected_ns:
+            self.resumed(received_ns)
+        if self.hub.recorder is not None:
+            self.hub.recorder.write(message, received_ns)
+        if self.queue is not None:
+            self.queue.put(message, received_ns)
+        else:
+            with self.dispatch_lock:
+                self.hub.dispatch(message, received_ns)
+
+    # ---- websocket-client (one thread per connection) ------------------------
+    def on_open(self, ws) -> None:
+        print(f"🌐 WebSocket #{self.index} Connected. Subscribing to {len(self.sids)} stocks...")
+        self.connected()
+        for msg in self.subscribe_messages():
+            ws.send(msg)
+
+    def on_message(self, ws, message) -> None:
+        self.on_frame(message)
+
+    def work(self) -> None:
+        hub = self.hub
+        waited = hub.metrics.queue
+        lock = self.dispatch_lock
+        while not hub.stopping.is_set():
+            for received_ns, frame in self.queue.take():
+                with lock:
+                    if self.rebase_ns and received_ns >= self.rebase_ns:
+                        self.rebase_ns = 0
+                        hub.gap(self)
+                    waited.record((time.time_ns() - received_ns) / 1e6)
+                    hub.dispatch(frame, received_ns)
+
+    def receive(self, schedule: DaySchedule) -> None:
+        hub = self.hub
+        url = FEED_URL.format(token=hub.access_token, client_id=hub.client_id)
+        while not hub.stopping.is_set() and schedule.is_active(include_pre_open=True):
+            try:
+                self.ws = websocket.WebSocketApp(url, on_message=self.on_message, on_open=self.on_open)
+                self.ws.run_forever()
+            except Exception as e:
+                print(f"⚠️ Socket #{self.index} error: {e}.")
+            self.disconnected()
+            delay = self.backoff.next()
+            if not hub.stopping.is_set():
+                print(f"⚠️ Socket #{self.index} closed. Reconnecting in {delay:.1f}s...")
+            hub.stopping.wait(delay)
+
+    def close(self) -> None:
+        if self.ws is not None:
+            self.ws.close()
+
+    # ---- asyncio (all connections on one event loop) -------------------------
+    async def stream(self, schedule: DaySchedule) -> None:
+        """
+        Connect, send every subscribe message back to back, then read frames
+        until stopped; reconnect with backoff whenever the socket drops.
+        """
+        hub = self.hub
+        url = FEED_URL.format(token=hub.access_token, client_id=hub.client_id)
+        while not hub.stopping.is_set() and schedule.is_active(include_pre_open=True):
+            try:
+                async with websockets.connect(url, max_size=None) as ws:
+                    self.ws = ws
+                    print(f"🌐 WebSocket #{self.index} Connected. Subscribing to {len(self.sids)} stocks...")
+                    self.connected()
+                    for msg in self.subscribe_messages():
+                        await ws.send(msg)
+                    async for message in ws:
+                        self.on_frame(message)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                print(f"⚠️ Socket #{self.index} error: {e}.")
+            except Exception as e:
+                # Anything else (a dispatch with no queue, gap(), building the
+                # subscriptions) must not end this shard's task: reconnect.
+                hub.errors += 1
+                print(f"⚠️ Socket #{self.index} failed: {e!r}.")
+            finally:
+                self.disconnected()
+            if not hub.stopping.is_set():
+                delay = self.backoff.next()
+                print(f"⚠️ Socket #{self.index} closed. Reconnecting in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+
+
+class FeedHub:
+    def __init__(self, analyzers: Iterable[Analyzer], access_token: Optional[str] = None,
+                 client_id: Optional[str] = None, connections: int = FEED_CONNECTIONS,
+                 queue_frames: int = FEED_QUEUE_FRAMES, queue_policy: str = FEED_QUEUE_POLICY,
+                 capture_dir: str = FEED_CAPTURE_DIR, quiet_mode: str = FEED_QUIET_MODE,
+                 checkpoint_file: str = FEED_CHECKPOINT_FILE, max_connections: int = MAX_CONNECTIONS):
+        self.analyzers: List[Analyzer] = list(analyzers)
+        self.access_token = access_token or DHAN_ACCESS_TOKEN
+        self.client_id = client_id or DHAN_CLIENT_ID
+        self.connections = connections
+        self.max_connections = max_connections   # this hub's share of the client's MAX_CONNECTIONS
+        self.queue_frames = queue_frames
+        self.queue_policy = queue_policy
+        self.recorder = FeedRecorder(capture_dir) if capture_dir else None
+        self.state = dhan_feed.FeedState({}, window_seconds=1, region=PAYLOAD_REGION)
+        self.sids: List[str] = []
+        self.shards: List[FeedConnection] = []
+        self.conn_of: Dict[str, FeedConnection] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping = threading.Event()
+        # One per dispatching or evaluating thread, each only ever contended
+        # by paused(): add() takes them all while new slots may grow (reallocate)
+        # every FeedState, so workers never wait on each other.
+        self._dispatch_locks: List[threading.Lock] = []
+        self.errors = 0
+        # Set by a replay to each frame's capture time (ns); 0 = wall clock.
+        self.replay_ns = 0
+        for analyzer in self.analyzers:
+            analyzer.clock = self.now
+        self.metrics = FeedMetrics(a.name for a in self.analyzers)
+        self.subscriptions = SubscriptionManager(self, quiet_mode)
+        checkpoint_file = checkpoint_path((a.name for a in self.analyzers), checkpoint_file)
+        self.checkpointer = Checkpointer(checkpoint_file, self.checkpoint_source) if checkpoint_file else None
+        # (name, bound handler) per analyzer, looked up once rather than per packet.
+        self._on_full = [(a.name, a.on_packet) for a in self.analyzers]
+        self._on_quote = [(a.name, a.on_quote) for a in self.analyzers]
+
+    # ---- setup -------------------------------------------------------------
+    def start(self, instruments: Mapping[int, str],
+              refresh: Optional[Callable[[], Mapping[int, str]]] = None,
+              subscribe: Optional[Iterable[int]] = None) -> None:
+        """
+        Assign slots for `instruments`, shard them and hand them to every
+        analyzer. `refresh` (returning a fresh universe) enables the
+        intraday universe refresh. `subscribe` limits the subscription to
+        those security ids; the rest still get slots, so processes sharing
+        state (feed_workers.py) number every instrument alike.
+        """
+        self.state = dhan_feed.FeedState(instruments, window_seconds=1, region=PAYLOAD_REGION)
+        wanted = None if subscribe is None else {int(sid) for sid in subscribe}
+        self.sids = [str(sid) for sid in self.state.security_ids if wanted is None or sid in wanted]
+        self.shards = [FeedConnection(self, i, sids) for i, sids in enumerate(shard(self.sids, self.connections, self.max_connections))]
+        self.conn_of = {sid: conn for conn in self.shards for sid in conn.sids}
+        if self.recorder is not None:
+            self.recorder.save_universe(instruments)
+        for analyzer in self.analyzers:
+            analyzer.start(instruments)
+        self.subscriptions.start(refresh)
+
+    def now(self) -> float:
+        """Seconds since the epoch: the replayed frame's capture time during a replay, else wall time."""
+        return self.replay_ns / 1e9 if self.replay_ns else time.time()
+
+    def dispatch_lock(self) -> threading.Lock:
+        """A lock for one thread that dispatches frames or runs a timer; hold it around each."""
+        lock = threading.Lock()
+        self._dispatch_locks.append(lock)
+        return lock
+
+    @contextmanager
+    def paused(self):
+        """Wait for every dispatching and timer thread to finish its current frame or pass, and hold them."""
+        locks = list(self._dispatch_locks)
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def gap(self, conn: FeedConnection) -> None:
+        """
+        `conn` is back after a drop: its instruments' next ticks re-baseline
+        volume in every analyzer. Called holding conn.dispatch_lock.
+        """
+        slot_of = self.state.slot_of
+        slots = [slot_of[int(sid)] for sid in list(conn.sids)]
+        for state in self.states().values():
+            state.rebase(slots)
+
+    def states(self) -> Dict[str, dhan_feed.FeedState]:
+        """Each analyzer's FeedState, by analyzer name."""
+        return {a.name: a.state for a in self.analyzers if isinstance(getattr(a, "state", None), dhan_feed.FeedState)}
+
+    def checkpoint_source(self):
+        return list(zip(self.state.security_ids, self.state.symbols)), self.states(), list(self.conn_of)
+
+    def add(self, instruments: Mapping[int, str]) -> None:
+        """
+        Slots for instruments joining mid-session, in the hub and every
+        analyzer (ones already known keep theirs), each assigned to the
+        connection with the most room. The caller subscribes them.
+        Dispatch is paused meanwhile, so no tick lands in a column being grown.
+        """
+        with self.paused():
+            for sec_id, symbol in instruments.items():
+                self.state.assign(sec_id, symbol)
+            for analyzer in self.analyzers:
+                analyzer.add(instruments)
+        load = {conn.index: len(conn.sids) for conn in self.shards}
+        for sec_id in instruments:
+            index = min(load, key=load.get, default=None)
+            if index is None or load[index] >= MAX_PER_CONNECTION:
+                print(f"⚠️ No connection has room for {sec_id}; not subscribing it.")
+                continue
+            load[index] += 1
+            self.conn_of[str(sec_id)] = self.shards[index]
+        self.sids = list(self.conn_of)
+        if self.recorder is not None:
+            # Slot order, so a replay assigns the same slots.
+            self.recorder.save_universe(dict(zip(self.state.security_ids, self.state.symbols)))
+
+    # ---- receive path --------------------------------------------------------
+    def dispatch(self, frame: dhan_feed.Buffer, received_ns: int = 0) -> None:
+        """
+        Decode every changed full or quote packet in `frame` once and pass
+        it to each analyzer. Called from every connection's worker (or
+        socket) thread, holding that connection's dispatch_lock; each
+        security lives on exactly one connection, so per-slot state is never
+        shared between them, and only add() (through paused()) ever waits
+        for it. `received_ns` (when the frame came off the socket) feeds the
+        lag metric; 0 skips it. LTP and cumulative volume are kept per slot
+        for the subscription tiers.
+        """
+        metrics = self.metrics
+        timed = metrics.sample()
+        started_ns = time.perf_counter_ns() if timed else 0
+        received_ms = received_ns / 1e6 - metrics.ltt_offset_ms
+        state = self.state
+        view = dhan_feed.readonly_view(frame)
+        slot_of = state.slot_of
+        last_ltp, last_ltt, last_vol = state._ltp, state._ltt, state._cum_vol
+        unpack_full = dhan_feed.FULL_TICK.unpack_from
+        unpack_quote = dhan_feed.QUOTE_VOLUME.unpack_from
+        on_full, on_quote = self._on_full, self._on_quote
+        packets = 0
+        in_analyzers = 0
+        for code, sec_id, off, length in dhan_feed.iter_packets(view):
+            if code == dhan_feed.FULL and length >= dhan_feed.FULL_SIZE:
+                size, unpack, handlers = dhan_feed.FULL_SIZE, unpack_full, on_full
+            elif code == dhan_feed.QUOTE and length >= dhan_feed.QUOTE_SIZE:
+                size, unpack, handlers = dhan_feed.QUOTE_SIZE, unpack_quote, on_quote
+            else:
+                continue
+            slot = slot_of.get(sec_id)
+            if slot is None or not state.changed(view, off, slot, size):
+                continue
+            fields = unpack(view, off)
+            ltt = fields[5]
+            if ltt > last_ltt[slot]:
+                # A new trade print: how long after the exchange stamped it did it reach us?
+                last_ltt[slot] = ltt
+                if received_ns:
+                    metrics.lag.record(received_ms - ltt * 1000)
+            last_ltp[slot] = fields[4]
+            last_vol[slot] = fields[6]
+            packet = view[off:off + size]
+            packets += 1
+            if timed:
+                in_analyzers += self._timed_packet(slot, fields, packet, handlers)
+                continue
+            for _name, handler in handlers:
+                try:
+                    handler(slot, fields, packet)
+                except Exception:
+                    self.errors += 1
+        if timed and packets:
+            elapsed_ns = time.perf_counter_ns() - started_ns
+            metrics.decode.record((elapsed_ns - in_analyzers) / packets / 1000)
+
+    def _timed_packet(self, slot: int, fields: Tuple, packet: memoryview, handlers) -> int:
+        """dispatch()'s analyzer loop with each call timed; returns the ns spent in analyzers."""
+        interval = self.metrics.interval
+        total = 0
+        for name, handler in handlers:
+            t0 = time.perf_counter_ns()
+            try:
+                handler(slot, fields, packet)
+            except Exception:
+                self.errors += 1
+            spent = time.perf_counter_ns() - t0
+            interval[name].record(spent / 1000)
+            total += spent
+        return total
+
+    # ---- background threads ------------------------------------------------
+    def _timer(self, analyzer: Analyzer) -> None:
+        lock = self.dispatch_lock()
+        while not self.stopping.wait(analyzer.interval_ms / 1000):
+            try:
+                with lock:
+                    analyzer.on_timer()
+            except Exception as e:
+                print(f"⚠️ {analyzer.name} evaluation failed: {e}")
+
+    def _heartbeat(self) -> None:
+        """Prints status every minute to keep GitHub Action logs alive."""
+        while not self.stopping.wait(HEARTBEAT_SECONDS):
+            self.beat()
+
+    def beat(self) -> None:
+        """Print the heartbeat, save the metrics snapshot and start a new metrics interval."""
+        print(self.describe())
+        if FEED_METRICS_FILE:
+            self.save_metrics(FEED_METRICS_FILE)
+        self.metrics.roll()
+
+    def save_metrics(self, path: str) -> None:
+        """Write metrics.snapshot() plus feed counters to `path` as JSON (atomically)."""
+        snapshot = self.metrics.snapshot()
+        snapshot.update(time=datetime.now(IST).isoformat(timespec="seconds"), packets=self.state.seen,
+                        skipped=self.state.skipped, errors=self.errors,
+                        frames=[conn.frames for conn in self.shards])
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(f.name, path)
+
+    def describe(self) -> str:
+        parts = [
+            f"💓 Heartbeat: {datetime.now(IST).strftime('%H:%M:%S')}",
+            f"Packets Recv: {self.state.seen}",
+            self.state.describe(),
+        ]
+        parts += [f"{a.name}: {a.describe()}" for a in self.analyzers if a.describe()]
+        timings = self.metrics.describe()
+        if timings:
+            parts.append(timings)
+        if self.errors:
+            parts.append(f"Errors: {self.errors}")
+        parts.append(f"Monitoring: {len(self.sids)} over {len(self.shards)} conn "
+                     f"({'/'.join(str(s.frames) for s in self.shards)} frames)")
+        reconnects = sum(s.reconnects for s in self.shards)
+        if reconnects:
+            down = [f"#{s.index}" for s in self.shards if s.down_ns and not self.stopping.is_set()]
+            parts.append(f"Reconnects: {reconnects} (longest gap {max(s.longest_gap for s in self.shards):.1f}s"
+                         + (f", down: {' '.join(down)})" if down else ")"))
+        parts += [f"#{s.index} {s.queue.describe()}" for s in self.shards if s.queue is not None]
+        tiers = self.subscriptions.describe()
+        if tiers:
+            parts.append(tiers)
+        if self.checkpointer is not None and self.checkpointer.describe():
+            parts.append(self.checkpointer.describe())
+        if self.recorder is not None:
+            parts.append(self.recorder.describe())
+        return " | ".join(parts)
+
+    async def _timer_async(self, analyzer: Analyzer) -> None:
+        lock = self.dispatch_lock()
+        while True:
+            await asyncio.sleep(analyzer.interval_ms / 1000)
+            try:
+                with lock:
+                    analyzer.on_timer()
+            except Exception as e:
+                print(f"⚠️ {analyzer.name} evaluation failed: {e}")
+
+    async def _heartbeat_async(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            self.beat()
+
+    async def run_async(self, schedule: DaySchedule) -> None:
+        """
+        run() on one asyncio loop: every connection, the heartbeat and the
+        analyzer timers are tasks, the market close is a single timed
+        sleep, and shutdown closes the sockets and awaits every task. Only
+        the FrameQueue workers and the subscription manager (if enabled)
+        remain threads.
+        """
+        self.loop = asyncio.get_running_loop()
+        for conn in self.shards:
+            if conn.queue is not None:
+                threading.Thread(target=conn.work, daemon=True).start()
+        if self.subscriptions.enabled:
+            threading.Thread(target=self.subscriptions.run, args=(self.stopping,), daemon=True).start()
+        if self.checkpointer is not None:
+            threading.Thread(target=self.checkpointer.run, args=(self.stopping,), daemon=True).start()
+        tasks = [asyncio.create_task(self._heartbeat_async())]
+        tasks += [asyncio.create_task(self._timer_async(a)) for a in self.analyzers if a.interval_ms]
+        streams = [asyncio.create_task(conn.stream(schedule)) for conn in self.shards]
+
+        while schedule.is_active(include_pre_open=True):
+            left = (schedule.stop_at - datetime.now(tz=schedule.stop_at.tzinfo)).total_seconds()
+            await asyncio.sleep(max(1.0, left))
+        print(f"🕒 Market closed ({datetime.now(IST).strftime('%H:%M')}). Shutting down...")
+
+        self.stopping.set()
+        await asyncio.gather(*(conn.aclose() for conn in self.shards), return_exceptions=True)
+        for task in tasks + streams:
+            task.cancel()
+        await asyncio.gather(*tasks, *streams, return_exceptions=True)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.loop = None
+
+    def run(self, schedule: DaySchedule) -> None:
+        """Stream until the session in `schedule` ends."""
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        for analyzer in self.analyzers:
+            if analyzer.interval_ms:
+                threading.Thread(target=self._timer, args=(analyzer,), daemon=True).start()
+        for conn in self.shards:
+            if conn.queue is not None:
+                threading.Thread(target=conn.work, daemon=True).start()
+            threading.Thread(target=conn.receive, args=(schedule,), daemon=True).start()
+        if self.subscriptions.enabled:
+            threading.Thread(target=self.subscriptions.run, args=(self.stopping,), daemon=True).start()
+        if self.checkpointer is not None:
+            threading.Thread(target=self.checkpointer.run, args=(self.stopping,), daemon=True).start()
+
+        while schedule.is_active(include_pre_open=True):
+            time.sleep(CLOSE_CHECK_SECONDS)
+        print(f"🕒 Market closed ({datetime.now(IST).strftime('%H:%M')}). Shutting down...")
+        self.stop()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        for conn in self.shards:
+            conn.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+def universe_fetcher(access_token: Optional[str] = None,
+                     client_id: Optional[str] = None) -> Callable[[], Dict[int, str]]:
+    """A function that builds today's universe (dhan_universe.fetch_universe with the exclusions)."""
+    access_token = access_token or DHAN_ACCESS_TOKEN
+    client_id = client_id or DHAN_CLIENT_ID
+    excluded = dhan_universe.load_excluded()
+    return lambda: dhan_universe.fetch_universe(access_token, client_id, excluded)
+
+
+def build_universe(schedule: DaySchedule, access_token: Optional[str] = None,
+                   client_id: Optional[str] = None) -> Tuple[Dict[int, str], Optional[Callable[[], Mapping[int, str]]]]:
+    """
+    Wait for the session and build the universe; returns it with a function
+    that rebuilds it (for the intraday refresh), or ({}, None) if there is
+    no session or it closed before any stocks were found.
+    """
+    # Pre-open is enough to build the universe; the feed starts at 09:15.
+    if not wait_until_open(schedule, include_pre_open=True, log=print):
+        print("🏁 No session today. Exiting script.")
+        return {}, None
+    fetch = universe_fetcher(access_token, client_id)
+    # Loop until we actually find stocks or market closes
+    while True:
+        instruments = fetch()
+        if instruments:
+            return instruments, fetch
+        if not schedule.is_active(include_pre_open=True):
+            print("🏁 Market Closed before setup finished. Exiting script.")
+            return {}, None
+        print("Refetching in 30 seconds...")
+        time.sleep(30)
+
+
+def run_hub(analyzers: Iterable[Analyzer]) -> None:
+    """Wait for the session, build the universe and stream it to `analyzers` until close."""
+    print(f"🎬 Script Started at {datetime.now(IST)}")
+    schedule = MarketCalendar().schedule()
+    hub = FeedHub(analyzers)
+    checkpoint = feed_checkpoint.load(hub.checkpointer.path) if hub.checkpointer is not None else None
+    if checkpoint is not None and not checkpoint.matches(hub.states()):
+        print(f"⚠️ {hub.checkpointer.path} was saved by other analyzers; starting fresh.")
+        checkpoint = None
+    if checkpoint is not None:
+        # A restart mid-session: skip the universe build and resubscribe right away.
+        instruments = checkpoint.instruments
+        refresh = universe_fetcher(hub.access_token, hub.client_id)
+    else:
+        instruments, refresh = build_universe(schedule, hub.access_token, hub.client_id)
+    if not instruments:
+        return
+
+    hub.start(instruments, refresh=refresh, subscribe=checkpoint.subscribed if checkpoint else None)
+    if checkpoint is not None:
+        restored = checkpoint.restore(hub.states())
+        print(f"♻️ Resumed {len(instruments)} stocks from the checkpoint saved "
+              f"{checkpoint.age_seconds:.0f}s ago ({', '.join(restored) or 'no state'} restored)")
+    if FEED_CLIENT == "asyncio":
+        asyncio.run(hub.run_async(schedule))
+    else:
+        hub.run(schedule)
+
+
+if __name__ == "__main__":
+    from dhan_streamer_order_book import BigOrderAnalyzer
+    from nse_data import VolumeSpikeAnalyzer
+
+    from feed_workers import FEED_WORKERS, run_sharded
+
+    try:
+        if FEED_WORKERS > 1:
+            run_sharded([VolumeSpikeAnalyzer, BigOrderAnalyzer])
+        else:
+            run_hub([VolumeSpikeAnalyzer(), BigOrderAnalyzer()])
+    except KeyboardInterrupt:
+        print("\n👋 Shutdown.")
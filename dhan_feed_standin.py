@@ -0,0 +1,346 @@
+"""
+Local stand-in for Dhan's v2 market feed (wss://api-feed.dhan.co).
+
+Accepts the same subscribe/unsubscribe JSON the streamers send (RequestCode
+21/22 full, 17/18 quote, 15/16 ticker, up to 100 instruments per message),
+then streams synthetic packets in each instrument's subscribed mode at a
+configurable total rate - prices random-walking in 0.05 ticks, monotonic
+cumulative volume, LTT on the wall clock, five depth levels in full mode -
+with optional fault injection:
+
+    --disconnect-every S   send a disconnect packet (code 50) and close each
+                           connection every S seconds (jittered)
+    --burst-every S        multiply the rate by --burst-factor for
+                           --burst-seconds out of every S seconds
+    --plant-every S        every S seconds plant one event the analyzers must
+                           alert on: a 100 Cr volume print or a 20 Cr order
+                           resting for 5 s, on an instrument not planted before
+                           (big orders only on instruments in full mode)
+
+    python dhan_feed_standin.py --port 8766 --instruments 2000 --rate 20000 --plant-every 2
+
+then point a FeedHub at it by setting dhan_feed_hub.FEED_URL to
+LOCAL_FEED_URL (soak_feed.py does this). The universe is
+synthetic_universe(instruments, seed) on both sides. With --report, every
+planted event (with its send time) and every closed connection's counters
+are appended to a JSON-lines file.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import signal
+import struct
+import time
+from typing import Dict, List, Optional, TextIO
+
+import websockets
+
+import dhan_feed
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+)
+logger = logging.getLogger("Dhan_Feed_Standin")
+
+
+LOCAL_FEED_URL = "ws://127.0.0.1:{port}/?version=2&token={{token}}&clientId={{client_id}}&authType=2"
+SUBSCRIBE_FULL = 21
+UNSUBSCRIBE_FULL = 22
+# RequestCode -> the packet code an instrument subscribed with it streams.
+SUBSCRIBE_MODES = {15: dhan_feed.TICKER, 17: dhan_feed.QUOTE, SUBSCRIBE_FULL: dhan_feed.FULL}
+UNSUBSCRIBE_MODES = {16: dhan_feed.TICKER, 18: dhan_feed.QUOTE, UNSUBSCRIBE_FULL: dhan_feed.FULL}
+DISCONNECT_FEED = 12
+MAX_PER_MESSAGE = 100
+DISCONNECT_PACKET = struct.Struct("<BhBIh")    # header + reason code
+DISCONNECT_REASON = 805                        # "too many connections", the one Dhan sends most
+FULL_PACKET = struct.Struct("<BhBIfhifIIIIIIffff" + "IIHHff" * 5)
+TICKER_PACKET = struct.Struct("<BhBIfi")
+
+STEP_SECONDS = 0.005                  # producer wake-up interval
+BASE_VALUE_PER_SECOND = 100_000       # ~3 Cr per instrument per 5 minutes, far below the spike threshold
+PLANT_VOLUME_RUPEES = 100 * 10_000_000
+PLANT_ORDER_RUPEES = 20 * 10_000_000
+PLANT_ORDER_SECONDS = 5                # a planted order rests in the book this long
+
+
+def synthetic_universe(n: int, seed: int = 11) -> Dict[int, str]:
+    """security id -> symbol for `n` made-up NSE stocks (SYM<security id>)."""
+    rng = random.Random(seed)
+    return {sid: f"SYM{sid}" for sid in rng.sample(range(1, 30000), n)}
+
+
+class SyntheticFeed:
+    """
+    Per-instrument price, volume and activity for the whole universe. The
+    busiest few instruments get most of the ticks (Pareto activity), like the
+    real feed; volume per tick is scaled so every instrument trades about
+    BASE_VALUE_PER_SECOND at the configured rate.
+    """
+
+    def __init__(self, instruments: Dict[int, str], rate: float, seed: int = 11):
+        self.rng = random.Random(seed + 1)
+        self.sids = list(instruments)
+        n = len(self.sids)
+        self.price = [min(900.0, max(5.0, round(self.rng.lognormvariate(math.log(150), 0.9) / 0.05) * 0.05))
+                      for _ in range(n)]
+        self.volume = [self.rng.randint(10_000, 2_000_000) for _ in range(n)]
+        self.weight = [self.rng.paretovariate(1.2) for _ in range(n)]
+        total = sum(self.weight)
+        self.ticks_per_second = [max(1e-3, rate * w / total) for w in self.weight]
+        self.index_of = {sid: i for i, sid in enumerate(self.sids)}
+        self.big_order: Dict[int, float] = {}   # instrument -> time its planted order is pulled
+        self.ticked = set()                     # instruments sent at least once
+
+    def packet(self, i: int, now: float, code: int = dhan_feed.FULL) -> bytes:
+        rng = self.rng
+        self.ticked.add(i)
+        ltp = self.price[i] = min(900.0, max(5.0, round((self.price[i] + rng.gauss(0, 0.1)) / 0.05) * 0.05))
+        mean_qty = BASE_VALUE_PER_SECOND / self.ticks_per_second[i] / ltp
+        qty = 1 + int(rng.expovariate(1 / mean_qty))
+        self.volume[i] += qty
+        if code == dhan_feed.QUOTE:
+            return dhan_feed.encode_quote(self.sids[i], ltp, self.volume[i] & 0xFFFFFFFF, int(now),
+                                          ltq=min(qty, 32767), atp=ltp, ohlc=(ltp, ltp, ltp, ltp))
+        if code == dhan_feed.TICKER:
+            return TICKER_PACKET.pack(dhan_feed.TICKER, TICKER_PACKET.size, 1, self.sids[i], ltp, int(now))
+        depth = []
+        for level in range(1, 6):
+            depth += (int(rng.lognormvariate(7.6, 1.0)), int(rng.lognormvariate(7.6, 1.0)),
+                      rng.randint(1, 40), rng.randint(1, 40), ltp - 0.05 * level, ltp + 0.05 * level)
+        if i in self.big_order:
+            if now < self.big_order[i]:
+                depth[0] = int(PLANT_ORDER_RUPEES / depth[4]) + 1
+            else:
+                del self.big_order[i]
+        return FULL_PACKET.pack(
+            dhan_feed.FULL, dhan_feed.FULL_SIZE, 1, self.sids[i],
+            ltp, min(qty, 32767), int(now), ltp, self.volume[i] & 0xFFFFFFFF,
+            0, 0, 0, 0, 0, ltp, ltp, ltp, ltp, *depth,
+        )
+
+    def plant_volume(self, i: int) -> None:
+        self.volume[i] += int(PLANT_VOLUME_RUPEES / self.price[i]) + 1
+
+    def plant_order(self, i: int, now: float) -> None:
+        self.big_order[i] = now + PLANT_ORDER_SECONDS
+
+
+class StandinConfig:
+    def __init__(self, rate: float = 10_000.0, packets_per_frame: int = 1,
+                 disconnect_every: float = 0.0, burst_every: float = 0.0,
+                 burst_factor: float = 3.0, burst_seconds: float = 2.0,
+                 plant_every: float = 0.0):
+        self.rate = rate                          # packets/s over all connections
+        self.packets_per_frame = packets_per_frame
+        self.disconnect_every = disconnect_every
+        self.burst_every = burst_every
+        self.burst_factor = burst_factor
+        self.burst_seconds = burst_seconds
+        self.plant_every = plant_every
+
+
+class Subscription:
+    """
+    One connection's subscribed instruments (feed indices) and the packet
+    code each streams; `version` bumps on every change.
+    """
+
+    def __init__(self):
+        self.indices: List[int] = []
+        self.mode: Dict[int, int] = {}
+        self.version = 0
+
+
+class FeedStandin:
+    def __init__(self, instruments: Dict[int, str], config: StandinConfig,
+                 seed: int = 11, report: Optional[TextIO] = None):
+        self.feed = SyntheticFeed(instruments, config.rate, seed)
+        self.config = config
+        self.rng = random.Random(seed + 2)
+        self.report = report
+        self.started = time.monotonic()
+        self.planted = set()
+        self.stats = {"connections": 0, "frames": 0, "packets": 0, "disconnects": 0, "planted": 0}
+
+    def log(self, **event) -> None:
+        if self.report is not None:
+            self.report.write(json.dumps(event) + "\n")
+            self.report.flush()
+
+    def rate_now(self) -> float:
+        cfg = self.config
+        if cfg.burst_every and (time.monotonic() - self.started) % cfg.burst_every < cfg.burst_seconds:
+            return cfg.rate * cfg.burst_factor
+        return cfg.rate
+
+    async def handler(self, ws) -> None:
+        if "token=" not in ws.request.path:
+            await ws.close(4001, "missing token")
+            return
+        self.stats["connections"] += 1
+        sub = Subscription()
+        producer = asyncio.create_task(self.produce(ws, sub))
+        try:
+            async for message in ws:
+                if self.on_request(message, sub) == DISCONNECT_FEED:
+                    await ws.close()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    def on_request(self, message, sub: Subscription) -> Optional[int]:
+        """Apply one subscribe/unsubscribe request; returns its RequestCode."""
+        try:
+            request = json.loads(message)
+        except ValueError:
+            logger.warning("Ignoring non-JSON request: %r", message[:80])
+            return None
+        code = request.get("RequestCode")
+        instruments = request.get("InstrumentList", [])
+        if len(instruments) > MAX_PER_MESSAGE:
+            logger.warning("Request %s lists %d instruments (max %d)", code, len(instruments), MAX_PER_MESSAGE)
+        wanted = {self.feed.index_of.get(int(i.get("SecurityId", -1))) for i in instruments} - {None}
+        if code in SUBSCRIBE_MODES:
+            sub.indices.extend(sorted(wanted - set(sub.mode)))
+            sub.mode.update(dict.fromkeys(wanted, SUBSCRIBE_MODES[code]))
+            sub.version += 1
+        elif code in UNSUBSCRIBE_MODES:
+            # Only instruments subscribed in that mode.
+            gone = {i for i in wanted if sub.mode.get(i) == UNSUBSCRIBE_MODES[code]}
+            sub.indices[:] = [i for i in sub.indices if i not in gone]
+            for i in gone:
+                del sub.mode[i]
+            sub.version += 1
+        return code
+
+    async def produce(self, ws, sub: Subscription) -> None:
+        cfg = self.config
+        feed = self.feed
+        per_frame = max(1, cfg.packets_per_frame)
+        close_at = (time.monotonic() + cfg.disconnect_every * self.rng.uniform(0.5, 1.5)
+                    if cfg.disconnect_every else math.inf)
+        next_plant = time.monotonic() + cfg.plant_every if cfg.plant_every else math.inf
+        frames = packets = 0
+        owed = 0.0
+        last = time.monotonic()
+        first = None
+        version = -1
+        subscribed: List[int] = []
+        cum_weights: List[float] = []
+        share = 0.0
+        try:
+            while True:
+                await asyncio.sleep(STEP_SECONDS)
+                now = time.monotonic()
+                if version != sub.version:
+                    version = sub.version
+                    subscribed = list(sub.indices)
+                    total = 0.0
+                    cum_weights = []
+                    for i in subscribed:
+                        total += feed.weight[i]
+                        cum_weights.append(total)
+                    share = total / sum(feed.weight)
+                if not subscribed:
+                    last = now
+                    continue
+                if first is None:
+                    first = now
+
+                if now >= next_plant:
+                    next_plant = now + cfg.plant_every
+                    kind = "volume" if self.stats["planted"] % 2 == 0 else "big_order"
+                    # Only instruments already sent once: the first tick is every analyzer's baseline.
+                    # Depth (and so a big order) only reaches instruments in full mode.
+                    fresh = [i for i in subscribed if i in feed.ticked and i not in self.planted
+                             and (kind == "volume" or sub.mode.get(i) == dhan_feed.FULL)
+                             and sub.mode.get(i) != dhan_feed.TICKER]
+                    if fresh:
+                        i = self.rng.choice(fresh)
+                        self.planted.add(i)
+                        if kind == "volume":
+                            feed.plant_volume(i)
+                        else:
+                            feed.plant_order(i, time.time())
+                        # Send the planted packet right away so its send time is exact.
+                        sent_ns = time.time_ns()
+                        await ws.send(feed.packet(i, sent_ns / 1e9, sub.mode.get(i, dhan_feed.FULL)))
+                        frames += 1
+                        packets += 1
+                        self.stats["planted"] += 1
+                        self.log(event="plant", kind=kind, sid=feed.sids[i], sent_ns=sent_ns)
+
+                owed += self.rate_now() * share * (now - last)
+                last = now
+                n = int(owed)
+                owed -= n
+                if n:
+                    wall = time.time()
+                    picks = self.rng.choices(subscribed, cum_weights=cum_weights, k=n)
+                    mode = sub.mode
+                    for start in range(0, n, per_frame):
+                        await ws.send(b"".join(feed.packet(i, wall, mode.get(i, dhan_feed.FULL))
+                                               for i in picks[start:start + per_frame]))
+                        frames += 1
+                    packets += n
+
+                if now >= close_at:
+                    self.stats["disconnects"] += 1
+                    await ws.send(DISCONNECT_PACKET.pack(dhan_feed.DISCONNECT, DISCONNECT_PACKET.size, 0, 0,
+                                                         DISCONNECT_REASON))
+                    await ws.close()
+                    return
+        finally:
+            self.stats["frames"] += frames
+            self.stats["packets"] += packets
+            self.log(event="closed", frames=frames, packets=packets,
+                     seconds=round(time.monotonic() - first, 3) if first is not None else 0.0)
+
+    async def serve(self, port: int, stop: asyncio.Event) -> None:
+        async with websockets.serve(self.handler, "127.0.0.1", port, max_size=None) as server:
+            logger.info("Dhan feed stand-in on ws://127.0.0.1:%s (%s instruments, %s packets/s)",
+                        port, len(self.feed.sids), self.config.rate)
+            await stop.wait()
+            server.close()
+            await server.wait_closed()
+        self.log(event="summary", **self.stats)
+        logger.info("Stand-in stopped: %s", self.stats)
+
+
+async def main(args) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    config = StandinConfig(args.rate, args.packets_per_frame, args.disconnect_every,
+                           args.burst_every, args.burst_factor, args.burst_seconds, args.plant_every)
+    report = open(args.report, "a") if args.report else None
+    try:
+        standin = FeedStandin(synthetic_universe(args.instruments, args.seed), config, args.seed, report)
+        await standin.serve(args.port, stop)
+    finally:
+        if report is not None:
+            report.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Dhan v2 market feed")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--instruments", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--rate", type=float, default=10_000, help="packets/s over all connections")
+    parser.add_argument("--packets-per-frame", type=int, default=1)
+    parser.add_argument("--disconnect-every", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=float, default=0.0)
+    parser.add_argument("--burst-factor", type=float, default=3.0)
+    parser.add_argument("--burst-seconds", type=float, default=2.0)
+    parser.add_argument("--plant-every", type=float, default=0.0)
+    parser.add_argument("--report", help="append planted events and connection counters (JSON lines)")
+    asyncio.run(main(parser.parse_args()))
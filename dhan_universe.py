@@ -0,0 +1,93 @@
+"""
+The stock universe the Dhan streamers subscribe to.
+
+NSE cash equities that Zerodha's leverage sheet lists at 5x MIS or more,
+minus ETFs/BEES and excluded_symbols.json, whose LTP is inside
+[MIN_LTP, MAX_LTP]. Built once per run and shared by every analyzer on a
+FeedHub (see dhan_feed_hub.py).
+"""
+import json
+import time
+from io import StringIO
+from typing import Callable, Dict, Iterable, Set
+
+import pandas as pd
+import requests
+
+
+INSTRUMENT_URL = "https://api.dhan.co/v2/instrument/NSE_EQ"
+LTP_URL = "https://api.dhan.co/v2/marketfeed/ltp"
+LEVERAGE_SHEET_URL = "https://docs.google.com/spreadsheets/d/1zqhM3geRNW_ZzEx62y0W5U2ZlaXxG-NDn0V8sJk5TQ4/gviz/tq?tqx=out:csv&gid=1663719548"
+EXCLUDED_FILE = "excluded_symbols.json"
+
+MIN_MIS = 5
+MIN_LTP = 5
+MAX_LTP = 900
+LTP_CHUNK = 1000          # securities per LTP request
+LTP_PAUSE_SECONDS = 1.2   # Dhan allows one LTP request per second
+
+
+def load_excluded(path: str = EXCLUDED_FILE) -> Set[str]:
+    with open(path) as f:
+        return set(json.load(f))
+
+
+def fetch_universe(access_token: str, client_id: str, excluded: Iterable[str] = (),
+                   log: Callable[[str], None] = print) -> Dict[int, str]:
+    """security id -> symbol for today's universe; {} if anything fails."""
+    excluded = set(excluded)
+    headers = {
+        'access-token': access_token,
+        'client-id': client_id,
+        'Content-Type': 'application/json'
+    }
+    log("⬇️ Fetching live instrument master and leverage data...")
+
+    try:
+        # 1. Instrument Master
+        resp = requests.get(INSTRUMENT_URL, headers=headers, timeout=30)
+        inst_df = pd.read_csv(StringIO(resp.text))
+        inst_df = inst_df[(inst_df["EXCH_ID"] == "NSE") & (inst_df["SEGMENT"] == "E") & (inst_df["INSTRUMENT_TYPE"] == "ES")]
+        inst_df = inst_df[["SECURITY_ID", "UNDERLYING_SYMBOL"]].rename(columns={"UNDERLYING_SYMBOL": "Symbol"})
+        inst_df["Symbol"] = inst_df["Symbol"].str.upper().str.strip()
+
+        # 2. Leverage Sheet (symbol column is the one after "Sr.")
+        lev_df = pd.read_csv(LEVERAGE_SHEET_URL)
+        symbol_col = lev_df.columns[list(lev_df.columns).index("Sr.") + 1]
+        lev_df = lev_df.rename(columns={symbol_col: "Symbol"})
+        lev_df["Symbol"] = lev_df["Symbol"].astype(str).str.upper().str.strip()
+        lev_df["MIS"] = pd.to_numeric(lev_df["MIS (Intraday)"].astype(str).str.replace("x", "", case=False), errors="coerce")
+
+        # 3. Filter
+        mis_df = lev_df[lev_df["MIS"] >= MIN_MIS][["Symbol"]].copy()
+        mis_df = mis_df[~mis_df["Symbol"].str.contains("BEES|ETF|CASE", case=False, na=False)]
+        mis_df = mis_df[~mis_df["Symbol"].isin(excluded)]
+
+        final_df = mis_df.merge(inst_df, on="Symbol", how="inner")
+        sid_to_symbol_map = dict(zip(final_df['SECURITY_ID'], final_df['Symbol']))
+        potential_sids = final_df["SECURITY_ID"].tolist()
+
+        # 4. LTP Filter
+        log(f"🔍 Checking LTP for {len(potential_sids)} candidates...")
+        universe = {}
+        for i in range(0, len(potential_sids), LTP_CHUNK):
+            chunk = potential_sids[i:i + LTP_CHUNK]
+            q_resp = requests.post(LTP_URL, headers=headers, json={"NSE_EQ": chunk}, timeout=10)
+            if q_resp.status_code == 200:
+                market_data = q_resp.json().get('data', {}).get('NSE_EQ', {})
+                for sid_key, details in market_data.items():
+                    ltp = details.get('last_price', 0)
+                    if MIN_LTP <= ltp <= MAX_LTP:
+                        sid_int = int(sid_key)
+                        universe[sid_int] = sid_to_symbol_map.get(sid_int, "Unknown")
+            time.sleep(LTP_PAUSE_SECONDS)
+
+        if universe:
+            log(f"✅ Setup Complete: {len(universe)} stocks ready.")
+        else:
+            log("❌ No stocks matched criteria.")
+        return universe
+
+    except Exception as e:
+        log(f"❌ Error during setup: {e}")
+        return {}
@@ -0,0 +1,210 @@
+"""
+Record raw Dhan feed frames to memory-mapped segment files and replay them.
+
+With FEED_CAPTURE_DIR set, FeedHub appends every binary frame it receives,
+stamped with its receive time, to <dir>/feed-YYYYMMDD-NNN.bin:
+
+    file    MAGIC (8 bytes), then records back to back, then a zero length
+    record  receive time (int64 ns since epoch) | length (uint32) | frame
+
+Each segment is preallocated (FEED_CAPTURE_SEGMENT_MB) and mapped, so a
+write is two copies into memory under a lock; the OS flushes pages in the
+background. A full segment is trimmed and the next one opened. The universe
+the hub subscribed is saved next to the first segment (…-universe.json) so
+a replay assigns the same slots.
+
+Replay feeds captured frames into any sink - FeedHub.dispatch() for the
+analyzers - as fast as possible or at the original pace:
+
+    python feed_capture.py captures/feed-20261019-000.bin              # both analyzers, dry run
+    python feed_capture.py captures/feed-20261019-*.bin --speed 1 --analyzers volume
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Mapping, Optional, Tuple
+
+from market_calendar import IST_ZONE
+
+
+MAGIC = b"DHANCAP1"
+RECORD = struct.Struct("<qI")    # receive time ns, frame length
+SEGMENT_MB = int(os.getenv("FEED_CAPTURE_SEGMENT_MB", 256))
+
+
+class FeedRecorder:
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_MB << 20, prefix: str = "feed"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.stem = f"{prefix}-{datetime.now(IST_ZONE):%Y%m%d}"
+        self.lock = threading.Lock()
+        self.file = None
+        self.mm = None
+        self.pos = 0
+        self.index = self._first_free_index()
+        self.frames = 0
+        self.bytes = 0
+        self.path: Optional[Path] = None
+
+    def _first_free_index(self) -> int:
+        taken = [int(p.stem.rsplit("-", 1)[1]) for p in self.directory.glob(f"{self.stem}-[0-9][0-9][0-9].bin")]
+        return max(taken) + 1 if taken else 0
+
+    def _open_segment(self, min_bytes: int) -> None:
+        self._close_segment()
+        self.path = self.directory / f"{self.stem}-{self.index:03d}.bin"
+        self.index += 1
+        size = max(self.segment_bytes, len(MAGIC) + min_bytes + RECORD.size)
+        self.file = open(self.path, "w+b")
+        self.file.truncate(size)
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        self.mm[:len(MAGIC)] = MAGIC
+        self.pos = len(MAGIC)
+
+    def _close_segment(self) -> None:
+        if self.mm is None:
+            return
+        # The zero-length record after the last frame marks the end.
+        end = self.pos + RECORD.size if self.pos + RECORD.size <= len(self.mm) else self.pos
+        self.mm.flush()
+        self.mm.close()
+        self.file.truncate(end)
+        self.file.close()
+        self.mm = self.file = None
+
+    def save_universe(self, instruments: Mapping[int, str]) -> Path:
+        path = self.directory / f"{self.stem}-universe.json"
+        with open(path, "w") as f:
+            json.dump({str(sid): sym for sid, sym in instruments.items()}, f)
+        return path
+
+    def write(self, frame: bytes, received_ns: Optional[int] = None) -> None:
+        n = len(frame)
+        with self.lock:
+            if self.mm is None or self.pos + RECORD.size + n + RECORD.size > len(self.mm):
+                self._open_segment(RECORD.size + n)
+            RECORD.pack_into(self.mm, self.pos, received_ns or time.time_ns(), n)
+            start = self.pos + RECORD.size
+            self.mm[start:start + n] = frame
+            self.pos = start + n
+            self.frames += 1
+            self.bytes += n
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_segment()
+
+    def describe(self) -> str:
+        return f"Captured: {self.frames} frames / {self.bytes / 1e6:.1f} MB -> {self.path.name if self.path else '-'}"
+
+
+def iter_capture(paths: Iterable[str]) -> Iterator[Tuple[int, bytes]]:
+    """(receive time ns, frame) for every record in `paths`, in order."""
+    for path in paths:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= len(MAGIC):
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{path} is not a feed capture")
+                pos, end = len(MAGIC), len(mm)
+                while pos + RECORD.size <= end:
+                    ts, n = RECORD.unpack_from(mm, pos)
+                    if n == 0 and ts == 0:
+                        break
+                    pos += RECORD.size
+                    if pos + n > end:
+                        break
+                    yield ts, mm[pos:pos + n]
+                    pos += n
+
+
+def replay(paths: Iterable[str], sink: Callable[[bytes], None], speed: float = 0.0,
+           clock: Optional[Callable[[int], None]] = None) -> dict:
+    """
+    Feed every captured frame to `sink`. speed 0 = as fast as possible,
+    1 = original pace, 2 = twice as fast, ... `clock`, if given, is called
+    with each frame's capture time first (e.g. to run timers on capture time).
+    """
+    frames = 0
+    nbytes = 0
+    first_ts = None
+    started = time.perf_counter()
+    for ts, frame in iter_capture(paths):
+        if speed > 0:
+            if first_ts is None:
+                first_ts = ts
+            due = (ts - first_ts) / 1e9 / speed
+            wait = due - (time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+        if clock is not None:
+            clock(ts)
+        sink(frame)
+        frames += 1
+        nbytes += len(frame)
+    elapsed = time.perf_counter() - started
+    return {"frames": frames, "bytes": nbytes, "seconds": elapsed,
+            "frames_per_sec": frames / elapsed if elapsed else 0.0}
+
+
+def universe_for(path: str) -> Mapping[int, str]:
+    stem = Path(path).stem.rsplit("-", 1)[0]
+    with open(Path(path).with_name(f"{stem}-universe.json")) as f:
+        return {int(sid): sym for sid, sym in json.load(f).items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a captured Dhan feed into the analyzers")
+    parser.add_argument("paths", nargs="+", help="capture segments (globs allowed), replayed in order")
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = as fast as possible, 1 = original pace")
+    parser.add_argument("--analyzers", default="volume,big_order")
+    parser.add_argument("--send", action="store_true", help="really send Telegram alerts")
+    args = parser.parse_args()
+
+    import dhan_streamer_order_book
+    import nse_data
+    from dhan_feed_hub import FeedHub
+
+    if not args.send:
+        nse_data.send_telegram = dhan_streamer_order_book.send_telegram = lambda msg: print(f"[dry run] {msg!r}")
+    available = {"volume": nse_data.VolumeSpikeAnalyzer, "big_order": dhan_streamer_order_book.BigOrderAnalyzer}
+    paths = sorted(p for pattern in args.paths for p in glob.glob(pattern))
+    if not paths:
+        raise SystemExit("No capture files matched.")
+
+    hub = FeedHub([available[name]() for name in args.analyzers.split(",")], capture_dir="")
+    hub.start(universe_for(paths[0]))
+
+    # Timer-driven analyzers run on capture time so a fast replay evaluates
+    # as often as the live run did.
+    timed = [a for a in hub.analyzers if a.interval_ms]
+    due = {}
+
+    # Frames are dispatched with their capture time, so the lag metrics
+    # describe the recorded session, and the hub's clock follows it, so
+    # cooldowns expire as they did live however fast the replay runs.
+    now = [0]
+
+    def run_timers(ts):
+        now[0] = hub.replay_ns = ts
+        for analyzer in timed:
+            if ts >= due.get(analyzer.name, 0):
+                if analyzer.name in due:
+                    analyzer.on_timer()
+                due[analyzer.name] = ts + analyzer.interval_ms * 1_000_000
+
+    result = replay(paths, lambda frame: hub.dispatch(frame, now[0]), args.speed, clock=run_timers)
+    for analyzer in timed:
+        analyzer.on_timer()
+    print(f"Replayed {result['frames']} frames ({result['bytes'] / 1e6:.1f} MB) in {result['seconds']:.2f}s "
+          f"= {result['frames_per_sec']:,.0f} frames/s")
+    print(hub.describe())
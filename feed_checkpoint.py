@@ -0,0 +1,235 @@
+"""
+Crash-safe checkpoints of the analyzers' streaming state, and resume.
+
+A restart mid-session used to lose every traded-value window and cooldown:
+alerts already sent fired again, and the windows were blind until they had
+refilled. With FEED_CHECKPOINT_FILE set (the default) the hub writes, every
+FEED_CHECKPOINT_SECONDS from a background thread, to that path with
+{analyzers} replaced by its sorted analyzer names - one file per entry
+point, so nse_data.py, dhan_streamer_order_book.py and dhan_feed_hub.py
+run from one directory do not overwrite each other:
+
+    file    MAGIC (8 bytes) | meta length (uint32) | meta (JSON) | columns
+    meta    day, save time, the universe in slot order, the subscribed
+            security ids, and per analyzer its FeedState geometry and the
+            dtype/shape of each column saved
+    columns the used rows of every FeedState column (windows, cumulative
+            value/volume, last tick, cooldowns), each zlib-compressed
+            (level 1: back-filled window rings shrink ~10-50x), back to
+            back; the raw packet copies, dirty flags and gate bytes are
+            not saved
+
+The receive path is never paused: the snapshot is a copy of each column
+(a memcpy, taken without locks - a slot ticked mid-copy may be one tick
+off) and the file is compressed, written, fsynced and renamed into place
+on the checkpoint thread (zlib and file I/O release the GIL), so a crash
+leaves either the old file or the new one.
+
+On start, a checkpoint from today's session replaces the universe build
+(no instrument master or LTP requests), so the hub resubscribes within
+seconds; the saved columns are copied back into the new FeedStates and
+FeedState.rebase() makes each stock's next tick only reset its volume
+baseline, so volume traded during the outage is not taken for a spike. A
+checkpoint saved by a different set of analyzers is ignored.
+
+On GitHub Actions a re-run job starts on a fresh runner, so the Dhan
+workflows restore the day's checkpoint from the Actions cache before the
+script starts and save it again when the job ends, however it ends.
+"""
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pytz
+
+from dhan_feed import FeedState
+
+
+IST = pytz.timezone("Asia/Kolkata")
+
+MAGIC = b"DHANCKP1"
+META_SIZE = struct.Struct("<I")
+# "" = no checkpoints (and no resume); {analyzers} = the entry point's sorted analyzer names.
+FEED_CHECKPOINT_FILE = os.getenv("FEED_CHECKPOINT_FILE", "feed_checkpoint-{analyzers}.bin")
+FEED_CHECKPOINT_SECONDS = float(os.getenv("FEED_CHECKPOINT_SECONDS", 15))
+SKIP_COLUMNS = ("packets", "dirty")
+
+# (security id, symbol) per slot, FeedState per analyzer name, subscribed security ids (None = all)
+Source = Callable[[], Tuple[Sequence[Tuple[int, str]], Mapping[str, FeedState], Optional[Sequence[str]]]]
+
+
+def checkpoint_path(names: Iterable[str], template: str = FEED_CHECKPOINT_FILE) -> str:
+    """`template` for the analyzers called `names` ("" stays "": no checkpoints)."""
+    return template.format(analyzers="-".join(sorted(names))) if template else ""
+
+
+def snapshot(universe: Sequence[Tuple[int, str]], states: Mapping[str, FeedState],
+             subscribed: Optional[Sequence[str]] = None) -> Tuple[dict, List[np.ndarray]]:
+    """(meta, column copies) for save()."""
+    meta = {
+        "day": datetime.now(IST).date().isoformat(),
+        "saved_at": time.time(),
+        "universe": [[int(sid), symbol] for sid, symbol in universe],
+        "subscribed": None if subscribed is None else [str(sid) for sid in subscribed],
+        "states": {},
+    }
+    arrays = []
+    for name, state in states.items():
+        n = len(state)
+        copies = [(column, getattr(state, column)[:n].copy())
+                  for column, _dtype, _fill, _row in state.columns if column not in SKIP_COLUMNS]
+        # A slot added mid-copy can leave a column taken before the state grew short of n.
+        n = min(len(array) for _column, array in copies)
+        columns = []
+        for column, array in copies:
+            array = array[:n]
+            columns.append([column, array.dtype.str, list(array.shape)])
+            arrays.append(array)
+        meta["states"][name] = {"slots": n, "span": state.span, "bucket_seconds": state.bucket_seconds,
+                                "cooldowns": state.cooldowns, "columns": columns}
+    return meta, arrays
+
+
+def save(path: str, meta: dict, arrays: Sequence[np.ndarray]) -> int:
+    """Write a checkpoint atomically (temp file, fsync, rename); returns its size in bytes."""
+    packed = [zlib.compress(array.data, 1) for array in arrays]
+    blob = json.dumps(dict(meta, lengths=[len(p) for p in packed])).encode()
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(MAGIC)
+        f.write(META_SIZE.pack(len(blob)))
+        f.write(blob)
+        for chunk in packed:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(f.name, path)
+    return size
+
+
+class Checkpoint:
+    """A loaded checkpoint: the universe it covered and every analyzer's saved columns."""
+
+    def __init__(self, meta: dict, columns: Dict[str, Dict[str, np.ndarray]]):
+        self.meta = meta
+        self.columns = columns
+        self.saved_at = meta["saved_at"]
+        self.instruments: Dict[int, str] = {sid: symbol for sid, symbol in meta["universe"]}
+        self.subscribed: Optional[List[int]] = (None if meta["subscribed"] is None
+                                                else [int(sid) for sid in meta["subscribed"]])
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.saved_at
+
+    def matches(self, names: Iterable[str]) -> bool:
+        """True if it was saved by exactly the analyzers called `names`."""
+        return set(self.meta["states"]) == set(names)
+
+    def restore(self, states: Mapping[str, FeedState]) -> List[str]:
+        """
+        Copy the saved columns into `states` (built for self.instruments, so
+        the slots match) and rebase them; returns the names restored.
+        Analyzers whose geometry changed since the save start fresh; a
+        checkpoint from a different set of analyzers restores nothing.
+        """
+        if not self.matches(states):
+            print(f"⚠️ Checkpoint is for {', '.join(sorted(self.meta['states']))}, "
+                  f"not {', '.join(sorted(states))}; not restoring it.")
+            return []
+        restored = []
+        for name, state in states.items():
+            saved = self.meta["states"].get(name)
+            if saved is None:
+                continue
+            geometry = (state.span, state.bucket_seconds, state.cooldowns)
+            if geometry != (saved["span"], saved["bucket_seconds"], saved["cooldowns"]) or saved["slots"] > len(state):
+                print(f"⚠️ Checkpoint for {name} does not fit its current settings; starting it fresh.")
+                continue
+            n = saved["slots"]
+            for column, array in self.columns[name].items():
+                getattr(state, column)[:n] = array
+            state.rebase()
+            restored.append(name)
+        return restored
+
+
+def load(path: str, day: Optional[date] = None) -> Optional[Checkpoint]:
+    """The checkpoint at `path` if it is from `day` (default today, IST), else None."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a feed checkpoint")
+        off = len(MAGIC)
+        (size,) = META_SIZE.unpack_from(data, off)
+        off += META_SIZE.size
+        meta = json.loads(data[off:off + size])
+        off += size
+        columns: Dict[str, Dict[str, np.ndarray]] = {}
+        lengths = iter(meta["lengths"])
+        for name, saved in meta["states"].items():
+            columns[name] = {}
+            for column, dtype, shape in saved["columns"]:
+                length = next(lengths)
+                raw = zlib.decompress(data[off:off + length])
+                columns[name][column] = np.frombuffer(raw, np.dtype(dtype)).reshape(shape)
+                off += length
+    except (OSError, ValueError, KeyError, StopIteration, struct.error, zlib.error) as e:
+        print(f"⚠️ Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    day = day or datetime.now(IST).date()
+    if meta["day"] != day.isoformat():
+        return None
+    return Checkpoint(meta, columns)
+
+
+class Checkpointer:
+    """Saves source() to `path` every `interval` seconds on its own thread."""
+
+    def __init__(self, path: str, source: Source, interval: float = FEED_CHECKPOINT_SECONDS):
+        self.path = path
+        self.source = source
+        self.interval = interval
+        self.saves = 0
+        self.failures = 0
+        self.size = 0
+        self.copy_ms = 0.0
+        self.write_ms = 0.0
+        self.saved_at = ""
+
+    def save(self) -> None:
+        t0 = time.perf_counter()
+        meta, arrays = snapshot(*self.source())
+        t1 = time.perf_counter()
+        self.size = save(self.path, meta, arrays)
+        t2 = time.perf_counter()
+        # copy is the only part that competes with the receive path for the GIL
+        self.copy_ms, self.write_ms = (t1 - t0) * 1000, (t2 - t1) * 1000
+        self.saves += 1
+        self.saved_at = datetime.now(IST).strftime("%H:%M:%S")
+
+    def run(self, stopping: threading.Event) -> None:
+        while not stopping.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Checkpoint failed: {e}")
+
+    def describe(self) -> str:
+        if not self.saves:
+            return f"Checkpoint: none yet ({self.failures} failed)" if self.failures else ""
+        text = (f"Checkpoint: {self.saved_at} ({self.size / 2**20:.1f} MB, "
+                f"copy {self.copy_ms:.0f} ms, write {self.write_ms:.0f} ms)")
+        return text + (f" | Checkpoint failures: {self.failures}" if self.failures else "")
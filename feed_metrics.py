@@ -0,0 +1,154 @@
+"""
+Streaming latency histograms for the feed hub.
+
+FeedHub records, per packet or frame:
+
+    lag         receive time - exchange last-trade time (ms), once per new
+                trade print of each security. LTT has one-second resolution,
+                so this includes 0-1000 ms of truncation (p50 ~500 ms with no
+                real delay); what matters is how far p95/p99 sit above that.
+    queue       frame received -> its dispatch started (ms): time spent in
+                the FrameQueue waiting for the worker
+    decode      dispatch time per packet not spent in analyzers (us)
+    <analyzer>  time in each analyzer's on_packet (us)
+    resume      socket reconnected -> its first frame (ms)
+    gap         socket dropped -> first frame after reconnecting (s)
+
+Decode and analyzer time are timed on one frame in FEED_METRICS_SAMPLE so
+the clock reads stay off most of the hot path; lag and queue are recorded
+for every frame. The heartbeat prints p50/p95/p99 for the interval since
+the previous heartbeat, and snapshot() (written to FEED_METRICS_FILE when
+set) has both the interval and the whole session.
+
+Histograms are log-bucketed (16 buckets per doubling, ~4% relative error),
+O(1) per record and a few KB each regardless of how many values go in.
+Several worker threads may record into one histogram; a lost increment
+under contention only nudges a percentile.
+"""
+import math
+import os
+from typing import Dict, Iterable, List, Optional
+
+
+SUB_BUCKETS = 16            # per doubling
+MIN_EXP = -10               # values below 2**-10 units share bucket 0
+MAX_BUCKET = 42 * SUB_BUCKETS
+FEED_METRICS_SAMPLE = int(os.getenv("FEED_METRICS_SAMPLE", 16))
+FEED_METRICS_FILE = os.getenv("FEED_METRICS_FILE", "")
+# Seconds to subtract from LTT before comparing it with the receive clock:
+# 0 if the feed's LTT is UTC epoch seconds, 19800 if it is IST wall-clock
+# seconds counted as if they were UTC.
+FEED_LTT_OFFSET_SECONDS = int(os.getenv("FEED_LTT_OFFSET_SECONDS", 0))
+
+
+class Histogram:
+    def __init__(self, unit: str = "ms"):
+        self.unit = unit
+        self.counts: List[int] = [0] * (MAX_BUCKET + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.negative = 0       # values below zero (clock skew), counted as 0
+
+    def record(self, value: float) -> None:
+        if value < 0:
+            self.negative += 1
+            value = 0.0
+        if value < 2.0 ** MIN_EXP:
+            i = 0
+        else:
+            i = min(MAX_BUCKET, 1 + int((math.log2(value) - MIN_EXP) * SUB_BUCKETS))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.negative += other.negative
+
+    def reset(self) -> None:
+        self.counts = [0] * (MAX_BUCKET + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.negative = 0
+
+    def percentile(self, pct: float) -> float:
+        """Upper edge of the bucket holding the pct-th percentile (0 if empty)."""
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.max, 2.0 ** (i / SUB_BUCKETS + MIN_EXP))
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "negative": self.negative,
+            "unit": self.unit,
+        }
+
+    def describe(self) -> str:
+        if not self.count:
+            return "-"
+        return "/".join(_short(self.percentile(p)) for p in (50, 95, 99)) + f" {self.unit}"
+
+
+def _short(value: float) -> str:
+    return f"{value:.0f}" if value >= 10 else f"{value:.1f}"
+
+
+class FeedMetrics:
+    """The hub's histograms; the current interval plus the session so far."""
+
+    def __init__(self, analyzers: Iterable[str] = (), sample_every: int = FEED_METRICS_SAMPLE,
+                 ltt_offset_seconds: int = FEED_LTT_OFFSET_SECONDS):
+        self.sample_every = max(1, sample_every)
+        self.ltt_offset_ms = ltt_offset_seconds * 1000
+        self.frames = 0
+        names = ["lag", "queue", "decode", "resume", "gap"] + list(analyzers)
+        units = {"lag": "ms", "queue": "ms", "resume": "ms", "gap": "s"}
+        self.interval = {name: Histogram(units.get(name, "us")) for name in names}
+        self.session = {name: Histogram(units.get(name, "us")) for name in names}
+        self.lag = self.interval["lag"]
+        self.queue = self.interval["queue"]
+        self.decode = self.interval["decode"]
+        self.resume = self.interval["resume"]
+        self.gap = self.interval["gap"]
+
+    def sample(self) -> bool:
+        """True for the one frame in `sample_every` whose decode/analyzer time is measured."""
+        self.frames += 1
+        return self.frames % self.sample_every == 0
+
+    def roll(self) -> None:
+        """Fold the interval into the session and start a new interval."""
+        for name, hist in self.interval.items():
+            self.session[name].merge(hist)
+            hist.reset()
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return {
+            "interval": {name: h.snapshot() for name, h in self.interval.items()},
+            "session": {name: h.snapshot() for name, h in self.session.items()},
+        }
+
+    def describe(self, names: Optional[Iterable[str]] = None) -> str:
+        """p50/p95/p99 of the current interval, e.g. 'Lag 480/930/1400 ms | Decode 3/5/9 us | ...'."""
+        names = list(names) if names is not None else list(self.interval)
+        return " | ".join(f"{name.capitalize()} {self.interval[name].describe()}"
+                          for name in names if self.interval[name].count)
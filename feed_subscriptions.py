@@ -0,0 +1,233 @@
+"""
+Subscription tiers and intraday universe refresh for the feed hub.
+
+Most of the universe is quiet most of the day, yet every instrument used to
+be subscribed in full mode (RequestCode 21: 162-byte packets with five depth
+levels). With FEED_QUIET_MODE=quote a FeedHub subscribes everything in
+quote mode (RequestCode 17: 50-byte packets, LTP and cumulative volume but
+no depth) and a SubscriptionManager thread, every TIER_REVIEW_SECONDS:
+
+    promotes   quote -> full  instruments trading TIER_PROMOTE_CR or more
+                              per minute since the previous review
+    demotes    full -> quote  instruments that have been full for at least
+                              TIER_HOLD_SECONDS and now trade less than
+                              TIER_DEMOTE_CR per minute
+
+by unsubscribing the old mode and subscribing the new one on the live
+socket - no reconnect. Volume spikes see every instrument in either mode;
+big orders are only checked while an instrument is in full mode.
+FEED_QUIET_MODE=full (the default) keeps everything in full mode.
+
+Every UNIVERSE_REFRESH_MINUTES it also rebuilds the universe (the same MIS
+and LTP filters as at startup, see dhan_universe.py) and applies the
+difference incrementally: new instruments get the next FeedState slots in
+the hub and every analyzer and are subscribed on the connection with the
+most room; instruments that left are unsubscribed but keep their slots, so
+one that comes back resumes where it left off. A refresh that would drop
+more than REFRESH_MAX_DROP of the universe is treated as a failed fetch
+(fetch_universe skips LTP chunks that error) and only adds.
+
+New slots can make a FeedState grow (capacity doubles, columns are
+reallocated), so FeedHub.add() pauses dispatch (FeedHub.paused()): each
+connection's worker and each analyzer timer finishes its current frame or
+pass and waits, rather than tick into a column mid-copy.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Mapping, Optional
+
+import numpy as np
+import pytz
+
+
+IST = pytz.timezone("Asia/Kolkata")
+
+SUBSCRIBE = {"ticker": 15, "quote": 17, "full": 21}
+UNSUBSCRIBE = {"ticker": 16, "quote": 18, "full": 22}
+
+# "full": no tiering. "quote": quiet instruments in quote mode, promoted to
+# full on activity. (Ticker packets carry no volume, which the volume
+# analyzer and the promotion rule both need, so "ticker" is not a tier.)
+FEED_QUIET_MODE = os.getenv("FEED_QUIET_MODE", "full")
+TIER_REVIEW_SECONDS = float(os.getenv("TIER_REVIEW_SECONDS", 60))
+TIER_PROMOTE_CR = float(os.getenv("TIER_PROMOTE_CR", 1.0))       # Cr traded per minute
+TIER_DEMOTE_CR = float(os.getenv("TIER_DEMOTE_CR", 0.25))
+TIER_HOLD_SECONDS = float(os.getenv("TIER_HOLD_SECONDS", 600))
+# 0 = keep the startup universe all day.
+UNIVERSE_REFRESH_MINUTES = float(os.getenv("UNIVERSE_REFRESH_MINUTES", 30))
+REFRESH_MAX_DROP = 0.2
+CR_UNIT = 10_000_000
+
+
+class SubscriptionManager:
+    """
+    Decides each instrument's mode from the hub's FeedState (ltp, cum_vol
+    and ltt are kept there for every quote and full packet) and applies
+    mode and universe changes through the hub's FeedConnections.
+    """
+
+    def __init__(self, hub, quiet_mode: str = FEED_QUIET_MODE,
+                 review_seconds: float = TIER_REVIEW_SECONDS, promote_cr: float = TIER_PROMOTE_CR,
+                 demote_cr: float = TIER_DEMOTE_CR, hold_seconds: float = TIER_HOLD_SECONDS,
+                 refresh_minutes: float = UNIVERSE_REFRESH_MINUTES):
+        if quiet_mode not in ("quote", "full"):
+            raise ValueError(f"Unknown quiet mode: {quiet_mode}")
+        self.hub = hub
+        self.quiet_mode = quiet_mode
+        self.review_seconds = review_seconds
+        self.promote_cr = promote_cr
+        self.demote_cr = demote_cr
+        self.hold_seconds = hold_seconds
+        self.refresh_seconds = refresh_minutes * 60
+        self.fetch: Optional[Callable[[], Mapping[int, str]]] = None
+        self.lock = threading.Lock()
+        # Per hub slot: in full mode?, since when, cum_vol at the last review (-1 = not ticked yet).
+        self.full = np.zeros(0, dtype=np.bool_)
+        self.since = np.zeros(0)
+        self.last_vol = np.zeros(0, dtype=np.int64)
+        self.last_review = 0.0
+        self.promoted = 0
+        self.demoted = 0
+        self.added = 0
+        self.removed = 0
+        self.refreshed_at = ""
+
+    @property
+    def tiering(self) -> bool:
+        return self.quiet_mode != "full"
+
+    @property
+    def enabled(self) -> bool:
+        return self.tiering or bool(self.refresh_seconds and self.fetch is not None)
+
+    def start(self, fetch: Optional[Callable[[], Mapping[int, str]]] = None) -> None:
+        """Called by FeedHub.start() once slots and shards exist; `fetch` rebuilds the universe."""
+        self.fetch = fetch
+        self._resize(len(self.hub.state))
+        self.full[:] = not self.tiering
+        self.last_review = time.time()
+
+    def _resize(self, n: int) -> None:
+        old = len(self.full)
+        if n <= old:
+            return
+        self.full = np.concatenate([self.full, np.full(n - old, not self.tiering)])
+        self.since = np.concatenate([self.since, np.full(n - old, time.time())])
+        self.last_vol = np.concatenate([self.last_vol, np.full(n - old, -1, dtype=np.int64)])
+
+    def mode_of(self, sid: str) -> str:
+        slot = self.hub.state.slot_of.get(int(sid))
+        return "full" if slot is None or slot >= len(self.full) or self.full[slot] else self.quiet_mode
+
+    # ---- tiers --------------------------------------------------------------
+    def review(self, now: Optional[float] = None) -> None:
+        """Promote and demote on traded value per minute since the previous review."""
+        now = now or time.time()
+        state = self.hub.state
+        n = min(len(state), len(self.full))
+        minutes = max(1e-9, (now - self.last_review) / 60)
+        self.last_review = now
+        cum_vol = state.cum_vol[:n].copy()
+        ticked = state.ltt[:n] > 0
+        last = self.last_vol[:n]
+        rate_cr = np.where(last >= 0, (cum_vol - last) * state.ltp[:n], 0.0) / CR_UNIT / minutes
+        # The first packet carries the day's volume so far; start counting from it.
+        self.last_vol[:n] = np.where(ticked, cum_vol, -1)
+        if not self.tiering:
+            return
+
+        full = self.full[:n]
+        promote = np.flatnonzero(~full & (rate_cr >= self.promote_cr))
+        demote = np.flatnonzero(full & (rate_cr < self.demote_cr) & (now - self.since[:n] >= self.hold_seconds))
+        self._switch(promote, True, now)
+        self._switch(demote, False, now)
+        self.promoted += len(promote)
+        self.demoted += len(demote)
+
+    def _switch(self, slots: np.ndarray, to_full: bool, now: float) -> None:
+        if not len(slots):
+            return
+        self.full[slots] = to_full
+        self.since[slots] = now
+        security_ids = self.hub.state.security_ids
+        by_conn: Dict[int, List[str]] = {}
+        for slot in slots.tolist():
+            conn = self.hub.conn_of.get(str(security_ids[slot]))
+            if conn is not None:
+                by_conn.setdefault(conn.index, []).append(str(security_ids[slot]))
+        old, new = ("full", self.quiet_mode) if not to_full else (self.quiet_mode, "full")
+        for index, sids in by_conn.items():
+            self.hub.shards[index].change(sids, UNSUBSCRIBE[old], SUBSCRIBE[new])
+
+    # ---- universe -----------------------------------------------------------
+    def refresh(self) -> None:
+        """Re-run the universe filters and subscribe/unsubscribe the difference."""
+        instruments = self.fetch() if self.fetch is not None else {}
+        if not instruments:
+            print("⚠️ Universe refresh returned nothing; keeping the current universe.")
+            return
+        hub = self.hub
+        current = set(hub.conn_of)
+        wanted = {str(sid): symbol for sid, symbol in instruments.items()}
+        added = {int(sid): symbol for sid, symbol in wanted.items() if sid not in current}
+        gone = [sid for sid in current if sid not in wanted]
+        if len(gone) > REFRESH_MAX_DROP * len(current):
+            print(f"⚠️ Universe refresh would drop {len(gone)} of {len(current)} stocks; only adding.")
+            gone = []
+
+        if gone:
+            by_conn: Dict[int, List[str]] = {}
+            for sid in gone:
+                by_conn.setdefault(hub.conn_of[sid].index, []).append(sid)
+            for index, sids in by_conn.items():
+                hub.shards[index].remove(sids, [UNSUBSCRIBE[self.mode_of(sid)] for sid in sids])
+            for sid in gone:
+                del hub.conn_of[sid]
+            hub.sids = list(hub.conn_of)
+        if added:
+            hub.add(added)
+            self._resize(len(hub.state))
+            for slot in (hub.state.slot_of[sid] for sid in added):
+                self.full[slot] = not self.tiering
+                self.last_vol[slot] = -1
+            by_conn = {}
+            for sid in added:
+                conn = hub.conn_of.get(str(sid))
+                if conn is not None:
+                    by_conn.setdefault(conn.index, []).append(str(sid))
+            for index, sids in by_conn.items():
+                hub.shards[index].subscribe(sids, [SUBSCRIBE[self.mode_of(sid)] for sid in sids])
+
+        self.added += len(added)
+        self.removed += len(gone)
+        self.refreshed_at = datetime.now(IST).strftime("%H:%M")
+        print(f"🔄 Universe refreshed: +{len(added)} -{len(gone)} ({len(hub.conn_of)} stocks)")
+
+    # ---- thread -------------------------------------------------------------
+    def run(self, stopping: threading.Event) -> None:
+        next_refresh = time.time() + self.refresh_seconds if self.refresh_seconds else float("inf")
+        while not stopping.wait(self.review_seconds):
+            try:
+                with self.lock:
+                    self.review()
+                    if self.fetch is not None and time.time() >= next_refresh:
+                        next_refresh = time.time() + self.refresh_seconds
+                        self.refresh()
+            except Exception as e:
+                print(f"⚠️ Subscription update failed: {e}")
+
+    def describe(self) -> str:
+        parts = []
+        if self.tiering:
+            slot_of = self.hub.state.slot_of
+            full = self.full
+            # refresh() resizes `full` only after hub.add(), so a new slot can be past its end for a moment.
+            subscribed = [slot for slot in (slot_of[int(sid)] for sid in list(self.hub.conn_of)) if slot < len(full)]
+            n = int(full[subscribed].sum())
+            parts.append(f"Tiers: full {n} / {self.quiet_mode} {len(subscribed) - n} "
+                         f"(+{self.promoted} -{self.demoted})")
+        if self.refreshed_at:
+            parts.append(f"Universe: +{self.added} -{self.removed} (last {self.refreshed_at})")
+        return " | ".join(parts)
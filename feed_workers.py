@@ -0,0 +1,273 @@
+"""
+Feed analysis sharded over worker processes, state in shared memory.
+
+One FeedHub decodes and analyzes on threads of one process, so the GIL
+caps it at about one core. With FEED_WORKERS=N (2..5) the streamers
+instead start N worker processes, each running its own FeedHub and
+analyzers over the instruments whose security id hashes to it
+(worker_of()), on its own websocket connection(s) - Dhan's limit of 5
+connections per client is why N tops out at 5. The workers share that
+limit: each may open at most MAX_CONNECTIONS // N sockets, and the
+supervisor refuses to start if a worker's instruments would not fit.
+
+Every analyzer's FeedState columns live in multiprocessing.shared_memory
+blocks created by the supervisor (this process) for the whole universe.
+Each worker attaches to them and assigns the same slots, but only
+subscribes (and so only ever writes) its own instruments' rows, so no
+locking is needed. The bookkeeping columns (LOCAL_COLUMNS: the dirty
+flags and raw packets) stay private to each process instead: a worker's
+timer only ever sees, evaluates and cools down the slots it ticked
+itself, never another worker's. The supervisor maps the same blocks and reads the
+global state in place - its heartbeat shows the universe's top traded
+value across all workers without copying anything between processes.
+A worker that dies is restarted and carries on from the shared state, with
+its windows and cooldowns intact. The supervisor, not the workers, writes
+the checkpoint (feed_checkpoint.py) and resumes from it.
+
+Shared columns cannot grow, so workers do not refresh the universe
+intraday (UNIVERSE_REFRESH_MINUTES is ignored); tiering still applies per
+worker. Feed captures go to FEED_CAPTURE_DIR/worker<N> and metrics to
+FEED_METRICS_FILE with -<N> before the extension.
+
+    FEED_WORKERS=4 python dhan_feed_hub.py
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+import dhan_feed
+import dhan_feed_hub
+import feed_checkpoint
+from dhan_feed_hub import IST, MAX_CONNECTIONS, MAX_PER_CONNECTION, Analyzer, FeedHub, build_universe
+from feed_checkpoint import FEED_CHECKPOINT_FILE, Checkpointer, checkpoint_path
+from market_calendar import DaySchedule, MarketCalendar
+
+
+# 0 or 1 = one process (run_hub); 2..MAX_CONNECTIONS = that many workers.
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", 0))
+SUPERVISOR_SECONDS = 60
+TOP_SECONDS = 300           # window the supervisor ranks stocks by
+TOP_COUNT = 5
+JOIN_SECONDS = 15
+
+
+# Per-process columns: only the owning worker's timer may take them.
+LOCAL_COLUMNS = ("dirty", "packets")
+
+
+def worker_of(sec_id: int, workers: int) -> int:
+    """Worker owning `sec_id`: a multiplicative hash, stable across processes (unlike hash(str))."""
+    return ((int(sec_id) * 2654435761) & 0xFFFFFFFF) % workers
+
+
+def connection_budget(workers: int) -> int:
+    """Sockets each of `workers` may open, so together they stay within MAX_CONNECTIONS."""
+    return max(1, MAX_CONNECTIONS // workers)
+
+
+class SharedFeedState(dhan_feed.FeedState):
+    """
+    A FeedState whose columns are shared-memory blocks named
+    "<name>-<column>": created (and filled) with create=True, attached
+    as they are otherwise. LOCAL_COLUMNS stay in this process. Capacity
+    is fixed at the universe size.
+    """
+
+    def __init__(self, instruments: Mapping[int, str], *args, name: str = "", create: bool = False, **kwargs):
+        self.name = name
+        self.create = create
+        self.blocks: List[SharedMemory] = []
+        super().__init__(instruments, *args, **kwargs)
+
+    def _alloc(self, column: str, shape, dtype, fill) -> np.ndarray:
+        if column in LOCAL_COLUMNS:
+            return super()._alloc(column, shape, dtype, fill)
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        block = SharedMemory(f"{self.name}-{column}", create=self.create, size=size if self.create else 0)
+        self.blocks.append(block)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if self.create and fill:
+            array.fill(fill)       # new blocks are zeroed already
+        return array
+
+    def _grow(self) -> None:
+        raise RuntimeError(f"Shared FeedState {self.name} is full ({self.capacity} slots)")
+
+    def unlink(self) -> None:
+        """Remove the blocks (supervisor, at shutdown); live mappings stay valid until exit."""
+        for block in self.blocks:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def share_states(analyzers: Sequence[Analyzer], prefix: str, create: bool) -> None:
+    """Make each analyzer build its FeedState in shared memory named after `prefix` and itself."""
+    for analyzer in analyzers:
+        analyzer.state_factory = functools.partial(SharedFeedState, name=f"{prefix}-{analyzer.name}", create=create)
+
+
+def run_worker(index: int, workers: int, factories: Sequence[Callable[[], Analyzer]],
+               instruments: Dict[int, str], prefix: str, schedule: DaySchedule, feed_url: str) -> None:
+    """Worker process: a FeedHub over every slot, subscribed to this worker's instruments only."""
+    dhan_feed_hub.FEED_URL = feed_url
+    if dhan_feed_hub.FEED_METRICS_FILE:
+        root, ext = os.path.splitext(dhan_feed_hub.FEED_METRICS_FILE)
+        dhan_feed_hub.FEED_METRICS_FILE = f"{root}-{index}{ext}"
+    analyzers = [factory() for factory in factories]
+    share_states(analyzers, prefix, create=False)
+    # Each worker captures its own frames, to its own subdirectory.
+    capture_dir = os.path.join(dhan_feed_hub.FEED_CAPTURE_DIR, f"worker{index}") if dhan_feed_hub.FEED_CAPTURE_DIR else ""
+    hub = FeedHub(analyzers, capture_dir=capture_dir, checkpoint_file="",
+                  max_connections=connection_budget(workers))
+    hub.start(instruments, subscribe=[sid for sid in instruments if worker_of(sid, workers) == index])
+    print(f"👷 Worker #{index} (pid {os.getpid()}): {len(hub.sids)} stocks")
+    if dhan_feed_hub.FEED_CLIENT == "asyncio":
+        asyncio.run(hub.run_async(schedule))
+    else:
+        hub.run(schedule)
+
+
+class ShardSupervisor:
+    """
+    Creates the shared state, runs the workers (restarting any that die
+    while the session is on) and reports on the global state.
+    """
+
+    def __init__(self, factories: Sequence[Callable[[], Analyzer]], workers: int = FEED_WORKERS,
+                 checkpoint_file: str = FEED_CHECKPOINT_FILE):
+        if workers > MAX_CONNECTIONS:
+            print(f"⚠️ {workers} workers need more than {MAX_CONNECTIONS} connections; using {MAX_CONNECTIONS}.")
+        self.factories = list(factories)
+        self.workers = max(1, min(workers, MAX_CONNECTIONS))
+        self.prefix = f"feed{os.getpid()}"
+        self.context = multiprocessing.get_context("spawn")
+        self.analyzers: List[Analyzer] = [factory() for factory in self.factories]
+        self.instruments: Dict[int, str] = {}
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self.restarts = 0
+        self.stopping = threading.Event()
+        checkpoint_file = checkpoint_path((a.name for a in self.analyzers), checkpoint_file)
+        self.checkpointer = Checkpointer(checkpoint_file, self.checkpoint_source) if checkpoint_file else None
+
+    @property
+    def states(self) -> Dict[str, dhan_feed.FeedState]:
+        return {analyzer.name: analyzer.state for analyzer in self.analyzers}
+
+    def checkpoint_source(self):
+        return list(self.instruments.items()), self.states, None
+
+    def start(self, instruments: Mapping[int, str]) -> None:
+        """Create every analyzer's shared state for `instruments` (slots in the same order as the workers')."""
+        budget = connection_budget(self.workers)
+        load = [0] * self.workers
+        for sec_id in instruments:
+            load[worker_of(sec_id, self.workers)] += 1
+        if max(load) > budget * MAX_PER_CONNECTION:
+            raise RuntimeError(
+                f"Worker #{load.index(max(load))} has {max(load)} stocks but only {budget} connection(s) "
+                f"x {MAX_PER_CONNECTION}; run fewer FEED_WORKERS or a smaller universe")
+        self.instruments = dict(instruments)
+        share_states(self.analyzers, self.prefix, create=True)
+        for analyzer in self.analyzers:
+            analyzer.start(self.instruments)
+
+    def spawn(self, index: int, schedule: DaySchedule) -> None:
+        process = self.context.Process(
+            target=run_worker, name=f"feed-worker-{index}", daemon=True,
+            args=(index, self.workers, self.factories, self.instruments, self.prefix, schedule,
+                  dhan_feed_hub.FEED_URL))
+        process.start()
+        self.processes[index] = process
+
+    def run(self, schedule: DaySchedule) -> None:
+        """Run the workers until the session in `schedule` ends, then unlink the shared state."""
+        if self.checkpointer is not None:
+            threading.Thread(target=self.checkpointer.run, args=(self.stopping,), daemon=True).start()
+        try:
+            for index in range(self.workers):
+                self.spawn(index, schedule)
+            while schedule.is_active(include_pre_open=True):
+                left = (schedule.stop_at - datetime.now(tz=schedule.stop_at.tzinfo)).total_seconds()
+                time.sleep(max(0.5, min(SUPERVISOR_SECONDS, left)))
+                if not schedule.is_active(include_pre_open=True):
+                    break
+                for index, process in enumerate(self.processes):
+                    if process is not None and not process.is_alive():
+                        print(f"⚠️ Worker #{index} exited ({process.exitcode}). Restarting...")
+                        self.restarts += 1
+                        self.spawn(index, schedule)
+                print(self.describe())
+            print(f"🕒 Market closed ({datetime.now(IST).strftime('%H:%M')}). Waiting for workers...")
+            for process in self.processes:
+                if process is not None:
+                    process.join(JOIN_SECONDS)
+        finally:
+            self.stopping.set()
+            for process in self.processes:
+                if process is not None and process.is_alive():
+                    process.terminate()
+            for analyzer in self.analyzers:
+                if isinstance(analyzer.state, SharedFeedState):
+                    analyzer.state.unlink()
+
+    def top_traded(self, name: str = "volume", seconds: int = TOP_SECONDS, count: int = TOP_COUNT):
+        """(symbol, traded value in Cr) of the `count` busiest stocks over `seconds`, across every worker."""
+        state = self.states.get(name)
+        if state is None or not len(state):
+            return []
+        values = state.window_values(np.arange(len(state)), seconds)
+        count = min(count, len(values))
+        top = np.argpartition(values, -count)[-count:]
+        top = top[np.argsort(values[top])[::-1]]
+        return [(state.symbols[slot], values[slot] / 1e7) for slot in top.tolist() if values[slot] > 0]
+
+    def describe(self) -> str:
+        alive = sum(1 for p in self.processes if p is not None and p.is_alive())
+        parts = [f"💓 Supervisor: {datetime.now(IST).strftime('%H:%M:%S')}",
+                 f"Workers: {alive}/{self.workers} alive"]
+        if self.restarts:
+            parts.append(f"Restarts: {self.restarts}")
+        for name, state in self.states.items():
+            ticked = int((state.last_bucket[:len(state)] >= 0).sum())
+            if ticked:
+                parts.append(f"{name}: {ticked}/{len(state)} ticking")
+        top = self.top_traded()
+        if top:
+            parts.append(f"Top {TOP_SECONDS // 60}m: " + ", ".join(f"{sym} {cr:.1f} Cr" for sym, cr in top))
+        if self.checkpointer is not None and self.checkpointer.describe():
+            parts.append(self.checkpointer.describe())
+        return " | ".join(parts)
+
+
+def run_sharded(factories: Sequence[Callable[[], Analyzer]], workers: int = FEED_WORKERS) -> None:
+    """run_hub() over `workers` processes; `factories` build the analyzers (e.g. the classes)."""
+    print(f"🎬 Script Started at {datetime.now(IST)} ({workers} workers)")
+    schedule = MarketCalendar().schedule()
+    supervisor = ShardSupervisor(factories, workers)
+    checkpoint = feed_checkpoint.load(supervisor.checkpointer.path) if supervisor.checkpointer is not None else None
+    if checkpoint is not None and not checkpoint.matches(a.name for a in supervisor.analyzers):
+        print(f"⚠️ {supervisor.checkpointer.path} was saved by other analyzers; starting fresh.")
+        checkpoint = None
+    if checkpoint is not None:
+        instruments = checkpoint.instruments
+    else:
+        instruments, _refresh = build_universe(schedule)
+    if not instruments:
+        return
+    supervisor.start(instruments)
+    if checkpoint is not None:
+        # Restored into the shared blocks before any worker attaches.
+        restored = checkpoint.restore(supervisor.states)
+        print(f"♻️ Resumed {len(instruments)} stocks from the checkpoint saved "
+              f"{checkpoint.age_seconds:.0f}s ago ({', '.join(restored) or 'no state'} restored)")
+    supervisor.run(schedule)
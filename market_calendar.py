@@ -0,0 +1,205 @@
+"""
+Shared NSE trading calendar and session model.
+
+Every loop in this repo used to hard-code its own close time and ran on
+weekends and holidays too. Build one DaySchedule per run and consult it
+once per cycle instead:
+
+    schedule = MarketCalendar().schedule(stop_before=timedelta(minutes=15))
+    if not wait_until_open(schedule):
+        return                      # holiday / weekend / already closed
+    while schedule.is_active():
+        ...
+
+Holidays and special sessions (Muhurat trading, Saturday budget sessions,
+...) come from nse_holidays.json next to this file (override the path with
+NSE_HOLIDAYS_FILE):
+
+    {
+      "holidays": {"2026-01-26": "Republic Day", ...},
+      "special_sessions": {
+        "2026-11-08": {"name": "Muhurat Trading", "pre_open": "17:45",
+                       "open": "18:00", "close": "19:00"}
+      }
+    }
+
+A special session overrides both the weekend rule and a holiday entry.
+"""
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional
+
+from zoneinfo import ZoneInfo
+
+
+logger = logging.getLogger("Market_Calendar")
+
+IST_ZONE = ZoneInfo("Asia/Kolkata")
+
+PRE_OPEN_IST = dt_time(9, 0)
+MARKET_OPEN_IST = dt_time(9, 15)
+MARKET_CLOSE_IST = dt_time(15, 30)
+
+HOLIDAYS_FILE = Path(os.environ.get(
+    "NSE_HOLIDAYS_FILE", Path(__file__).with_name("nse_holidays.json")
+))
+
+
+class Session(NamedTuple):
+    day: date
+    pre_open: datetime
+    open: datetime
+    close: datetime
+    name: str = "Normal"
+
+
+class DaySchedule:
+    """
+    The precomputed session bounds for one day. phase()/is_active() are just
+    datetime comparisons, cheap enough to call on every loop iteration.
+    """
+
+    def __init__(self, day: date, session: Optional[Session], next_session: Optional[Session],
+                 stop_before: timedelta = timedelta(0), reason: str = ""):
+        self.day = day
+        self.session = session
+        self.next_session = next_session
+        self.reason = reason
+        self.stop_at = session.close - stop_before if session else None
+
+    @property
+    def is_trading_day(self) -> bool:
+        return self.session is not None
+
+    def phase(self, now: Optional[datetime] = None) -> str:
+        """One of "closed", "pre_open", "open", "after_close"."""
+        if self.session is None:
+            return "closed"
+        now = now or datetime.now(tz=IST_ZONE)
+        if now < self.session.pre_open:
+            return "closed"
+        if now < self.session.open:
+            return "pre_open"
+        if now < self.stop_at:
+            return "open"
+        return "after_close"
+
+    def is_active(self, now: Optional[datetime] = None, include_pre_open: bool = False) -> bool:
+        phase = self.phase(now)
+        return phase == "open" or (include_pre_open and phase == "pre_open")
+
+    def describe(self) -> str:
+        if self.session is None:
+            nxt = self.next_session.open.strftime("%a %d-%b %H:%M") if self.next_session else "unknown"
+            return f"{self.day} closed ({self.reason}); next open {nxt} IST"
+        return (
+            f"{self.day} {self.session.name} session: pre-open {self.session.pre_open:%H:%M}, "
+            f"open {self.session.open:%H:%M}, stop {self.stop_at:%H:%M} IST"
+        )
+
+
+class MarketCalendar:
+    def __init__(self, path: Path = HOLIDAYS_FILE):
+        self.path = path
+        self.holidays: Dict[date, str] = {}
+        self.special: Dict[date, Dict[str, str]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            logger.warning("Holiday file %s not found; only weekends are treated as closed", self.path)
+            return
+        try:
+            with open(self.path, "r") as f:
+                raw = json.load(f)
+            self.holidays = {
+                date.fromisoformat(day): name
+                for day, name in raw.get("holidays", {}).items()
+            }
+            self.special = {
+                date.fromisoformat(day): spec
+                for day, spec in raw.get("special_sessions", {}).items()
+            }
+        except (json.JSONDecodeError, OSError, ValueError) as e:
+            logger.warning("Could not read holiday file (%s), ignoring it: %s", self.path, e)
+
+    @staticmethod
+    def _at(day: date, value) -> datetime:
+        if isinstance(value, str):
+            value = dt_time.fromisoformat(value)
+        return datetime.combine(day, value, tzinfo=IST_ZONE)
+
+    def closed_reason(self, day: date) -> Optional[str]:
+        if day in self.special:
+            return None
+        if day in self.holidays:
+            return self.holidays[day]
+        if day.weekday() >= 5:
+            return "weekend"
+        return None
+
+    def session(self, day: date) -> Optional[Session]:
+        """The session held on `day`, or None if the market is shut."""
+        spec = self.special.get(day)
+        if spec:
+            open_at = self._at(day, spec["open"])
+            return Session(
+                day,
+                self._at(day, spec.get("pre_open", spec["open"])),
+                open_at,
+                self._at(day, spec["close"]),
+                spec.get("name", "Special"),
+            )
+        if self.closed_reason(day):
+            return None
+        return Session(day, self._at(day, PRE_OPEN_IST), self._at(day, MARKET_OPEN_IST),
+                       self._at(day, MARKET_CLOSE_IST))
+
+    def next_session(self, after: datetime, horizon_days: int = 15) -> Optional[Session]:
+        """First session whose close is later than `after`."""
+        day = after.astimezone(IST_ZONE).date()
+        for _ in range(horizon_days):
+            sess = self.session(day)
+            if sess and sess.close > after:
+                return sess
+            day += timedelta(days=1)
+        return None
+
+    def schedule(self, day: Optional[date] = None, stop_before: timedelta = timedelta(0)) -> DaySchedule:
+        """
+        Precompute today's (or `day`'s) bounds. stop_before ends the active
+        window early, e.g. 15 minutes for scripts that stop notifying at 15:15.
+        """
+        day = day or datetime.now(tz=IST_ZONE).date()
+        sess = self.session(day)
+        nxt = self.next_session(self._at(day, dt_time(23, 59)) if sess else self._at(day, dt_time(0, 0)))
+        return DaySchedule(day, sess, nxt, stop_before, reason=self.closed_reason(day) or "")
+
+
+def wait_until_open(schedule: DaySchedule, include_pre_open: bool = False,
+                    log: Callable[[str], None] = logger.info) -> bool:
+    """
+    Sleep until the session opens (or pre-opens). Returns False straight
+    away when there is nothing left to wait for today - a holiday, a
+    weekend, or the session is already over - so the caller can exit
+    instead of polling a closed market.
+    """
+    log(schedule.describe())
+    if not schedule.is_trading_day:
+        return False
+
+    target = schedule.session.pre_open if include_pre_open else schedule.session.open
+    while True:
+        phase = schedule.phase()
+        if phase == "after_close":
+            log("Session already over for today.")
+            return False
+        if phase == "open" or (include_pre_open and phase == "pre_open"):
+            return True
+        wait = (target - datetime.now(tz=IST_ZONE)).total_seconds()
+        log(f"Market not open yet; sleeping {wait / 60:.1f} min until {target:%H:%M} IST")
+        time.sleep(max(1.0, min(wait, 300)))
@@ -0,0 +1,216 @@
+"""
+Local stand-in for the nseindia.com pages used by NSE_Most_Active_Stocks.py.
+
+Serves the two warmup pages (which hand out the session cookies) and the
+most-active endpoint (which refuses requests without them), with optional
+fault injection so the monitor's 401/403 retry path, timeouts and JSON
+handling can be exercised offline:
+
+    python nse_api_standin.py --port 8765 --symbols 500 --forbid-rate 0.05
+
+then point the monitor at it with NSEMarketMonitor(base_url="http://127.0.0.1:8765").
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+)
+logger = logging.getLogger("NSE_Standin")
+
+
+WARMUP_PATHS = {"/", "/market-data/most-active-equities"}
+API_PATH = "/api/live-analysis-most-active-securities"
+COOKIE_NAMES = ("nsit", "nseappid")
+
+
+# --------------------------------------------------------------------------
+# Synthetic market
+# --------------------------------------------------------------------------
+class SyntheticMarket:
+    """
+    A random walk over `n_symbols` stocks. Every call to rows() advances the
+    walk by one step, so consecutive polls see moving pChange values and a
+    steady trickle of symbols crossing the ±2% thresholds.
+    """
+
+    def __init__(self, n_symbols: int = 500, volatility: float = 0.35, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.volatility = volatility
+        self.lock = threading.Lock()
+        self.stocks = []
+        for i in range(n_symbols):
+            prev_close = round(self.rng.uniform(20, 3000), 2)
+            self.stocks.append({
+                "symbol": f"SYM{i:04d}",
+                "previousClose": prev_close,
+                "lastPrice": prev_close,
+                "totalTradedVolume": 0,
+            })
+
+    def rows(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            out = []
+            for s in self.stocks:
+                s["lastPrice"] = max(0.05, s["lastPrice"] * (1 + self.rng.gauss(0, self.volatility) / 100))
+                s["totalTradedVolume"] += self.rng.randint(0, 50_000)
+                change = s["lastPrice"] - s["previousClose"]
+                out.append({
+                    "symbol": s["symbol"],
+                    "lastPrice": round(s["lastPrice"], 2),
+                    "change": round(change, 2),
+                    "pChange": round(change / s["previousClose"] * 100, 2),
+                    "previousClose": s["previousClose"],
+                    "totalTradedVolume": s["totalTradedVolume"],
+                    "totalTradedValue": round(s["totalTradedVolume"] * s["lastPrice"], 2),
+                })
+            return out
+
+
+# --------------------------------------------------------------------------
+# HTTP handler
+# --------------------------------------------------------------------------
+class StandinConfig:
+    def __init__(self, forbid_rate: float = 0.0, slow_rate: float = 0.0,
+                 slow_seconds: float = 2.0, malformed_rate: float = 0.0,
+                 cookie_ttl: float = 300.0):
+        self.forbid_rate = forbid_rate        # 403 even with valid cookies
+        self.slow_rate = slow_rate            # delay the API response
+        self.slow_seconds = slow_seconds
+        self.malformed_rate = malformed_rate  # truncated / non-JSON body
+        self.cookie_ttl = cookie_ttl          # seconds before cookies go stale
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, market: SyntheticMarket, config: StandinConfig):
+        super().__init__(address, StandinHandler)
+        self.market = market
+        self.config = config
+        self.rng = random.Random()
+        self.issued: Dict[str, float] = {}  # cookie value -> issued at
+        self.stats = {"warmup": 0, "api_ok": 0, "api_401": 0, "api_403": 0,
+                      "api_slow": 0, "api_malformed": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] += 1
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server: StandinServer
+
+    def log_message(self, fmt, *args):  # keep benchmark output quiet
+        logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json",
+              cookies: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (cookies or {}).items():
+            self.send_header("Set-Cookie", f"{name}={value}; Path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cookie_valid(self) -> Optional[bool]:
+        """None = no cookies at all, False = stale/unknown, True = ok."""
+        raw = self.headers.get("Cookie", "")
+        jar = dict(part.strip().split("=", 1) for part in raw.split(";") if "=" in part)
+        if not all(name in jar for name in COOKIE_NAMES):
+            return None
+        issued_at = self.server.issued.get(jar["nsit"])
+        if issued_at is None:
+            return False
+        return time.monotonic() - issued_at < self.server.config.cookie_ttl
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        srv = self.server
+        cfg = srv.config
+
+        if url.path in WARMUP_PATHS:
+            token = f"{srv.rng.getrandbits(64):016x}"
+            srv.issued[token] = time.monotonic()
+            srv.count("warmup")
+            self._send(200, b"<html><body>NSE stand-in</body></html>", "text/html",
+                       cookies={"nsit": token, "nseappid": token[::-1]})
+            return
+
+        if url.path != API_PATH:
+            self._send(404, b'{"error": "not found"}')
+            return
+
+        valid = self._cookie_valid()
+        if valid is None:
+            srv.count("api_401")
+            self._send(401, b'{"error": "unauthorized"}')
+            return
+        if not valid or srv.rng.random() < cfg.forbid_rate:
+            srv.count("api_403")
+            self._send(403, b"<html>Access Denied</html>", "text/html")
+            return
+
+        if srv.rng.random() < cfg.slow_rate:
+            srv.count("api_slow")
+            time.sleep(cfg.slow_seconds)
+
+        index = parse_qs(url.query).get("index", ["value"])[0]
+        rows = srv.market.rows()
+        key = "totalTradedValue" if index == "value" else "totalTradedVolume"
+        rows.sort(key=lambda r: r[key], reverse=True)
+        body = json.dumps({"data": rows, "timestamp": time.strftime("%d-%b-%Y %H:%M:%S")}).encode()
+
+        if srv.rng.random() < cfg.malformed_rate:
+            srv.count("api_malformed")
+            body = body[: len(body) // 2]
+        else:
+            srv.count("api_ok")
+        self._send(200, body)
+
+
+def start_standin(port: int = 0, n_symbols: int = 500, config: Optional[StandinConfig] = None,
+                  seed: Optional[int] = None) -> StandinServer:
+    """Start the stand-in on a background thread; port=0 picks a free port."""
+    server = StandinServer(("127.0.0.1", port), SyntheticMarket(n_symbols, seed=seed),
+                           config or StandinConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("NSE stand-in listening on http://127.0.0.1:%s", server.server_address[1])
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the NSE most-active API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--forbid-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-seconds", type=float, default=2.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--cookie-ttl", type=float, default=300.0)
+    args = parser.parse_args()
+
+    srv = start_standin(args.port, args.symbols, StandinConfig(
+        forbid_rate=args.forbid_rate,
+        slow_rate=args.slow_rate,
+        slow_seconds=args.slow_seconds,
+        malformed_rate=args.malformed_rate,
+        cookie_ttl=args.cookie_ttl,
+    ))
+    try:
+        while True:
+            time.sleep(60)
+            logger.info("Stats: %s", srv.stats)
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -1,100 +1,60 @@
-import os, asyncio, pytz, threading, json, websocket, struct, requests, time, re, pandas as pd
-from io import StringIO
-from collections import deque
-from datetime import datetime
+import os, threading, requests, time
+from typing import NamedTuple
 from dotenv import load_dotenv
+import numpy as np
+import dhan_feed
+from dhan_feed_hub import Analyzer, run_hub
+from volume_baseline import SpikeThresholds, VolumeBaseline
 
 load_dotenv()
 # --- CONFIG ---
 SIGNAL_AMOUNT = float(os.getenv("SIGNAL_AMOUNT"))
-DHAN_CLIENT_ID = os.getenv("DHAN_CLIENT_ID")
-DHAN_ACCESS_TOKEN = os.getenv("DHAN_ACCESS_TOKEN")
-IST = pytz.timezone("Asia/Kolkata")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 
 # --- PARAMETERS ---
 VOL_5MIN_THRESHOLD_CR = 70.0
+VOL_BUCKET_SECONDS = 1
+# > 0: packets only update the analyzer's FeedState and every VOL_EVAL_MS a
+#   timer checks all stocks ticked since the last check at once with NumPy.
+#   0: check each packet inline as it arrives.
+VOL_EVAL_MS = int(os.getenv("VOL_EVAL_MS", 0))
 COOLDOWN_SECONDS = 800 
 CR_UNIT = 10_000_000
 
-# --- STATE ---
-alert_cooldowns = {}
-volume_history = {} 
-ID_TO_SYMBOL = {}
-SIDS_LIST = []
-packets_received = 0
 
+class SpikeWindow(NamedTuple):
+    seconds: int
+    threshold_cr: float
+    cooldown_seconds: float
 
-# ============================================================= #
-#                INSTRUMENT FETCH & FILTERING                   #
-# ============================================================= #
-# EXCLUDED_SYMBOLS = {"M&M", "BEL", "JISLJALEQS", "ABCAPITAL", "HDFCLIFE", "NSLNISP", "ASIANPAINT", "HEROMOTOCO","IDEA","SBIN","CANB","CENTRALBK","BANKBARODA","IDBI", "NATIONALUM", "NMDC", "SAMMAANCAP", "NESTLEIND", "IDBI", "JIOFIN", "GAEL", "ITC", "FMCGIETF","HDFCGOLD", "MON100", "PSUBNKBEES", "SILVERBEES", "ITBEES", "ITIETF", "NIFTYBEES", "CONSUMBEES", "ALPHA", "AUTOBEES", "MASPTOP50", "SILVERETF", "SILVERIETF", "LTF", "HNGSNGBEES", "SOUTHBANK", "HINDALCO","ICICIPRULI","TATSILV", "IRB", "TECHM", "SAIL", "POWERGRID", "CANB", "IREDA", "IRCON", "BEML", "AXISBANK", "BANKBEES", "BANKIETF", "BANKNIFTY1", "HDFCBANK", "ICICIBANK", "KOTAKBANK", "KTKBANK", "PSUBANK", "PSUBANKADD",     "PVTBANKADD", "RBLBANK", "UTIBANKETF", "YESBANK", "ETERNAL", "SBIN", "NTPC", "BHEL", "RECLTD", "WIPRO", "INFY", "MSUMI", "MOTHERSON", "ABFRL", "DELHIVERY", "RELIANCE", "TCS", "TATACHEM",  "TATACOMM", "TATACONSUM", "TATAELXSI", "TATAINVEST", "TATAMOTORS", "TATAPOWER", "TATASTEEL","SILVER360","ABSLPSE","SILVER","AXISILVER","SILVERBND","EQUAL50ADD","ESILVER","IT","BFSI","SILVERAG","MOSILVER","SILVERBETA", "TATATECH", "Zerodha Nifty 1D Rate Liquid ETF", "ALLCARGO", "HDFCSILVER", "SILVER1", "SILVERADD", "SBISILVER","GOLD360","GOLD360","BSLNIFTY","AXISGOLD","GOLDBND","BBNPPGOLD","ICICIB22","CHOICEGOLD","GOLDADD","TOP10ADD","EGOLD","ELM250","GROWWGOLD","GROWWDEFNC","GROWWRAIL","HDFCNIFBAN","HDFCMID150","HDFCSML250","HDFCSENSEX","IVZINGOLD","GOLD1","MIDCAP","LICMFGOLD","MIDSMALL","MAFANG","LIQUID","MAKEINDIA","METAL","NEXT50","SMALLCAP","MOGOLD","MOM100","MONQ50","MONIFTY500","MOMENTUM50","MOCAPITAL","MODEFENCE","MOREALTY","MOSMALL250","MOVALUE","QGOLDHALF","SBIBPB","SENSEXBETA","BANKBETA","NEXT50BETA","UNIONGOLD","GOLDBETA","TATAGOLD"}
-with open("excluded_symbols.json") as f:
-    EXCLUDED_SYMBOLS = set(json.load(f))
-    
-print("Excluded symbols loaded:", EXCLUDED_SYMBOLS)
+    @property
+    def label(self):
+        return f"{self.seconds // 60}m" if self.seconds % 60 == 0 else f"{self.seconds}s"
 
-def fetch_and_build_list():
-    global ID_TO_SYMBOL, SIDS_LIST
-    print("⬇️ Fetching live instrument master...")
 
-    headers = {
-        'access-token': DHAN_ACCESS_TOKEN, 
-        'client-id': DHAN_CLIENT_ID, 
-        'Content-Type': 'application/json'
-    }
+def parse_windows(spec):
+    """"60:25:300,300:70:800" -> SpikeWindows (seconds:threshold Cr:cooldown seconds), shortest first."""
+    windows = []
+    for part in spec.split(","):
+        seconds, threshold_cr, cooldown_seconds = part.split(":")
+        windows.append(SpikeWindow(int(seconds), float(threshold_cr), float(cooldown_seconds)))
+    return sorted(windows)
 
-    try:
-        resp = requests.get("https://api.dhan.co/v2/instrument/NSE_EQ", headers=headers)
-        inst_df = pd.read_csv(StringIO(resp.text))
-        inst_df = inst_df[(inst_df["EXCH_ID"] == "NSE") & (inst_df["SEGMENT"] == "E") & (inst_df["INSTRUMENT_TYPE"] == "ES")]
-        inst_df = inst_df[["SECURITY_ID", "UNDERLYING_SYMBOL"]].rename(columns={"UNDERLYING_SYMBOL": "Symbol"})
-        inst_df["Symbol"] = inst_df["Symbol"].str.upper().str.strip()
-
-        print("📊 Fetching leverage sheet...")
-        sheet_url = "https://docs.google.com/spreadsheets/d/1zqhM3geRNW_ZzEx62y0W5U2ZlaXxG-NDn0V8sJk5TQ4/gviz/tq?tqx=out:csv&gid=1663719548"
-        lev_df = pd.read_csv(sheet_url)
-        
-        # Identify symbol column dynamically
-        symbol_col = lev_df.columns[lev_df.columns.get_loc("Sr.") + 1]
-        lev_df = lev_df.rename(columns={symbol_col: "Symbol"})
-        lev_df["Symbol"] = lev_df["Symbol"].astype(str).str.upper().str.strip()
-        lev_df["MIS"] = pd.to_numeric(lev_df["MIS (Intraday)"].astype(str).str.replace("x","",case=False), errors="coerce")
-
-        mis_df = lev_df[lev_df["MIS"] >= 5][["Symbol"]].copy()
-        mis_df = mis_df[~mis_df["Symbol"].str.contains("BEES|ETF|CASE", case=False, na=False)]
-        mis_df = mis_df[~mis_df["Symbol"].isin(EXCLUDED_SYMBOLS)]
-
-        final_df = mis_df.merge(inst_df, on="Symbol", how="inner")
-        potential_sids = final_df["SECURITY_ID"].tolist()
-        sid_to_symbol_map = dict(zip(final_df['SECURITY_ID'], final_df['Symbol']))
-
-        print(f"🔍 Checking LTP for {len(potential_sids)} candidates...")
-        filtered_data = []
-        for i in range(0, len(potential_sids), 1000):
-            chunk = potential_sids[i:i+1000]
-            q_resp = requests.post("https://api.dhan.co/v2/marketfeed/ltp", headers=headers, json={"NSE_EQ": chunk}, timeout=10)
-            if q_resp.status_code == 200:
-                market_data = q_resp.json().get('data', {}).get('NSE_EQ', {})
-                for sid_key, details in market_data.items():
-                    ltp = details.get('last_price', 0)
-                    if 5 <= ltp <= 900:
-                        sid_int = int(sid_key)
-                        filtered_data.append({"SECURITY_ID": sid_int, "Symbol": sid_to_symbol_map.get(sid_int, "Unknown")})
-            time.sleep(1.2)
-
-        if filtered_data:
-            valid_df = pd.DataFrame(filtered_data)
-            ID_TO_SYMBOL = pd.Series(valid_df.Symbol.values, index=valid_df.SECURITY_ID).to_dict()
-            SIDS_LIST = valid_df["SECURITY_ID"].astype(str).tolist()
-            print(f"✅ Setup Complete: Subscribing to {len(SIDS_LIST)} stocks.")
-        else:
-            print("❌ No stocks matched criteria.")
 
-    except Exception as e:
-        print(f"❌ Error during setup: {e}")
+# Traded-value windows, each with its own threshold and cooldown. The
+# default is the single 5-minute window; more are opt-in, e.g. short ones to
+# catch fast bursts and long ones for sustained accumulation:
+#   VOL_WINDOWS="60:25:300,180:45:600,300:70:800,900:150:1800"
+# They all read the same per-stock prefix sums (FeedState.opening), so each
+# window costs one lookup per tick.
+VOL_WINDOWS = parse_windows(os.getenv("VOL_WINDOWS", f"300:{VOL_5MIN_THRESHOLD_CR:g}:{COOLDOWN_SECONDS}"))
+VOL_WINDOW_SECONDS = VOL_WINDOWS[-1].seconds
+# With a time-of-day baseline (volume_baseline.py, VOL_BASELINE_FILE) each
+# window's threshold becomes per stock and per 5-minute slot; the fixed
+# thresholds above stay for stocks the baseline does not cover.
+
 
 # ============================================================= #
 #                       FEED & ANALYTICS                        #
@@ -123,141 +83,131 @@ def send_telegram(msg):
     except Exception as e:
         print(f"❌ Telegram Connection Error: {e}")
         
-'''
-def process_volume(sec_id, ltp, cum_vol):
-    now = time.time()
-    if sec_id not in volume_history:
-        volume_history[sec_id] = deque()
 
-    volume_history[sec_id].append((now, cum_vol))
-    
-    # Keep only 5 mins of data
-    while volume_history[sec_id] and (now - volume_history[sec_id][0][0] > 300):
-        volume_history[sec_id].popleft()
-
-    if len(volume_history[sec_id]) > 1:
-        start_vol = volume_history[sec_id][0][1]
-        delta_qty = cum_vol - start_vol
-        traded_value_cr = (delta_qty * ltp) / CR_UNIT
-
-        if traded_value_cr >= VOL_5MIN_THRESHOLD_CR:
-            last_alert = alert_cooldowns.get(sec_id, 0)
-            
-            # CHECK COOLDOWN FIRST
-            if now - last_alert > COOLDOWN_SECONDS:
-                # UPDATE IMMEDIATELY to block near-simultaneous packets
-                alert_cooldowns[sec_id] = now 
-                
-                symbol = ID_TO_SYMBOL.get(sec_id, f"ID:{sec_id}")
-                qty = int((SIGNAL_AMOUNT * 5) // ltp)
-                msg = f"🔥VOLUME SPIKE\nStock: {symbol} QTY: {qty} \n*5-Min Vol:* ₹{traded_value_cr:.2f} Cr\n*Price:* {ltp}"
-                
-                print(f"Alert: {symbol} - {traded_value_cr:.2f} Cr")
-                threading.Thread(target=send_telegram, args=(msg,), daemon=True).start()
-'''
-
-def process_volume(sec_id, ltp, cum_vol):
-    now = time.time()
-    
-    # 1. Initialize history if new security
-    if sec_id not in volume_history:
-        volume_history[sec_id] = deque()
+def process_volume(state, limits, slot, ltp, ltt, cum_vol, now=None):
+    # 1-2. Record the tick in this stock's bucket ring (keyed on the exchange's
+    #      last-trade time) and read the value traded over the longest window
+    #      in one step
+    longest_cr = state.tick(slot, ltp, ltt, cum_vol) / CR_UNIT
+
+    # 3. Check for Spike: no shorter window can hold more than the longest
+    if longest_cr < limits.minimum:
+        return
+
+    now = now or time.time()
+    for which, window in enumerate(VOL_WINDOWS):
+        # 4. Evaluate each window's threshold (this stock, this time of day), shortest first
+        traded_value_cr = state.traded_value(slot, window.seconds) / CR_UNIT
+        if traded_value_cr >= limits.at(slot, ltt, which):
+            # 5. Check Cooldown (per window)
+            # --- CRITICAL FIX ---
+            # cool_down() moves the deadline IMMEDIATELY.
+            # This "closes the gate" for any other packets arriving
+            # while the Telegram message is still being prepared.
+            if state.cool_down(slot, now, window.cooldown_seconds, which):
+                mute_longer(state, slot, which, now)
+                send_volume_alert(state.symbols[slot], ltp, traded_value_cr, window.label,
+                                  partial=state.incomplete(slot, window.seconds))
+                return
+
+
+def mute_longer(state, slot, which, now):
+    """The longer windows hold the same burst; keep them quiet for this window's cooldown."""
+    until = now + VOL_WINDOWS[which].cooldown_seconds
+    row = state.cooldown_until[slot]
+    row[which + 1:] = row[which + 1:].clip(min=until)
+
+
+def evaluate_universe(state, limits, now=None):
+    """process_volume's threshold and cooldown checks for every stock ticked since the last call."""
+    slots = state.take_dirty()
+    if not len(slots):
+        return
+    slots = slots[state.window_values(slots) / CR_UNIT >= limits.minimum]
+    now = now or time.time()
+    for which, window in enumerate(VOL_WINDOWS):
+        if not len(slots):
+            return
+        traded_value_cr = state.window_values(slots, window.seconds) / CR_UNIT
+        hit = traded_value_cr >= limits.many(slots, state.ltt[slots], which)
+        value_of = dict(zip(slots[hit].tolist(), traded_value_cr[hit].tolist()))
+        fired = state.cool_down_many(slots[hit], now, window.cooldown_seconds, which)
+        for slot in fired.tolist():
+            mute_longer(state, slot, which, now)
+            send_volume_alert(state.symbols[slot], float(state.ltp[slot]), value_of[slot], window.label,
+                              partial=state.incomplete(slot, window.seconds))
+        # One alert per stock per pass, from its shortest spiking window.
+        slots = slots[~np.isin(slots, fired)]
+
+
+def send_volume_alert(symbol, ltp, traded_value_cr, label="5m", partial=False):
+    # Simple QTY calculation based on your SIGNAL_AMOUNT
+    qty = int((SIGNAL_AMOUNT * 5) // ltp)
+
+    msg = (
+        f"VOL SPIKE {label}- {symbol}, Qty: {qty}\n"
+        f"Vol: ₹{traded_value_cr:.2f} Cr"
+    )
+    if partial:
+        # The window spans a feed gap: the real value is at least this.
+        msg += "\nPartial window: feed gap"
+    print(f"🚀 Alert Triggered: {symbol} | {label} Vol: {traded_value_cr:.2f} Cr")
+    threading.Thread(target=send_telegram, args=(msg,), daemon=True).start()
+
+
+class VolumeSpikeAnalyzer(Analyzer):
+    """Traded-value spikes over VOL_WINDOWS; see process_volume / evaluate_universe."""
+
+    name = "volume"
+
+    def __init__(self, eval_ms=VOL_EVAL_MS):
+        self.interval_ms = eval_ms
+        self.state = self._new_state({})
+        self.limits = SpikeThresholds([(w.seconds, w.threshold_cr) for w in VOL_WINDOWS])
+        self.processed = 0
+
+    def _new_state(self, instruments):
+        # Per-stock prefix sums, one cooldown per window and last-tick state,
+        # one slot per stock. Its gate drops packets whose LTP..volume bytes
+        # match the previous one.
+        return self.state_factory(instruments, VOL_WINDOW_SECONDS, VOL_BUCKET_SECONDS, dhan_feed.VOLUME_REGION,
+                                  cooldowns=len(VOL_WINDOWS))
+
+    def start(self, instruments):
+        self.state = self._new_state(instruments)
+        self.limits = SpikeThresholds([(w.seconds, w.threshold_cr) for w in VOL_WINDOWS],
+                                      self.state.security_ids, VolumeBaseline.load())
+
+    def on_packet(self, slot, fields, packet):
+        state = self.state
+        if not state.changed(packet, 0, slot):
+            return
+        self.processed += 1
+        ltp, ltt, cum_vol = round(fields[4], 2), fields[5], fields[6]
+        if self.interval_ms:
+            state.tick(slot, ltp, ltt, cum_vol)
+        else:
+            process_volume(state, self.limits, slot, ltp, ltt, cum_vol, self.clock())
+
+    # Quote packets carry the same LTP..volume bytes, and FULL_TICK's first fields.
+    on_quote = on_packet
+
+    def add(self, instruments):
+        for sec_id, symbol in instruments.items():
+            self.state.assign(sec_id, symbol)
+        self.limits.set_securities(self.state.security_ids)
+
+    def on_timer(self):
+        evaluate_universe(self.state, self.limits, self.clock())
+
+    def describe(self):
+        return f"Processed: {self.processed} | {self.state.describe()} | {self.limits.describe()}"
 
-    # 2. Append current data point
-    volume_history[sec_id].append((now, cum_vol))
-    
-    # 3. Sliding Window: Keep only the last 5 minutes (300 seconds) of data
-    while volume_history[sec_id] and (now - volume_history[sec_id][0][0] > 300):
-        volume_history[sec_id].popleft()
-
-    # 4. Check for Spike
-    if len(volume_history[sec_id]) > 1:
-        start_vol = volume_history[sec_id][0][1]
-        delta_qty = cum_vol - start_vol
-        traded_value_cr = (delta_qty * ltp) / CR_UNIT
-
-        # 5. Evaluate Threshold
-        if traded_value_cr >= VOL_5MIN_THRESHOLD_CR:
-            last_alert_time = alert_cooldowns.get(sec_id, 0)
-            
-            # 6. Check Cooldown (500 seconds)
-            if now - last_alert_time > COOLDOWN_SECONDS:
-                
-                # --- CRITICAL FIX ---
-                # We update the dictionary IMMEDIATELY.
-                # This "closes the gate" for any other packets arriving 
-                # while the Telegram message is still being prepared.
-                alert_cooldowns[sec_id] = now 
-                # ---------------------
-
-                # 7. Prepare message details
-                symbol = ID_TO_SYMBOL.get(sec_id, f"ID:{sec_id}")
-                # Simple QTY calculation based on your SIGNAL_AMOUNT
-                qty = int((SIGNAL_AMOUNT * 5) // ltp)
-                
-                msg = (
-                    f"VOL SPIKE- {symbol}, Qty: {qty}\n"
-                    f"Vol: ₹{traded_value_cr:.2f} Cr"
-                )
-                print(f"🚀 Alert Triggered: {symbol} | Vol: {traded_value_cr:.2f} Cr")
-                threading.Thread(target=send_telegram, args=(msg,), daemon=True).start()
-
-
-def on_message(ws, message):
-    global packets_received
-    if isinstance(message, bytes) and message[0] == 8:
-        packets_received += 1
-        try:
-            # Correct Dhan offsets for Full Packet (Code 8)
-            sec_id = struct.unpack('<I', message[4:8])[0]
-            ltp = round(struct.unpack('<f', message[8:12])[0], 2)
-            # Volume usually starts at byte 22 or 23 for Code 8
-            cum_vol = struct.unpack('<I', message[22:26])[0] 
-            process_volume(sec_id, ltp, cum_vol)
-        except:
-            pass
-
-def heartbeat():
-    """Prints status every minute to keep GitHub Action logs alive."""
-    while True:
-        time.sleep(60)
-        print(f"💓 Heartbeat: {datetime.now(IST).strftime('%H:%M:%S')} | Packets Recv: {packets_received} | Monitoring: {len(SIDS_LIST)}")
-
-def run_ws():
-    auth_url = f"wss://api-feed.dhan.co?version=2&token={DHAN_ACCESS_TOKEN}&clientId={DHAN_CLIENT_ID}&authType=2"
-    
-    def on_open(ws):
-        print("🌐 WebSocket Connected. Subscribing to instruments...")
-        for i in range(0, len(SIDS_LIST), 100):
-            chunk = SIDS_LIST[i:i+100]
-            sub_data = {
-                "RequestCode": 21,
-                "InstrumentCount": len(chunk),
-                "InstrumentList": [{"ExchangeSegment": "NSE_EQ", "SecurityId": s} for s in chunk]
-            }
-            ws.send(json.dumps(sub_data))
-
-    ws = websocket.WebSocketApp(auth_url, on_message=on_message, on_open=on_open)
-    ws.run_forever()
 
 if __name__ == "__main__":
-    print(f"🎬 Script Started at {datetime.now(IST)}")
-    threading.Thread(target=heartbeat, daemon=True).start()
-    
-    # Loop until we actually find stocks or market closes
-    while not SIDS_LIST:
-        fetch_and_build_list()
-        if not SIDS_LIST:
-            print("Refetching in 30 seconds...")
-            time.sleep(30)
-
-    # Now enter the WebSocket loop
-    while True:
-        if datetime.now(IST).time() > datetime.strptime("15:30:00", "%H:%M:%S").time():
-            print("🏁 Market Closed. Exiting script.")
-            break
-        try:
-            run_ws()
-        except Exception as e:
-            print(f"⚠️ Socket error: {e}. Reconnecting...")
-            time.sleep(5)
+    from feed_workers import FEED_WORKERS, run_sharded
+
+    if FEED_WORKERS > 1:
+        run_sharded([VolumeSpikeAnalyzer])
+    else:
+        run_hub([VolumeSpikeAnalyzer()])
@@ -0,0 +1,259 @@
+"""
+Soak test: the real FeedHub and analyzers against dhan_feed_standin.py.
+
+Each stage starts the stand-in in its own process at one packet rate, runs
+a FeedHub with VolumeSpikeAnalyzer and BigOrderAnalyzer against it for a
+simulated session of --stage-seconds (DaySchedule closing at the end of the
+stage, so run_async shuts down exactly as it does at 15:30), then reports:
+
+    offered / received    packets/s the stand-in sent vs frames the hub read
+    lost                  frames sent but never read (in flight at a disconnect)
+    reconnects            reconnects the hub made; the resume (reconnect -> first
+                          frame) and gap (drop -> first frame) times are in timings
+    queue                 FrameQueue overflows and frames dropped/coalesced
+    alert latency         planted event sent -> send_telegram called (p50/p95/max)
+    missed                planted events with no alert
+    rss                   resident memory at the end of the stage and growth since the first
+
+The highest stage with nothing lost or dropped, no overflow, every planted
+event alerted and the stand-in offering >= 98% of the target rate is the
+max sustainable rate.
+
+    python soak_feed.py --rates 5000,10000,20000,40000 --stage-seconds 30
+    python soak_feed.py --rates 10000 --stage-seconds 300 --disconnect-every 60 --burst-every 20
+    python soak_feed.py --rates 10000 --quiet-mode quote --tier-review-seconds 5
+
+Telegram is never called; alerts are only timed.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SIGNAL_AMOUNT", "100000")
+
+import dhan_feed_hub
+import dhan_streamer_order_book
+import nse_data
+from dhan_feed_hub import FeedHub
+from dhan_feed_standin import LOCAL_FEED_URL, synthetic_universe
+from feed_subscriptions import TIER_REVIEW_SECONDS
+from market_calendar import IST_ZONE, DaySchedule, Session
+
+
+SYMBOL = re.compile(r"SYM(\d+)")
+ALERTS = []
+ALERTS_LOCK = threading.Lock()
+
+
+def record_alert(msg):
+    now = time.time_ns()
+    match = SYMBOL.search(msg)
+    with ALERTS_LOCK:
+        ALERTS.append((now, int(match.group(1)) if match else None, msg))
+
+
+nse_data.send_telegram = dhan_streamer_order_book.send_telegram = record_alert
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Stand-in did not start on port {port}")
+
+
+def stage_schedule(seconds: float) -> DaySchedule:
+    """A session that opened a moment ago and closes after `seconds`."""
+    now = datetime.now(IST_ZONE)
+    session = Session(now.date(), now - timedelta(seconds=2), now - timedelta(seconds=1),
+                      now + timedelta(seconds=seconds), "Soak")
+    return DaySchedule(now.date(), session, None)
+
+
+def read_report(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_stage(rate, args, universe, baseline_rss):
+    port = free_port()
+    report_path = os.path.join(tempfile.mkdtemp(prefix="soak-"), "standin.jsonl")
+    cmd = [sys.executable, "dhan_feed_standin.py", "--port", str(port),
+           "--instruments", str(args.instruments), "--seed", str(args.seed), "--rate", str(rate),
+           "--packets-per-frame", str(args.packets_per_frame),
+           "--disconnect-every", str(args.disconnect_every), "--burst-every", str(args.burst_every),
+           "--burst-factor", str(args.burst_factor), "--burst-seconds", str(args.burst_seconds),
+           "--plant-every", str(args.plant_every), "--report", report_path]
+    standin = subprocess.Popen(cmd, stderr=subprocess.DEVNULL if not args.verbose else None)
+    try:
+        wait_for_port(port)
+        dhan_feed_hub.FEED_URL = LOCAL_FEED_URL.format(port=port)
+        hub = FeedHub([nse_data.VolumeSpikeAnalyzer(args.vol_eval_ms),
+                       dhan_streamer_order_book.BigOrderAnalyzer(args.depth_batch_ms)],
+                      "soak", "soak", connections=args.connections,
+                      queue_frames=args.queue_frames, queue_policy=args.queue_policy, capture_dir="",
+                      quiet_mode=args.quiet_mode, checkpoint_file=args.checkpoint_file)
+        hub.subscriptions.review_seconds = args.tier_review_seconds
+        hub.start(universe)
+        with ALERTS_LOCK:
+            ALERTS.clear()
+        started = time.monotonic()
+        schedule = stage_schedule(args.stage_seconds)
+        asyncio.run(hub.run_async(schedule))
+        # Let queue workers and timers finish what was already received.
+        time.sleep(0.5)
+        for analyzer in hub.analyzers:
+            if analyzer.interval_ms:
+                analyzer.on_timer()
+        elapsed = time.monotonic() - started
+        print(hub.describe())
+        hub.metrics.roll()
+    finally:
+        standin.terminate()
+        standin.wait(10)
+
+    events = read_report(report_path)
+    summary = next((e for e in events if e["event"] == "summary"), {})
+    # Events planted in the last second may never reach the hub before it closes.
+    cutoff_ns = (schedule.stop_at.timestamp() - 1) * 1e9
+    plants = [e for e in events if e["event"] == "plant" and e["sent_ns"] <= cutoff_ns]
+    sent_frames = sum(e["frames"] for e in events if e["event"] == "closed")
+    sent_packets = sum(e["packets"] for e in events if e["event"] == "closed")
+    # Rate while subscribed: connection-seconds spread over the hub's shards (reconnect pauses excluded).
+    subscribed_seconds = sum(e["seconds"] for e in events if e["event"] == "closed") / max(1, len(hub.shards))
+    offered = sent_packets / subscribed_seconds if subscribed_seconds else 0.0
+    received = sum(conn.frames for conn in hub.shards)
+    queues = [conn.queue for conn in hub.shards if conn.queue is not None]
+
+    with ALERTS_LOCK:
+        alerts = list(ALERTS)
+    first_alert = {}
+    for ts, sid, _msg in alerts:
+        first_alert.setdefault(sid, ts)
+    latencies = [(first_alert[p["sid"]] - p["sent_ns"]) / 1e6 for p in plants if p["sid"] in first_alert]
+    planted_sids = {e["sid"] for e in events if e["event"] == "plant"}
+
+    gc.collect()
+    rss = rss_mb()
+    return {
+        "rate": rate,
+        "seconds": round(elapsed, 2),
+        "offered_pps": offered,
+        "sent_packets": sent_packets,
+        "received_fps": received / subscribed_seconds if subscribed_seconds else 0.0,
+        "sent_frames": sent_frames,
+        "received_frames": received,
+        "lost_frames": max(0, sent_frames - received),
+        "packets_decoded": hub.state.seen,
+        "overflows": sum(q.overflows for q in queues),
+        "dropped_frames": sum(q.dropped for q in queues),
+        "coalesced_packets": sum(q.coalesced for q in queues),
+        "queue_high_water": max((q.high_water for q in queues), default=0),
+        "promoted": hub.subscriptions.promoted,
+        "demoted": hub.subscriptions.demoted,
+        "disconnects": summary.get("disconnects", 0),
+        "reconnects": sum(conn.reconnects for conn in hub.shards),
+        "connections": summary.get("connections", 0),
+        "errors": hub.errors,
+        "planted": len(plants),
+        "missed": sum(1 for p in plants if p["sid"] not in first_alert),
+        "unplanted_alerts": len(set(first_alert) - planted_sids),
+        "latency_ms_p50": percentile(latencies, 50) if latencies else None,
+        "latency_ms_p95": percentile(latencies, 95) if latencies else None,
+        "latency_ms_max": max(latencies) if latencies else None,
+        "rss_mb": rss,
+        "rss_growth_mb": rss - baseline_rss,
+        "timings": hub.metrics.snapshot()["session"],
+    }
+
+
+def sustainable(stage, target) -> bool:
+    return (stage["lost_frames"] == 0 and stage["dropped_frames"] == 0 and stage["overflows"] == 0
+            and stage["missed"] == 0 and stage["offered_pps"] >= 0.98 * target)
+
+
+def fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak the feed hub against the local Dhan stand-in")
+    parser.add_argument("--rates", default="5000,10000,20000,40000", help="packets/s per stage")
+    parser.add_argument("--stage-seconds", type=float, default=30)
+    parser.add_argument("--instruments", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--packets-per-frame", type=int, default=1)
+    parser.add_argument("--connections", type=int, default=dhan_feed_hub.FEED_CONNECTIONS)
+    parser.add_argument("--queue-frames", type=int, default=dhan_feed_hub.FEED_QUEUE_FRAMES)
+    parser.add_argument("--queue-policy", default=dhan_feed_hub.FEED_QUEUE_POLICY)
+    parser.add_argument("--vol-eval-ms", type=int, default=nse_data.VOL_EVAL_MS)
+    parser.add_argument("--depth-batch-ms", type=int, default=dhan_streamer_order_book.DEPTH_BATCH_MS)
+    parser.add_argument("--disconnect-every", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=float, default=0.0)
+    parser.add_argument("--burst-factor", type=float, default=3.0)
+    parser.add_argument("--burst-seconds", type=float, default=2.0)
+    parser.add_argument("--plant-every", type=float, default=2.0)
+    parser.add_argument("--quiet-mode", default="full", help="full, or quote for subscription tiers")
+    parser.add_argument("--tier-review-seconds", type=float, default=TIER_REVIEW_SECONDS)
+    parser.add_argument("--checkpoint-file", default="", help="checkpoint the analyzers here during each stage")
+    parser.add_argument("--json", help="write every stage's results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the stand-in's log")
+    args = parser.parse_args()
+
+    universe = synthetic_universe(args.instruments, args.seed)
+    baseline = rss_mb()
+    stages = []
+    for rate in (float(r) for r in args.rates.split(",")):
+        print(f"\n▶️ Stage: {rate:,.0f} packets/s for {args.stage_seconds:.0f}s")
+        stage = run_stage(rate, args, universe, baseline)
+        stage["sustainable"] = sustainable(stage, rate)
+        stages.append(stage)
+
+    print(f"\n{'rate':>8} {'offered':>9} {'recv f/s':>9} {'lost':>6} {'ovfl':>5} {'drop':>6} {'coal':>7} "
+          f"{'disc':>5} {'alerts':>7} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'rss MB':>7} {'+MB':>6}  ok")
+    for s in stages:
+        print(f"{s['rate']:8,.0f} {s['offered_pps']:9,.0f} {s['received_fps']:9,.0f} {s['lost_frames']:6} "
+              f"{s['overflows']:5} {s['dropped_frames']:6} {s['coalesced_packets']:7} {s['disconnects']:5} "
+              f"{s['planted'] - s['missed']:>3}/{s['planted']:<3} {fmt(s['latency_ms_p50'], '7.1f')} "
+              f"{fmt(s['latency_ms_p95'], '7.1f')} {fmt(s['latency_ms_max'], '7.1f')} "
+              f"{s['rss_mb']:7.1f} {s['rss_growth_mb']:6.1f}  {'✅' if s['sustainable'] else '❌'}")
+    ok = [s["rate"] for s in stages if s["sustainable"]]
+    print(f"\nMax sustainable rate: {max(ok):,.0f} packets/s" if ok else "\nNo stage was sustainable.")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "stages": stages}, f, indent=2)
@@ -0,0 +1,312 @@
+"""
+Time-of-day traded-value baseline for the volume spike analyzer.
+
+A fixed crore threshold flags the same large caps every morning and never
+fires on a small cap trading ten times its usual value. This module builds,
+offline, the median and median absolute deviation (MAD) of the value each
+security trades in every 5-minute slot of the session (09:15-15:30, 75
+slots) over its last N sessions, and stores them in one .npy file of
+BASELINE_DTYPE rows:
+
+    sid      security id
+    median   (75,) float32, Cr traded in that slot on a typical day
+    mad      (75,) float32, Cr
+    sessions number of sessions behind the row
+
+At about 600 bytes per security the file is mapped read-only at startup
+(np.load(mmap_mode="r")). SpikeThresholds then folds it and the spike
+windows into one (slot, time-of-day slot, window) table, so the check on
+each tick is one flat index:
+
+    expected = sum of the medians of the slots the window covers
+               (the current slot and as many before it as fit; the
+               oldest, or a window shorter than 5 min, pro rata)
+    spread = sqrt(sum over the same slots of mad^2, same weights)
+    threshold = max(window.threshold_cr * VOL_RVOL_FLOOR,     # never below a floor
+                    VOL_RVOL_MULT * expected,                 # relative volume
+                    expected + VOL_RVOL_Z * 1.4826 * spread)
+
+so a 15-minute window at 09:25 expects the opening slots' value, not three
+times the 09:25 slot's.
+
+Securities without a baseline row keep the fixed window thresholds.
+
+Build from captured feed segments (feed_capture.py) and/or 5-minute candles
+(CSV with security_id, timestamp, close, volume; timestamps in IST):
+
+    python volume_baseline.py build --captures "captures/feed-*.bin" --sessions 20
+    python volume_baseline.py build --candles candles.csv --out volume_baseline.npy
+    python volume_baseline.py show 2885
+"""
+import argparse
+import glob
+import os
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+import dhan_feed
+from feed_metrics import FEED_LTT_OFFSET_SECONDS
+from market_calendar import MARKET_CLOSE_IST, MARKET_OPEN_IST
+
+
+SLOT_SECONDS = 300
+IST_OFFSET_SECONDS = 19800
+OPEN_SECONDS = MARKET_OPEN_IST.hour * 3600 + MARKET_OPEN_IST.minute * 60
+N_SLOTS = ((MARKET_CLOSE_IST.hour * 3600 + MARKET_CLOSE_IST.minute * 60) - OPEN_SECONDS) // SLOT_SECONDS
+CR_UNIT = 10_000_000
+MAD_TO_SIGMA = 1.4826
+
+BASELINE_FILE = os.getenv("VOL_BASELINE_FILE", "volume_baseline.npy")
+BASELINE_SESSIONS = int(os.getenv("VOL_BASELINE_SESSIONS", 20))
+VOL_RVOL_MULT = float(os.getenv("VOL_RVOL_MULT", 4))
+VOL_RVOL_Z = float(os.getenv("VOL_RVOL_Z", 6))
+VOL_RVOL_FLOOR = float(os.getenv("VOL_RVOL_FLOOR", 0.1))   # of each window's fixed threshold
+
+BASELINE_DTYPE = np.dtype([
+    ("sid", "<u4"),
+    ("median", "<f4", (N_SLOTS,)),
+    ("mad", "<f4", (N_SLOTS,)),
+    ("sessions", "<u2"),
+])
+
+
+def day_slot(ltt: int, offset_seconds: int = FEED_LTT_OFFSET_SECONDS) -> Tuple[int, int]:
+    """(IST day number, 5-minute slot) of a feed LTT; pre-open counts as slot 0, after close as the last."""
+    return (ltt - offset_seconds + IST_OFFSET_SECONDS) // 86400, tod_slot(ltt, offset_seconds)
+
+
+def tod_slot(ltt: int, offset_seconds: int = FEED_LTT_OFFSET_SECONDS) -> int:
+    slot = ((ltt - offset_seconds + IST_OFFSET_SECONDS) % 86400 - OPEN_SECONDS) // SLOT_SECONDS
+    return min(N_SLOTS - 1, max(0, slot))
+
+
+# --------------------------------------------------------------------------
+# Per-session slot values
+# --------------------------------------------------------------------------
+Sessions = Dict[int, Dict[int, np.ndarray]]     # IST day number -> sid -> (N_SLOTS,) Cr
+
+
+def sessions_from_captures(paths: Iterable[str]) -> Sessions:
+    """Traded value per slot from recorded full packets (volume increase x LTP, as the analyzer counts it)."""
+    from feed_capture import iter_capture
+
+    sessions: Sessions = defaultdict(dict)
+    last_vol: Dict[Tuple[int, int], int] = {}
+    for _ts, frame in iter_capture(paths):
+        for _c, _l, _s, sid, ltp, ltt, cum_vol in dhan_feed.full_packets(frame, dhan_feed.FULL_VOLUME):
+            if ltt <= 0:
+                continue
+            day, slot = day_slot(ltt)
+            prev = last_vol.get((day, sid))
+            last_vol[(day, sid)] = max(cum_vol, prev or 0)
+            if prev is None or cum_vol <= prev:
+                continue
+            row = sessions[day].get(sid)
+            if row is None:
+                row = sessions[day][sid] = np.zeros(N_SLOTS)
+            row[slot] += (cum_vol - prev) * ltp / CR_UNIT
+    return sessions
+
+
+def sessions_from_candles(path: str) -> Sessions:
+    """Traded value per slot from 5-minute candles (security_id, timestamp in IST, close, volume)."""
+    import pandas as pd
+
+    df = pd.read_csv(path, usecols=["security_id", "timestamp", "close", "volume"])
+    ts = pd.to_datetime(df["timestamp"])
+    seconds = ts.dt.hour * 3600 + ts.dt.minute * 60 + ts.dt.second
+    df["slot"] = ((seconds - OPEN_SECONDS) // SLOT_SECONDS).clip(0, N_SLOTS - 1)
+    df["day"] = (ts.dt.normalize() - pd.Timestamp("1970-01-01")).dt.days
+    df["value"] = df["close"] * df["volume"] / CR_UNIT
+    sessions: Sessions = defaultdict(dict)
+    for (day, sid), group in df.groupby(["day", "security_id"]):
+        row = np.zeros(N_SLOTS)
+        np.add.at(row, group["slot"].to_numpy(), group["value"].to_numpy())
+        sessions[int(day)][int(sid)] = row
+    return sessions
+
+
+def merge_sessions(*parts: Sessions) -> Sessions:
+    merged: Sessions = defaultdict(dict)
+    for part in parts:
+        for day, rows in part.items():
+            merged[day].update(rows)
+    return merged
+
+
+# --------------------------------------------------------------------------
+# Baseline file
+# --------------------------------------------------------------------------
+def build(sessions: Sessions, n_sessions: int = BASELINE_SESSIONS) -> np.ndarray:
+    """
+    BASELINE_DTYPE rows from the last `n_sessions` days in `sessions`. A
+    security missing from one of those days traded nothing that day.
+    """
+    days = sorted(sessions)[-n_sessions:]
+    sids = sorted({sid for day in days for sid in sessions[day]})
+    out = np.zeros(len(sids), dtype=BASELINE_DTYPE)
+    zeros = np.zeros(N_SLOTS)
+    for i, sid in enumerate(sids):
+        values = np.stack([sessions[day].get(sid, zeros) for day in days])
+        median = np.median(values, axis=0)
+        out[i]["sid"] = sid
+        out[i]["median"] = median
+        out[i]["mad"] = np.median(np.abs(values - median), axis=0)
+        out[i]["sessions"] = len(days)
+    return out
+
+
+def save(path: str, rows: np.ndarray) -> None:
+    tmp = f"{path}.tmp.npy"
+    np.save(tmp, rows)
+    os.replace(tmp, path)
+
+
+class VolumeBaseline:
+    """A baseline file mapped read-only; row_of maps security id -> row."""
+
+    def __init__(self, path: str = BASELINE_FILE):
+        self.path = path
+        self.rows = np.load(path, mmap_mode="r")
+        if self.rows.dtype != BASELINE_DTYPE:
+            raise ValueError(f"{path} is not a volume baseline ({self.rows.dtype})")
+        self.row_of = {int(sid): i for i, sid in enumerate(self.rows["sid"])}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def load(cls, path: str = BASELINE_FILE, log=print) -> Optional["VolumeBaseline"]:
+        """The baseline at `path`, or None (fixed thresholds) if it is missing or unreadable."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            baseline = cls(path)
+        except (OSError, ValueError) as e:
+            log(f"⚠️ Ignoring volume baseline {path}: {e}")
+            return None
+        log(f"📊 Volume baseline: {len(baseline)} stocks from {path}")
+        return baseline
+
+
+def window_sums(values: np.ndarray, seconds: int) -> np.ndarray:
+    """
+    (n, N_SLOTS) sums of `values` (n, N_SLOTS) over the `seconds` ending
+    with each slot: whole slots back from it, the oldest pro rata, nothing
+    before the open.
+    """
+    n_slots = values.shape[1]
+    cum = np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)    # (n, S + 1)
+    end = np.arange(1, n_slots + 1)
+    start = np.maximum(0.0, end - seconds / SLOT_SECONDS)
+    lo = start.astype(np.int64)
+    frac = start - lo
+    at_start = cum[:, lo] + frac * values[:, np.minimum(lo, n_slots - 1)]
+    return cum[:, end] - at_start
+
+
+class SpikeThresholds:
+    """
+    Threshold (Cr) per FeedState slot, time-of-day slot and spike window,
+    precomputed from the baseline so the per-tick check is one lookup:
+    at(slot, ltt, which).
+    """
+
+    def __init__(self, windows: Sequence[Tuple[int, float]], security_ids: Sequence[int] = (),
+                 baseline: Optional[VolumeBaseline] = None, mult: float = VOL_RVOL_MULT,
+                 z: float = VOL_RVOL_Z, floor: float = VOL_RVOL_FLOOR):
+        self.windows = [(int(seconds), float(threshold_cr)) for seconds, threshold_cr in windows]
+        self.baseline = baseline
+        self.mult, self.z, self.floor = mult, z, floor
+        self.fixed = np.array([threshold_cr for _s, threshold_cr in self.windows], dtype=np.float32)
+        self.table = np.empty((0, N_SLOTS, len(self.windows)), dtype=np.float32)
+        self.covered = 0
+        self.set_securities(security_ids)
+
+    def set_securities(self, security_ids: Sequence[int]) -> None:
+        """(Re)build the table for FeedState slots 0..n-1 holding `security_ids`."""
+        table = np.empty((max(1, len(security_ids)), N_SLOTS, len(self.windows)), dtype=np.float32)
+        table[:] = self.fixed
+        self.covered = 0
+        if self.baseline is not None and len(security_ids):
+            rows = np.array([self.baseline.row_of.get(int(sid), -1) for sid in security_ids])
+            have = np.flatnonzero(rows >= 0)
+            self.covered = len(have)
+            if len(have):
+                table[have] = self._from_baseline(self.baseline.rows[rows[have]])
+        self.table = table
+        self._flat = memoryview(table.reshape(-1))
+        self.minimum = float(table.min()) if table.size else 0.0
+
+    def _from_baseline(self, rows: np.ndarray) -> np.ndarray:
+        median = rows["median"].astype(np.float64)                                     # (n, S)
+        variance = rows["mad"].astype(np.float64) ** 2
+        expected = np.stack([window_sums(median, seconds) for seconds, _t in self.windows], axis=2)   # (n, S, W)
+        spread = MAD_TO_SIGMA * np.sqrt(np.stack([window_sums(variance, seconds)
+                                                  for seconds, _t in self.windows], axis=2))
+        return np.maximum.reduce([
+            np.broadcast_to(self.fixed * self.floor, expected.shape),
+            self.mult * expected,
+            expected + self.z * spread,
+        ]).astype(np.float32)
+
+    def at(self, slot: int, ltt: int, which: int) -> float:
+        return self._flat[(slot * N_SLOTS + tod_slot(ltt)) * len(self.windows) + which]
+
+    def many(self, slots: np.ndarray, ltts: np.ndarray, which: int) -> np.ndarray:
+        tods = np.clip((ltts - FEED_LTT_OFFSET_SECONDS + IST_OFFSET_SECONDS) % 86400 - OPEN_SECONDS,
+                       0, None) // SLOT_SECONDS
+        return self.table[slots, np.minimum(tods, N_SLOTS - 1), which]
+
+    def describe(self) -> str:
+        if self.baseline is None:
+            return "fixed thresholds"
+        return f"baseline {self.covered}/{len(self.table)}"
+
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+def _slot_label(slot: int) -> str:
+    start = OPEN_SECONDS + slot * SLOT_SECONDS
+    return f"{start // 3600:02d}:{start % 3600 // 60:02d}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the time-of-day volume baseline")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build")
+    b.add_argument("--captures", action="append", default=[], help="capture segments (globs allowed)")
+    b.add_argument("--candles", action="append", default=[], help="5-minute candle CSVs")
+    b.add_argument("--sessions", type=int, default=BASELINE_SESSIONS)
+    b.add_argument("--out", default=BASELINE_FILE)
+    s = sub.add_parser("show")
+    s.add_argument("sid", type=int)
+    s.add_argument("--file", default=BASELINE_FILE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = sorted(p for pattern in args.captures for p in glob.glob(pattern))
+        parts = [sessions_from_captures(paths)] if paths else []
+        parts += [sessions_from_candles(path) for path in args.candles]
+        sessions = merge_sessions(*parts)
+        if not sessions:
+            raise SystemExit("No sessions found; pass --captures and/or --candles.")
+        rows = build(sessions, args.sessions)
+        save(args.out, rows)
+        days = sorted(sessions)[-args.sessions:]
+        first, last = (date.fromordinal(date(1970, 1, 1).toordinal() + d) for d in (days[0], days[-1]))
+        print(f"✅ {len(rows)} stocks x {N_SLOTS} slots from {len(days)} sessions ({first} .. {last}) "
+              f"-> {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+    else:
+        baseline = VolumeBaseline(args.file)
+        i = baseline.row_of.get(args.sid)
+        if i is None:
+            raise SystemExit(f"{args.sid} is not in {args.file}")
+        row = baseline.rows[i]
+        print(f"{args.sid}: {row['sessions']} sessions")
+        for slot in range(N_SLOTS):
+            print(f"  {_slot_label(slot)}  median {row['median'][slot]:8.2f} Cr  mad {row['mad'][slot]:7.2f} Cr")